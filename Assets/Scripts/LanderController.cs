@@ -102,7 +102,7 @@ public class LanderController : MonoBehaviour {
             agentController.EndEpisode(0f);
         }
 
-        SendPosition(position.x+1000f, position.y, position.z+1000f);
+        SendPosition(position.x+1000f, position.y, position.z+1000f, velocity);
 
         int[] safetyMapData = udpSocket.GetSafetyMapData();
         int[] centroid = udpSocket.GetCentroidData();
@@ -254,9 +254,8 @@ public class LanderController : MonoBehaviour {
         targetY = transform.localPosition.z + Random.Range(-randomPositionTarget, randomPositionTarget);
     }
 
-    private void SendPosition(float posX, float posY, float posZ) {
-        string message = posX.ToString() + "," + posY.ToString() + "," + posZ.ToString();
-        udpSocket.SendData(message);
+    private void SendPosition(float posX, float posY, float posZ, Vector3 velocity) {
+        udpSocket.SendPosition(posX, posY, posZ, velocity);
     }
 
     private float GetAltitude() {
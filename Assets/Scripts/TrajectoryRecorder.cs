@@ -0,0 +1,56 @@
+using System.Globalization;
+using System.IO;
+using UnityEngine;
+
+// Records the training lander's state every FixedUpdate for the parity check of LanderEnv.py
+// (python LanderEnv.py parity <file>). Add it next to TrainingLanderController.
+public class TrajectoryRecorder : MonoBehaviour {
+
+    [SerializeField] private string outputPath = "unity_trajectories.csv";
+    [SerializeField] private int maxRows = 200000;
+
+    private TrainingLanderController landerController;
+    private TrainingAgentController agentController;
+    private StreamWriter writer;
+    private int rows;
+
+    void Start() {
+        landerController = GetComponent<TrainingLanderController>();
+        agentController = GetComponent<TrainingAgentController>();
+        writer = new StreamWriter(outputPath, false);
+        writer.WriteLine("episode,step,altitude,px,pz,tx,tz,rx,ry,rz,vx,vy,vz,wx,wy,wz,a0,a1,a2,reward");
+    }
+
+    void FixedUpdate() {
+        if (writer == null || rows >= maxRows)
+            return;
+
+        Vector3 position = landerController.GetPosition();
+        Vector2 target = landerController.GetTarget();
+        Vector3 rotation = landerController.GetRotation();
+        Vector3 velocity = landerController.GetVelocity();
+        Vector3 angularVelocity = landerController.GetAngularVelocity();
+        var actions = agentController.GetStoredActionBuffers().DiscreteActions;
+
+        float[] values = {
+            position.y, position.x, position.z, target.x, target.y,
+            rotation.x, rotation.y, rotation.z,
+            velocity.x, velocity.y, velocity.z,
+            angularVelocity.x, angularVelocity.y, angularVelocity.z
+        };
+        string line = agentController.CompletedEpisodes + "," + agentController.StepCount;
+        foreach (float value in values)
+            line += "," + value.ToString("R", CultureInfo.InvariantCulture);
+        line += "," + actions[0] + "," + actions[1] + "," + actions[2];
+        line += "," + agentController.GetCumulativeReward().ToString("R", CultureInfo.InvariantCulture);
+        writer.WriteLine(line);
+        rows++;
+    }
+
+    void OnDestroy() {
+        if (writer != null) {
+            writer.Close();
+            writer = null;
+        }
+    }
+}
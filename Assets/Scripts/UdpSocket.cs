@@ -1,6 +1,7 @@
 using UnityEngine;
 using System.Collections;
 using System;
+using System.Buffers.Binary;
 using System.Text;
 using System.Net;
 using System.Net.Sockets;
@@ -14,6 +15,21 @@ public class UdpSocket : MonoBehaviour
     [SerializeField] string IP = "127.0.0.1"; // local host
     [SerializeField] int rxPort = 8000; // port to receive data from Python on
     [SerializeField] int txPort = 8001; // port to send data to Python on
+    [SerializeField] bool binaryProtocol = true; // send packed positions and receive packed safety maps (see SafetyProtocol.py)
+    [SerializeField] bool sendVelocity = true; // append the velocity to positions so the server can prefetch the next FOVs (text: needs a server that parses it)
+
+    // Binary protocol constants, must match SafetyProtocol.py
+    const byte PROTOCOL_VERSION = 1;
+    const byte MSG_POSITION = 1;
+    const byte MSG_SAFETY_MAP = 2;
+    const byte ENCODING_BITPACKED = 0;
+    const byte ENCODING_RLE = 1;
+    const int HEADER_SIZE = 16; // magic (2) | version (1) | type (1) | sequence (4) | timestamp us (8)
+    const int SAFETY_MAP_HEADER_SIZE = 22; // cx, cy, global_cx, global_cy (4x4) | width, height (2x2) | encoding (1) | site count (1)
+    const int SITE_SIZE = 16; // cx, cy (2x2) | global_cx, global_cy (2x4) | clearance radius (4)
+
+    private uint txSequence = 0;
+    private readonly byte[] positionBuffer = new byte[HEADER_SIZE + 24]; // position, optionally followed by the velocity
 
     // Variables to store received data
     private int[] safetyMapData;
@@ -21,6 +37,8 @@ public class UdpSocket : MonoBehaviour
     private int cy;
     private int global_cx;
     private int global_cy;
+    private uint replySequence; // sequence number of the position message the last reply answers
+    private float[] landingSites = new float[0]; // ranked candidates, 5 values each: cx, cy, global_cx, global_cy, clearance
 
     // Create necessary UdpClient objects
     UdpClient client;
@@ -38,6 +56,61 @@ public class UdpSocket : MonoBehaviour
         }
     }
 
+    // Send the lander position as three packed floats (or "x,y,z" text when binaryProtocol is off)
+    public void SendPosition(float posX, float posY, float posZ) {
+        SendPosition(posX, posY, posZ, null);
+    }
+
+    // Send the position followed by the velocity (three more floats, or ";vx,vy,vz" in text) when sendVelocity is on
+    public void SendPosition(float posX, float posY, float posZ, Vector3? velocity) {
+        bool withVelocity = sendVelocity && velocity.HasValue;
+        if (!binaryProtocol) {
+            string message = posX.ToString() + "," + posY.ToString() + "," + posZ.ToString();
+            if (withVelocity) {
+                Vector3 v = velocity.Value;
+                message += ";" + v.x.ToString() + "," + v.y.ToString() + "," + v.z.ToString();
+            }
+            SendData(message);
+            return;
+        }
+
+        try {
+            WriteHeader(positionBuffer, MSG_POSITION, txSequence++);
+            WriteFloat(positionBuffer, HEADER_SIZE, posX);
+            WriteFloat(positionBuffer, HEADER_SIZE + 4, posY);
+            WriteFloat(positionBuffer, HEADER_SIZE + 8, posZ);
+            int length = HEADER_SIZE + 12;
+            if (withVelocity) {
+                Vector3 v = velocity.Value;
+                WriteFloat(positionBuffer, HEADER_SIZE + 12, v.x);
+                WriteFloat(positionBuffer, HEADER_SIZE + 16, v.y);
+                WriteFloat(positionBuffer, HEADER_SIZE + 20, v.z);
+                length += 12;
+            }
+            client.Send(positionBuffer, length, remoteEndPoint);
+        }
+        catch (Exception err) {
+            print(err.ToString());
+        }
+    }
+
+    private static void WriteFloat(byte[] buffer, int offset, float value) {
+        BinaryPrimitives.WriteInt32LittleEndian(new Span<byte>(buffer, offset, 4), BitConverter.SingleToInt32Bits(value));
+    }
+
+    private static void WriteHeader(byte[] buffer, byte msgType, uint sequence) {
+        buffer[0] = (byte)'L';
+        buffer[1] = (byte)'L';
+        buffer[2] = PROTOCOL_VERSION;
+        buffer[3] = msgType;
+        BinaryPrimitives.WriteUInt32LittleEndian(new Span<byte>(buffer, 4, 4), sequence);
+        BinaryPrimitives.WriteInt64LittleEndian(new Span<byte>(buffer, 8, 8), DateTimeOffset.UtcNow.ToUnixTimeMilliseconds() * 1000);
+    }
+
+    private static bool IsBinary(byte[] data) {
+        return data.Length >= HEADER_SIZE && data[0] == (byte)'L' && data[1] == (byte)'L';
+    }
+
     void Awake() {
         // Create remote endpoint (to Matlab) 
         remoteEndPoint = new IPEndPoint(IPAddress.Parse(IP), txPort);
@@ -63,9 +136,14 @@ public class UdpSocket : MonoBehaviour
             try {
                 IPEndPoint anyIP = new IPEndPoint(IPAddress.Any, 0);
                 byte[] data = client.Receive(ref anyIP);
-                string text = Encoding.UTF8.GetString(data);
-                // print(">> " + text);
-                ProcessInput(text);
+                if (IsBinary(data)) {
+                    ProcessBinaryInput(data);
+                }
+                else {
+                    string text = Encoding.UTF8.GetString(data);
+                    // print(">> " + text);
+                    ProcessInput(text);
+                }
             }
             catch (Exception err) {
                 print(err.ToString());
@@ -88,6 +166,16 @@ public class UdpSocket : MonoBehaviour
         global_cx = int.Parse(dataArray[3]);
         global_cy = int.Parse(dataArray[4]);
 
+        // Optional ranked landing site candidates, sent as "@cx,cy,global_cx,global_cy,clearance" fields
+        var sites = new System.Collections.Generic.List<float>();
+        for (int i = 5; i < dataArray.Length; i++) {
+            if (dataArray[i].StartsWith("@")) {
+                foreach (string value in dataArray[i].Substring(1).Split(','))
+                    sites.Add(float.Parse(value, System.Globalization.CultureInfo.InvariantCulture));
+            }
+        }
+        landingSites = sites.ToArray();
+
         // Further processing of the received data can be done here
         // Debug.Log("Received Processed Safety Map: " + string.Join(", ", safetyMapData));
         // Debug.Log("Received Centroid Coordinates: (" + cx + ", " + cy + ", " + global_cx + ", " + global_cy + ")");
@@ -101,6 +189,91 @@ public class UdpSocket : MonoBehaviour
         }
     }
 
+    private void ProcessBinaryInput(byte[] data) {
+        if (data[2] != PROTOCOL_VERSION || data[3] != MSG_SAFETY_MAP || data.Length < HEADER_SIZE + SAFETY_MAP_HEADER_SIZE) {
+            print("Ignoring unsupported binary message");
+            return;
+        }
+
+        ReadOnlySpan<byte> span = new ReadOnlySpan<byte>(data);
+        uint sequence = BinaryPrimitives.ReadUInt32LittleEndian(span.Slice(4, 4));
+
+        ReadOnlySpan<byte> body = span.Slice(HEADER_SIZE);
+        int newCx = BinaryPrimitives.ReadInt32LittleEndian(body.Slice(0, 4));
+        int newCy = BinaryPrimitives.ReadInt32LittleEndian(body.Slice(4, 4));
+        int newGlobalCx = BinaryPrimitives.ReadInt32LittleEndian(body.Slice(8, 4));
+        int newGlobalCy = BinaryPrimitives.ReadInt32LittleEndian(body.Slice(12, 4));
+        int width = BinaryPrimitives.ReadUInt16LittleEndian(body.Slice(16, 2));
+        int height = BinaryPrimitives.ReadUInt16LittleEndian(body.Slice(18, 2));
+        byte encoding = body[20];
+        int siteCount = body[21];
+        int maskLength = body.Length - SAFETY_MAP_HEADER_SIZE - siteCount * SITE_SIZE;
+        if (maskLength < 0) {
+            print("Ignoring truncated safety map");
+            return;
+        }
+        ReadOnlySpan<byte> mask = body.Slice(SAFETY_MAP_HEADER_SIZE, maskLength);
+
+        // Ranked landing site candidates follow the mask
+        float[] sites = new float[siteCount * 5];
+        ReadOnlySpan<byte> siteData = body.Slice(SAFETY_MAP_HEADER_SIZE + maskLength);
+        for (int i = 0; i < siteCount; i++) {
+            ReadOnlySpan<byte> site = siteData.Slice(i * SITE_SIZE, SITE_SIZE);
+            sites[5 * i] = BinaryPrimitives.ReadUInt16LittleEndian(site.Slice(0, 2));
+            sites[5 * i + 1] = BinaryPrimitives.ReadUInt16LittleEndian(site.Slice(2, 2));
+            sites[5 * i + 2] = BinaryPrimitives.ReadInt32LittleEndian(site.Slice(4, 4));
+            sites[5 * i + 3] = BinaryPrimitives.ReadInt32LittleEndian(site.Slice(8, 4));
+            sites[5 * i + 4] = BitConverter.Int32BitsToSingle(BinaryPrimitives.ReadInt32LittleEndian(site.Slice(12, 4)));
+        }
+
+        // Expand the mask to the same 0/255 values the text protocol carries
+        int cells = width * height;
+        int[] map = new int[cells];
+        if (encoding == ENCODING_BITPACKED) {
+            for (int i = 0; i < cells; i++) {
+                if ((mask[i >> 3] & (0x80 >> (i & 7))) != 0)
+                    map[i] = 255;
+            }
+        }
+        else if (encoding == ENCODING_RLE) {
+            // uint16 run lengths alternating unsafe/safe, starting with unsafe
+            int index = 0;
+            bool safe = false;
+            for (int offset = 0; offset + 1 < mask.Length && index < cells; offset += 2) {
+                int run = BinaryPrimitives.ReadUInt16LittleEndian(mask.Slice(offset, 2));
+                int end = Math.Min(cells, index + run);
+                if (safe) {
+                    for (int i = index; i < end; i++)
+                        map[i] = 255;
+                }
+                index = end;
+                safe = !safe;
+            }
+        }
+        else {
+            print("Unknown safety map encoding " + encoding);
+            return;
+        }
+
+        safetyMapData = map;
+        cx = newCx;
+        cy = newCy;
+        global_cx = newGlobalCx;
+        global_cy = newGlobalCy;
+        landingSites = sites;
+        replySequence = sequence;
+
+        if (!isTxStarted) // First data arrived so tx started
+        {
+            isTxStarted = true;
+        }
+    }
+
+    // Sequence number of the position message answered by the latest safety map
+    public uint GetReplySequence() {
+        return replySequence;
+    }
+
     // Method to retrieve safety map data
     public int[] GetSafetyMapData() {
         return safetyMapData;
@@ -111,6 +284,12 @@ public class UdpSocket : MonoBehaviour
         return new int[] { cx, cy, global_cx, global_cy };
     }
 
+    // Ranked landing site candidates of the latest reply (empty unless the server runs with --site-candidates),
+    // 5 values per site: cx, cy, global_cx, global_cy, clearance radius in DEM units
+    public float[] GetLandingSites() {
+        return landingSites;
+    }
+
     //Prevent crashes - close clients and threads properly!
     void OnDisable() {
         if (receiveThread != null)
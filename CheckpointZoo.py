@@ -0,0 +1,255 @@
+# Index, optimize and profile every policy checkpoint under results/
+#
+# Scans results/<run>/LunarLander/LunarLander-<step>.onnx (and the matching .pt), records run, step,
+# observation/mask/action shapes and file sizes, and writes cheaper variants of each policy:
+#   optimized  onnxruntime graph optimizations applied offline (constant folding, Gemm fusions)
+#   int8       dynamic int8 quantization of the Gemm/MatMul weights
+#   fp16       weights stored as float16 and cast back to float32 at load (half the size; the CPU
+#              provider has no float16 kernels, so compute stays in float32)
+# Every variant is benchmarked on CPU (single sample and batched) and compared with the original
+# policy on observations visited by the original policy in LanderEnv: action divergence is the
+# share of observations where any action branch differs. With --landing, variants of the 10
+# observation policies are also flown in LanderEnv to check that they still land.
+#
+#   python CheckpointZoo.py --runs "finalphase5*" --landing
+#   python CheckpointZoo.py --pick --max-divergence 0.01
+#
+# Needs onnx and onnxruntime from mlagentsRequirements.txt; the int8 variant uses onnxruntime.quantization,
+# which ships with the pinned onnxruntime 1.12.1 wheel.
+
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import re
+import time
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import TensorProto, helper, numpy_helper
+
+import LanderEnv as LE
+from PolicyService import PolicyModel
+
+VARIANTS = ('original', 'optimized', 'int8', 'fp16')
+
+
+def scan_checkpoints(results_dir, runs='*'):
+    # One entry per ONNX checkpoint: run, step, paths, sizes and model signature
+    entries = []
+    for path in sorted(glob.glob(os.path.join(results_dir, '*', '*', '*.onnx'))):
+        run = os.path.relpath(path, results_dir).split(os.sep)[0]
+        if not fnmatch.fnmatch(run, runs):
+            continue
+        match = re.search(r'-(\d+)\.onnx$', path)
+        pt = path[:-len('.onnx')] + '.pt'
+        session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+        entries.append({
+            'run': run,
+            'step': int(match.group(1)) if match else None,
+            'onnx': path,
+            'onnx_bytes': os.path.getsize(path),
+            'pt': pt if os.path.exists(pt) else None,
+            'pt_bytes': os.path.getsize(pt) if os.path.exists(pt) else None,
+            'inputs': {i.name: i.shape for i in session.get_inputs()},
+            'outputs': {o.name: o.shape for o in session.get_outputs()},
+        })
+    return entries
+
+
+def export_optimized(source, target):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = target
+    ort.InferenceSession(source, options, providers=['CPUExecutionProvider'])
+
+
+def export_int8(source, target):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+
+
+def export_fp16(source, target):
+    # Store float32 initializers as float16 and insert a Cast back to float32 in front of their users
+    model = onnx.load(source)
+    graph = model.graph
+    casts = []
+    for initializer in graph.initializer:
+        if initializer.data_type != TensorProto.FLOAT:
+            continue
+        values = numpy_helper.to_array(initializer)
+        if values.size < 16: # scalars and tiny constants are not worth a Cast
+            continue
+        half = numpy_helper.from_array(values.astype(np.float16), initializer.name + '_fp16')
+        initializer.CopyFrom(half)
+        casts.append(helper.make_node('Cast', [half.name], [half.name[:-len('_fp16')]], to=TensorProto.FLOAT))
+    for cast in reversed(casts):
+        graph.node.insert(0, cast)
+    onnx.save(model, target)
+
+
+EXPORTERS = {'optimized': export_optimized, 'int8': export_int8, 'fp16': export_fp16}
+
+
+def observation_set(model, count, seed=0):
+    """
+    Observations visited by the model's own deterministic rollouts in LanderEnv
+    12 observation policies (AgentController) get absolute position prepended to the 10 training observations.
+    """
+    env = LE.LanderVecEnv(min(count, 256), seed=seed)
+    observations, _ = env.reset()
+    collected = []
+    while sum(len(c) for c in collected) < count:
+        obs = observations if model.obsSize == LE.OBSERVATION_SIZE else np.column_stack(
+            [env.position[:, 0], env.Altitude(), env.position[:, 2], observations[:, 1:]]).astype(np.float32)
+        collected.append(obs)
+        observations, _, _, _, _ = env.step(model.Infer(obs))
+    return np.concatenate(collected)[:count]
+
+
+def latency(model, observations, repeat):
+    # Median and p99 latency (ms) of Infer on this batch
+    model.Infer(observations)
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        model.Infer(observations)
+        samples[i] = time.perf_counter() - start
+    return float(np.median(samples) * 1e3), float(np.percentile(samples, 99) * 1e3)
+
+
+def landing_rate(model, envs, decisions, seed=0):
+    # Share of finished episodes that ended with the +1000 landing reward
+    env = LE.LanderVecEnv(envs, seed=seed)
+    observations, _ = env.reset()
+    returns = []
+    for _ in range(decisions):
+        observations, _, _, _, infos = env.step(model.Infer(observations))
+        if 'episode_return' in infos:
+            returns.extend(infos['episode_return'])
+    returns = np.asarray(returns)
+    return float((returns > 900).mean()) if len(returns) else None
+
+
+def profile(entry, zoo_dir, batch=64, samples=2048, repeat=200, landing=False, threads=1):
+    """
+    Export the variants of one checkpoint and measure them against the original
+    :return: dict variant -> metrics (or error)
+    """
+    out_dir = os.path.join(zoo_dir, entry['run'])
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(entry['onnx']))[0]
+
+    paths = {'original': entry['onnx']}
+    results = {}
+    for variant, exporter in EXPORTERS.items():
+        target = os.path.join(out_dir, '%s.%s.onnx' % (base, variant))
+        try:
+            if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(entry['onnx']):
+                exporter(entry['onnx'], target)
+            paths[variant] = target
+        except Exception as e:
+            results[variant] = {'error': repr(e)}
+
+    reference = PolicyModel(entry['onnx'], threads=threads, maxBatch=batch)
+    observations = observation_set(reference, samples)
+    expected = reference.Infer(observations)
+
+    for variant, path in paths.items():
+        model = PolicyModel(path, threads=threads, maxBatch=max(batch, samples))
+        actions = model.Infer(observations)
+        single = latency(model, observations[:1], repeat)
+        batched = latency(model, observations[:batch], repeat // 4)
+        result = {
+            'path': path,
+            'bytes': os.path.getsize(path),
+            'single_p50_ms': single[0],
+            'single_p99_ms': single[1],
+            'batch': batch,
+            'batch_p50_ms': batched[0],
+            'per_sample_us': batched[0] * 1e3 / batch,
+            'divergence': float((actions != expected).any(axis=1).mean()),
+            'branch_divergence': (actions != expected).mean(axis=0).tolist(),
+        }
+        if landing and model.obsSize == LE.OBSERVATION_SIZE:
+            result['landing_rate'] = landing_rate(model, 256, 1600)
+        results[variant] = result
+    return results
+
+
+def pick(index, max_divergence, min_landing):
+    # Cheapest (per-sample latency) variant of each run that stays within the divergence / landing limits
+    best = {}
+    for entry in index:
+        for variant, result in entry.get('variants', {}).items():
+            if 'error' in result or result['divergence'] > max_divergence:
+                continue
+            if min_landing is not None and (result.get('landing_rate') or 0) < min_landing:
+                continue
+            current = best.get(entry['run'])
+            if current is None or result['per_sample_us'] < current[2]['per_sample_us']:
+                best[entry['run']] = (entry, variant, result)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index, optimize and profile the ONNX policy checkpoints")
+    parser.add_argument('--results', default='results', help="directory with the run directories")
+    parser.add_argument('--zoo', default='checkpoint_zoo', help="output directory for variants and index.json")
+    parser.add_argument('--runs', default='*', help="glob pattern of runs to process")
+    parser.add_argument('--latest', action='store_true', help="only profile the last checkpoint of each run")
+    parser.add_argument('--index-only', action='store_true', help="only scan and write the index")
+    parser.add_argument('--batch', type=int, default=64, help="batch size of the batched latency measurement")
+    parser.add_argument('--samples', type=int, default=2048, help="observations used for action divergence")
+    parser.add_argument('--threads', type=int, default=1, help="onnxruntime intra-op threads")
+    parser.add_argument('--landing', action='store_true', help="fly every variant in LanderEnv and report its landing rate")
+    parser.add_argument('--pick', action='store_true', help="print the cheapest acceptable variant per run from the index")
+    parser.add_argument('--max-divergence', type=float, default=0.01)
+    parser.add_argument('--min-landing', type=float, default=None)
+    args = parser.parse_args()
+
+    index_path = os.path.join(args.zoo, 'index.json')
+    if args.pick:
+        with open(index_path) as f:
+            index = json.load(f)
+        for run, (entry, variant, result) in sorted(pick(index, args.max_divergence, args.min_landing).items()):
+            print('%-16s step %9s  %-9s %7.2f us/sample  divergence %.4f  %s' % (
+                run, entry['step'], variant, result['per_sample_us'], result['divergence'], result['path']))
+        return
+
+    ort.set_default_logger_severity(3)
+    os.makedirs(args.zoo, exist_ok=True)
+    index = scan_checkpoints(args.results, args.runs)
+    if args.latest:
+        last = {}
+        for entry in index:
+            if entry['run'] not in last or (entry['step'] or 0) > (last[entry['run']]['step'] or 0):
+                last[entry['run']] = entry
+        todo = list(last.values())
+    else:
+        todo = index
+
+    if not args.index_only:
+        for entry in todo:
+            entry['variants'] = profile(entry, args.zoo, args.batch, args.samples, landing=args.landing,
+                                        threads=args.threads)
+            for variant in VARIANTS:
+                result = entry['variants'].get(variant)
+                if result is None or 'error' in result:
+                    print('%-16s %9s %-9s %s' % (entry['run'], entry['step'], variant, result and result['error']))
+                    continue
+                landing = result.get('landing_rate')
+                print('%-16s %9s %-9s %7d B  single %6.3f ms  %6.2f us/sample  divergence %.4f%s' % (
+                    entry['run'], entry['step'], variant, result['bytes'], result['single_p50_ms'],
+                    result['per_sample_us'], result['divergence'],
+                    '' if landing is None else '  landing %.1f%%' % (100 * landing)))
+
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=1)
+    print("Indexed %d checkpoints in %s" % (len(index), index_path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Offline builder for full-DEM hazard layers
+#
+# Tiles a whole DEM with a halo overlap, computes slope, roughness and safety for every
+# tile on a process pool and writes them as tiled, overviewed GeoTIFFs:
+#
+#   python DEMLayers.py DEMS/dem1.tif --out DEMS/layers --workers 8
+#
+# The halo is wide enough for the gradient, the 3x3 roughness window and the opening
+# kernel, and tiles at the raster edge are clipped rather than padded, so every output
+# pixel is identical to processing the whole raster in one piece (no seams).
+#
+# Only a few tiles per worker are in flight at a time, so memory stays bounded by the tile size
+# rather than the raster size. Nodata cells of the DEM (and NaNs) and the cells whose gradient or
+# roughness window reaches them get NODATA in slope and roughness and are unsafe (0) in safety;
+# safety marks the nodata cells themselves in its internal mask band.
+
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from HazardMap import calculate_slope, calculate_roughness, classify_safety, postprocess_safety
+
+LAYERS = ('slope', 'roughness', 'safety')
+NODATA = -9999.0 # slope and roughness
+OVERVIEW_RESAMPLING = {'slope': Resampling.average, 'roughness': Resampling.average, 'safety': Resampling.nearest}
+
+# Dataset opened once per worker process by init_worker
+worker_dataset = None
+
+
+def opening_kernel_size(pixel_size_x, min_kernel_size=3):
+    # Same kernel size rule as HazardMap.postprocess_safety
+    return max(min_kernel_size, int(15/pixel_size_x))
+
+
+def compute_layers(dem_array, pixel_size_x, min_kernel_size=3, invalid=None):
+    """
+    Compute the hazard layers for one DEM array
+    :param invalid: optional boolean array of nodata cells; they and their 3x3 neighbours get NODATA in
+                    slope and roughness and are unsafe before the opening
+    :return: slope (degrees), roughness and safety (uint8, 1 = safe) arrays
+    """
+    if invalid is not None:
+        dem_array = np.where(invalid, 0, dem_array)
+    slope_deg = calculate_slope(dem_array, pixel_size_x).astype(np.float32)
+    roughness_array = calculate_roughness(dem_array).astype(np.float32)
+    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    if invalid is not None:
+        halo = cv2.dilate(invalid.view(np.uint8), np.ones((3, 3), np.uint8)).view(bool)
+        slope_deg[halo] = NODATA
+        roughness_array[halo] = NODATA
+        safety_map[halo] = False
+    safety_map_processed = postprocess_safety(safety_map, pixel_size_x, min_kernel_size)
+    return slope_deg, roughness_array, safety_map_processed
+
+
+def tile_windows(width, height, tile_size, halo):
+    # Yield (core, padded) windows covering the raster; padded is core grown by halo and clipped to the raster
+    for row in range(0, height, tile_size):
+        for col in range(0, width, tile_size):
+            core = Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+            col0, row0 = max(0, col - halo), max(0, row - halo)
+            col1 = min(width, col + core.width + halo)
+            row1 = min(height, row + core.height + halo)
+            yield core, Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def init_worker(input_dem_path):
+    global worker_dataset
+    worker_dataset = rasterio.open(input_dem_path)
+
+
+def process_tile(core, padded, pixel_size_x, min_kernel_size):
+    # Runs in a worker: read the padded window, compute the layers and crop the halo away
+    dem_array = worker_dataset.read(1, window=padded)
+    invalid = None
+    if worker_dataset.nodata is not None or dem_array.dtype.kind == 'f':
+        invalid = ~np.isfinite(dem_array) if dem_array.dtype.kind == 'f' else np.zeros(dem_array.shape, bool)
+        if worker_dataset.nodata is not None:
+            invalid |= dem_array == worker_dataset.nodata
+        if not invalid.any():
+            invalid = None
+    layers = compute_layers(dem_array, pixel_size_x, min_kernel_size, invalid)
+
+    r0 = core.row_off - padded.row_off
+    c0 = core.col_off - padded.col_off
+    crop = (slice(r0, r0 + core.height), slice(c0, c0 + core.width))
+    valid = None if invalid is None else np.where(invalid[crop], 0, 255).astype(np.uint8)
+    return core, [layer[crop] for layer in layers], valid
+
+
+def build_layers(input_dem_path, output_dir, tile_size=1024, workers=None, pixel_size=None,
+                 min_kernel_size=3, block_size=256, overview_levels=(2, 4, 8, 16, 32)):
+    """
+    Build slope.tif, roughness.tif and safety.tif for a whole DEM
+    :param pixel_size: DEM cell size; defaults to the pixel width from the geotransform
+    :param workers: number of worker processes (defaults to the number of CPUs); at most twice as
+                    many tiles are computed or waiting to be written at a time
+    :return: dict mapping layer name to output path
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with rasterio.open(input_dem_path) as src:
+        profile = src.profile
+        width, height = src.width, src.height
+        masked = src.nodata is not None or np.dtype(src.dtypes[0]).kind == 'f'
+        if pixel_size is None:
+            pixel_size = abs(src.transform.a)
+
+    halo = opening_kernel_size(pixel_size, min_kernel_size) + 1
+
+    profile.update({
+        'driver': 'GTiff',
+        'count': 1,
+        'tiled': True,
+        'blockxsize': block_size,
+        'blockysize': block_size,
+        'compress': 'deflate',
+        'BIGTIFF': 'IF_SAFER'})
+    profile.pop('nodata', None)
+
+    paths = {name: os.path.join(output_dir, name + '.tif') for name in LAYERS}
+    outputs = {
+        'slope': rasterio.open(paths['slope'], 'w', **dict(profile, dtype='float32', predictor=3, nodata=NODATA)),
+        'roughness': rasterio.open(paths['roughness'], 'w', **dict(profile, dtype='float32', predictor=3, nodata=NODATA)),
+        'safety': rasterio.open(paths['safety'], 'w', **dict(profile, dtype='uint8', predictor=2)),
+    }
+
+    def write_tiles(done):
+        for future in done:
+            core, layers, valid = future.result()
+            for name, layer in zip(LAYERS, layers):
+                outputs[name].write(layer, 1, window=core)
+            if masked:
+                if valid is None:
+                    valid = np.full(layers[2].shape, 255, np.uint8)
+                outputs['safety'].write_mask(valid, window=core)
+
+    try:
+        max_pending = 2 * (workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(input_dem_path,)) as pool:
+            pending = set()
+            for core, padded in tile_windows(width, height, tile_size, halo):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    write_tiles(done)
+                pending.add(pool.submit(process_tile, core, padded, pixel_size, min_kernel_size))
+            write_tiles(wait(pending)[0])
+
+        # Internal overviews so consumers can read coarse levels cheaply
+        for name, dst in outputs.items():
+            levels = [level for level in overview_levels if min(width, height) // level >= 1]
+            dst.build_overviews(levels, OVERVIEW_RESAMPLING[name])
+            dst.update_tags(ns='rio_overview', resampling=OVERVIEW_RESAMPLING[name].name)
+    finally:
+        for dst in outputs.values():
+            dst.close()
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build tiled slope/roughness/safety GeoTIFFs for a whole DEM")
+    parser.add_argument('input_dem', help="input DEM GeoTIFF")
+    parser.add_argument('--out', default='DEMS/layers', help="output directory")
+    parser.add_argument('--tile-size', type=int, default=1024, help="processing tile size in pixels")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument('--pixel-size', type=float, default=None, help="DEM cell size (default: from geotransform)")
+    parser.add_argument('--min-kernel', type=int, default=3, help="minimum opening kernel size")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = build_layers(args.input_dem, args.out, args.tile_size, args.workers, args.pixel_size, args.min_kernel)
+    print("Built layers in %.1fs:" % (time.perf_counter() - start))
+    for name, path in paths.items():
+        print("  %s: %s" % (name, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# Min/max/mean elevation pyramid for conservative hazard maps over large FOVs
+#
+# Level L stores, for every aligned 2^L x 2^L block of the DEM, the minimum, maximum and mean
+# elevation. A 64x64 hazard map cell of a wide FOV covers a window of W/64 DEM pixels; at the
+# level whose blocks are no larger than that window, the window is covered by at most 3x3 blocks,
+# so the elevation bounds of every output cell take a constant number of lookups whatever the FOV
+# size. Unlike nearest-neighbour downsampling, no DEM sample is skipped: a boulder or crater rim
+# anywhere in a cell widens that cell's bounds (see HazardMap.compute_conservative_safety_map).
+#
+#   python DEMPyramid.py DEMS/dem1.tif --out DEMS/dem1_pyramid
+#
+# The pyramid is stored as one .npy file per level and statistic and memory-mapped when loaded,
+# so process pool workers share the pages. Together the levels take about as much space as the DEM.
+# write_pyramid builds it from row strips of the DEM into memory-mapped files, so DEMs larger than
+# RAM never have to be loaded whole.
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+STATS = ('min', 'max', 'mean')
+STRIP_BYTES = 64 * 1024 * 1024 # float32 DEM rows read at a time by write_pyramid
+
+
+def reduce_level(zmin, zmax, zmean):
+    # Next pyramid level: 2x2 block reduction, odd edges are padded by repeating the last row/column
+    height, width = zmin.shape
+    pad = ((0, height % 2), (0, width % 2))
+    shape = ((height + 1) // 2, 2, (width + 1) // 2, 2)
+    if height % 2 or width % 2:
+        zmin, zmax, zmean = (np.pad(a, pad, mode='edge') for a in (zmin, zmax, zmean))
+    return (zmin.reshape(shape).min(axis=(1, 3)),
+            zmax.reshape(shape).max(axis=(1, 3)),
+            zmean.reshape(shape).mean(axis=(1, 3), dtype=np.float32))
+
+
+def build_pyramid(dem_array, max_level=None):
+    """
+    Build the min/max/mean levels of a DEM
+    :param dem_array: 2D elevation array
+    :param max_level: last level to build (default: until a level is a single block)
+    :return: list of (min, max, mean) float32 arrays; entry 0 is level 1 (2x2 blocks)
+    """
+    zmin = zmax = zmean = np.asarray(dem_array, dtype=np.float32)
+    levels = []
+    while max(zmin.shape) > 1 and (max_level is None or len(levels) < max_level):
+        zmin, zmax, zmean = reduce_level(zmin, zmax, zmean)
+        levels.append((zmin, zmax, zmean))
+    return levels
+
+
+def save_pyramid(levels, shape, path):
+    # Write every level and statistic as .npy plus an index.json with the DEM shape
+    os.makedirs(path, exist_ok=True)
+    for level, arrays in enumerate(levels, start=1):
+        for name, array in zip(STATS, arrays):
+            np.save(os.path.join(path, 'level%02d_%s.npy' % (level, name)), array)
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({'shape': list(shape), 'levels': len(levels)}, f)
+
+
+def write_pyramid(read_rows, shape, path, max_level=None, strip_rows=None):
+    """
+    Build the pyramid strip by strip into memory-mapped .npy files (the layout of save_pyramid)
+    Level 1 is reduced from strip_rows DEM rows at a time and every further level from the previous
+    level's file, so memory use does not depend on the DEM size. The levels equal build_pyramid's.
+    :param read_rows: function (row0, row1) -> the full-width DEM rows [row0, row1)
+    :param shape: (height, width) of the DEM
+    :param strip_rows: rows per strip, even (default: about STRIP_BYTES, a multiple of 256 to match DEM tiles)
+    :return: number of levels
+    """
+    os.makedirs(path, exist_ok=True)
+    height, width = shape
+    if strip_rows is None:
+        strip_rows = max(256, STRIP_BYTES // (4 * width) // 256 * 256)
+    previous = None
+    level = 0
+    while max(height, width) > 1 and (max_level is None or level < max_level):
+        level += 1
+        outputs = [np.lib.format.open_memmap(os.path.join(path, 'level%02d_%s.npy' % (level, name)), 'w+',
+                                             np.float32, ((height + 1) // 2, (width + 1) // 2))
+                   for name in STATS]
+        for row in range(0, height, strip_rows):
+            if previous is None:
+                strip = np.asarray(read_rows(row, min(height, row + strip_rows)), dtype=np.float32)
+                reduced = reduce_level(strip, strip, strip)
+            else:
+                reduced = reduce_level(*(array[row:row + strip_rows] for array in previous))
+            for output, array in zip(outputs, reduced):
+                output[row // 2:row // 2 + len(array)] = array
+        for output in outputs:
+            output.flush()
+        previous = outputs
+        height, width = outputs[0].shape
+    del previous
+
+    with open(os.path.join(path, 'index.json'), 'w') as f:
+        json.dump({'shape': list(shape), 'levels': level}, f)
+    return level
+
+
+class DEMPyramid():
+    def __init__(self, source, maxLevel=None):
+        """
+        Constructor
+        :param source: directory written by save_pyramid (memory-mapped), or a 2D elevation array to build from
+        :param maxLevel: last level to build when source is an array
+        """
+        if isinstance(source, str):
+            with open(os.path.join(source, 'index.json')) as f:
+                index = json.load(f)
+            self.shape = tuple(index['shape'])
+            self.levels = [tuple(np.load(os.path.join(source, 'level%02d_%s.npy' % (level, name)), mmap_mode='r')
+                                 for name in STATS)
+                           for level in range(1, index['levels'] + 1)]
+        else:
+            self.shape = tuple(source.shape)
+            self.levels = build_pyramid(source, maxLevel)
+        self.lookups = 0
+
+    def Bounds(self, row0, row1, col0, col1, outSize=64):
+        """
+        Elevation bounds of the cells of an outSize x outSize grid over the window [row0, row1) x [col0, col1)
+        Cell j starts at the pixel cv2.resize INTER_NEAREST samples for it, so the grid lines up with resize_dem.
+        Cells must be at least 2 DEM pixels wide; use the DEM itself below that.
+        :return: (min, max) float32 arrays of shape (outSize, outSize); the bounds cover every pixel of each cell
+        """
+        level, rows, cols = self.Cells(row0, row1, col0, col1, outSize)
+        zmin, zmax, _ = self.levels[level - 1]
+        return self.Reduce(zmin, rows, cols, np.minimum), self.Reduce(zmax, rows, cols, np.maximum)
+
+    def Mean(self, row0, row1, col0, col1, outSize=64):
+        # Mean elevation of the blocks covering each cell of the same grid as Bounds
+        level, rows, cols = self.Cells(row0, row1, col0, col1, outSize)
+        zmean = self.levels[level - 1][2]
+        return self.Reduce(zmean, rows, cols, np.add) / (rows.shape[1] * cols.shape[1])
+
+    def Cells(self, row0, row1, col0, col1, outSize):
+        # Pyramid level and (outSize, span) block indices covering each cell along both axes
+        extent = int(min(row1 - row0, col1 - col0) // outSize) # bounds may be NumPy integers
+        if extent < 2:
+            raise ValueError("Pyramid cells need a window of at least %d pixels" % (2 * outSize))
+        # Blocks of the chosen level are no larger than the narrowest cell, so a cell spans <= 3 blocks per axis
+        level = min(extent.bit_length() - 1, len(self.levels))
+        blocks = self.levels[level - 1][0].shape
+        self.lookups += 1
+        return (level, self.BlockIndex(row0, row1 - row0, outSize, level, blocks[0]),
+                self.BlockIndex(col0, col1 - col0, outSize, level, blocks[1]))
+
+    @staticmethod
+    def BlockIndex(start, length, outSize, level, blocks):
+        # (outSize, span) block indices covering each cell along one axis, repeated where a cell spans fewer blocks
+        # Same source coordinate as OpenCV: floor(j * (1 / scale)) with scale = outSize / length
+        edges = np.floor(np.arange(outSize + 1) * (1.0 / (outSize / length))).astype(np.int64)
+        edges[-1] = length
+        edges += start
+        first = edges[:-1] >> level
+        last = np.minimum((edges[1:] - 1) >> level, blocks - 1)
+        span = int((last - first).max()) + 1
+        return np.minimum(first[:, None] + np.arange(span), last[:, None])
+
+    @staticmethod
+    def Reduce(level, rows, cols, ufunc):
+        # Combine the blocks of every cell one axis at a time, on the part of the level under the window
+        row0, col0 = rows[0, 0], cols[0, 0]
+        window = level[row0:rows[-1, -1] + 1, col0:cols[-1, -1] + 1]
+        spanRows, spanCols = rows.shape[1], cols.shape[1]
+
+        gathered = window.take((cols - col0).ravel(), axis=1)
+        partial = gathered[:, 0::spanCols]
+        for offset in range(1, spanCols):
+            partial = ufunc(partial, gathered[:, offset::spanCols])
+
+        gathered = partial.take((rows - row0).ravel(), axis=0)
+        result = gathered[0::spanRows]
+        for offset in range(1, spanRows):
+            result = ufunc(result, gathered[offset::spanRows])
+        return result
+
+    def Stats(self):
+        return {
+            'levels': len(self.levels),
+            'bytes': sum(array.nbytes for arrays in self.levels for array in arrays),
+            'lookups': self.lookups,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the min/max/mean elevation pyramid of a DEM")
+    parser.add_argument('input_dem', help="input DEM GeoTIFF")
+    parser.add_argument('--out', default=None, help="output directory (default: <dem>_pyramid)")
+    parser.add_argument('--max-level', type=int, default=None, help="last level to build")
+    args = parser.parse_args()
+
+    import rasterio
+    from rasterio.windows import Window
+
+    start = time.perf_counter()
+    out = args.out or os.path.splitext(args.input_dem)[0] + '_pyramid'
+    with rasterio.open(args.input_dem) as src:
+        levels = write_pyramid(lambda row0, row1: src.read(1, window=Window(0, row0, src.width, row1 - row0)),
+                               (src.height, src.width), out, args.max_level)
+        width, height = src.width, src.height
+    print("Built %d levels for a %dx%d DEM in %.1fs: %s" % (levels, width, height, time.perf_counter() - start, out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# Windowed, tile-cached access to large DEM rasters
+#
+# TiledDEM can be sliced like the 2D array returned by src.read(1), so existing code such
+# as crop_dem keeps working, but only the tiles overlapping the requested window are ever
+# decoded. Decoded tiles are kept in a bounded LRU cache.
+#
+# For fast start-up a GeoTIFF band can be converted once into a snapshot: the raw array as .npy
+# plus a .json sidecar with the georeferencing. Opening a snapshot memory-maps it, so nothing is
+# decoded and rasterio is not imported; windows are served straight from the page cache.
+#
+#   python DEMTiles.py DEMS/dem1.tif              # writes DEMS/dem1.npy and DEMS/dem1.json
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+SNAPSHOT_ROWS = 1024 # rows converted per read when writing a snapshot
+
+
+def sidecar_path(snapshot_path):
+    return os.path.splitext(snapshot_path)[0] + '.json'
+
+
+def write_snapshot(input_dem_path, snapshot_path=None, band=1):
+    """
+    Convert one band of a raster into a memory-mappable snapshot
+    :param snapshot_path: output .npy path, defaults to the input path with a .npy extension
+    :return: path of the snapshot
+    """
+    import rasterio
+    from rasterio.windows import Window
+
+    if snapshot_path is None:
+        snapshot_path = os.path.splitext(input_dem_path)[0] + '.npy'
+    with rasterio.open(input_dem_path) as src:
+        array = np.lib.format.open_memmap(snapshot_path, mode='w+', dtype=src.dtypes[band - 1],
+                                          shape=(src.height, src.width))
+        for row in range(0, src.height, SNAPSHOT_ROWS):
+            rows = min(SNAPSHOT_ROWS, src.height - row)
+            array[row:row + rows] = src.read(band, window=Window(0, row, src.width, rows))
+        array.flush()
+        del array
+
+        sidecar = {
+            'source': os.path.abspath(input_dem_path),
+            'source_mtime': os.path.getmtime(input_dem_path),
+            'band': band,
+            'shape': [src.height, src.width],
+            'dtype': src.dtypes[band - 1],
+            'transform': [src.transform.a, src.transform.b, src.transform.c, src.transform.d, src.transform.e, src.transform.f],
+            'crs': src.crs.to_wkt() if src.crs else None,
+            'nodata': src.nodata,
+        }
+    with open(sidecar_path(snapshot_path), 'w') as f:
+        json.dump(sidecar, f, indent=1)
+    return snapshot_path
+
+
+def open_snapshot(snapshot_path):
+    """
+    Memory-map a snapshot written by write_snapshot
+    :return: (read-only 2D np.memmap, sidecar dict; empty if the .json is missing)
+    """
+    array = np.load(snapshot_path, mmap_mode='r')
+    sidecar = {}
+    if os.path.exists(sidecar_path(snapshot_path)):
+        with open(sidecar_path(snapshot_path)) as f:
+            sidecar = json.load(f)
+    return array, sidecar
+
+
+class TiledDEM():
+    def __init__(self, source, tileSize=256, maxCacheBytes=256 * 1024 * 1024, band=1):
+        """
+        Constructor
+        :param source: path to a raster readable by rasterio/GDAL or to a .npy snapshot, or a 2D array (e.g. np.memmap)
+        :param tileSize: edge length in pixels of the square tiles that are decoded and cached
+        :param maxCacheBytes: upper bound on the memory used by decoded tiles
+        :param band: raster band to read when source is a path
+        """
+        self.tileSize = tileSize
+        self.maxCacheBytes = maxCacheBytes
+        self.band = band
+
+        self.dataset = None
+        self.array = None
+        self.transform = None
+        self.nodata = None
+
+        if isinstance(source, str) and source.endswith('.npy'):
+            # Snapshot: georeferencing from the sidecar, transform as the 6 affine coefficients (a, b, c, d, e, f)
+            source, sidecar = open_snapshot(source)
+            self.transform = tuple(sidecar['transform']) if sidecar.get('transform') else None
+            self.nodata = sidecar.get('nodata')
+
+        if isinstance(source, np.ndarray):
+            if source.ndim != 2:
+                raise ValueError("TiledDEM expects a 2D elevation array")
+            self.array = source
+            self.shape = source.shape
+            self.dtype = source.dtype
+            # Memory-mapped arrays are sliced directly; the page cache makes the tile cache redundant
+            self.mapped = isinstance(source, np.memmap)
+        else:
+            import rasterio
+
+            self.dataset = rasterio.open(source)
+            self.shape = (self.dataset.height, self.dataset.width)
+            self.dtype = np.dtype(self.dataset.dtypes[band - 1])
+            self.transform = self.dataset.transform
+            self.nodata = self.dataset.nodata
+            self.mapped = False
+
+        self.ndim = 2
+        self.tiles = OrderedDict()
+        self.residentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __del__(self):
+        self.Close()
+
+    def Close(self):
+        # Function to close the underlying dataset
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        # Support dem[rowStart:rowStop, colStart:colStop] with the same semantics as NumPy slicing
+        if not isinstance(key, tuple) or len(key) != 2 or not all(isinstance(k, slice) for k in key):
+            raise TypeError("TiledDEM only supports 2D slicing, e.g. dem[y0:y1, x0:x1]")
+        rows, cols = key
+        if rows.step not in (None, 1) or cols.step not in (None, 1):
+            raise ValueError("TiledDEM does not support strided slicing")
+
+        row0, row1, _ = rows.indices(self.shape[0])
+        col0, col1, _ = cols.indices(self.shape[1])
+        return self.ReadWindow(row0, max(row0, row1), col0, max(col0, col1))
+
+    def ReadWindow(self, row0, row1, col0, col1):
+        """
+        Read the half-open window [row0, row1) x [col0, col1), touching only overlapping tiles
+        :return: 2D array; a read-only view into the cached tile when the window fits in a single tile
+        """
+        if row1 <= row0 or col1 <= col0:
+            return np.empty((max(0, row1 - row0), max(0, col1 - col0)), dtype=self.dtype)
+        if self.mapped:
+            return np.asarray(self.array[row0:row1, col0:col1])
+
+        ts = self.tileSize
+        tileRows = range(row0 // ts, (row1 - 1) // ts + 1)
+        tileCols = range(col0 // ts, (col1 - 1) // ts + 1)
+
+        # Fast path: the window lies inside one tile
+        if len(tileRows) == 1 and len(tileCols) == 1:
+            tr, tc = tileRows[0], tileCols[0]
+            tile = self.GetTile(tr, tc)
+            return tile[row0 - tr * ts:row1 - tr * ts, col0 - tc * ts:col1 - tc * ts]
+
+        window = np.empty((row1 - row0, col1 - col0), dtype=self.dtype)
+        for tr in tileRows:
+            for tc in tileCols:
+                tile = self.GetTile(tr, tc)
+                # Intersection of the tile and the requested window in global coordinates
+                r0 = max(row0, tr * ts)
+                r1 = min(row1, tr * ts + tile.shape[0])
+                c0 = max(col0, tc * ts)
+                c1 = min(col1, tc * ts + tile.shape[1])
+                window[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = tile[r0 - tr * ts:r1 - tr * ts, c0 - tc * ts:c1 - tc * ts]
+        return window
+
+    def Gather(self, rows, cols):
+        """
+        Nearest-neighbour samples of many windows at once (see server.compute_hazard_maps)
+        :param rows: (N, h) global row indices of each window
+        :param cols: (N, w) global column indices of each window
+        :return: (N, h, w) array with out[i, j, k] = dem[rows[i, j], cols[i, k]]
+        """
+        if self.array is not None:
+            return self.array[rows[:, :, None], cols[:, None, :]]
+        out = np.empty((len(rows), rows.shape[1], cols.shape[1]), dtype=self.dtype)
+        for i in range(len(rows)):
+            row0, col0 = int(rows[i].min()), int(cols[i].min())
+            window = self.ReadWindow(row0, int(rows[i].max()) + 1, col0, int(cols[i].max()) + 1)
+            out[i] = window[np.ix_(rows[i] - row0, cols[i] - col0)]
+        return out
+
+    def GetTile(self, tileRow, tileCol):
+        # Return the decoded tile, reading it from the source on a cache miss
+        key = (tileRow, tileCol)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+
+            tile = self.DecodeTile(tileRow, tileCol)
+            tile.flags.writeable = False
+            self.tiles[key] = tile
+            self.residentBytes += tile.nbytes
+
+            # Evict least recently used tiles, always keeping the one just decoded
+            while self.residentBytes > self.maxCacheBytes and len(self.tiles) > 1:
+                _, evicted = self.tiles.popitem(last=False)
+                self.residentBytes -= evicted.nbytes
+            return tile
+
+    def DecodeTile(self, tileRow, tileCol):
+        # Should not be called by user, reads one tile straight from the source
+        ts = self.tileSize
+        row0, col0 = tileRow * ts, tileCol * ts
+        height = min(ts, self.shape[0] - row0)
+        width = min(ts, self.shape[1] - col0)
+
+        if self.array is not None:
+            return np.array(self.array[row0:row0 + height, col0:col0 + width])
+
+        from rasterio.windows import Window
+        return self.dataset.read(self.band, window=Window(col0, row0, width, height))
+
+    def Stats(self):
+        """
+        Cache statistics
+        :return: dict with hits, misses, hit_rate, resident_bytes and tiles
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'resident_bytes': self.residentBytes,
+                'tiles': len(self.tiles),
+                'mapped': self.mapped,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a DEM band into a memory-mappable snapshot for fast start-up")
+    parser.add_argument('input_dem', help="input DEM GeoTIFF")
+    parser.add_argument('--out', default=None, help="output .npy path (default: input path with .npy extension)")
+    parser.add_argument('--band', type=int, default=1, help="raster band to convert")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path = write_snapshot(args.input_dem, args.out, args.band)
+    print("Wrote %s and %s in %.1fs" % (path, sidecar_path(path), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
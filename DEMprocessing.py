@@ -1,27 +1,218 @@
-import rasterio
+# DEM patch pipeline: crop -> resize to 64x64 -> hazard map -> centroid of the largest safe blob
+#
+# The stages hand a DEMPatch (array plus georeferencing) to each other in memory instead of writing
+# DEMS/crop.tif, DEMS/resized.tif and DEMS/safetymap.png and reading each back (the old script, kept
+# below as legacy_process for --compare). GeoTIFF/PNG outputs are only written when asked, and
+# process_windows runs many crop windows off one open dataset, classifying them as one stack
+# (HazardMap.compute_safety_map_batch).
+#
+#   python DEMprocessing.py DEMS/dem2.tif --window 1500 1025 200 --show
+#   python DEMprocessing.py DEMS/dem2.tif --windows windows.csv --json results.json
+#   python DEMprocessing.py DEMS/dem2.tif --window 1500 1025 200 --write DEMS   # crop.tif, resized.tif, safetymap.png
+#   python DEMprocessing.py DEMS/dem2.tif --compare 100   # check against the file-based route and time both
+#
+# Results match the file-based route: the resampling picks the same DEM pixels as skimage's
+# resize(order=0, mode='reflect') (nearest neighbour on the pixel-centre grid), the resized DEM is
+# float32 like the Float32 resized.tif, and contours are found on the 0/1 map the PNG encoded as 0/255.
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
 import numpy as np
-import matplotlib.pyplot as plt
+import rasterio
+from rasterio.transform import Affine
 from rasterio.windows import Window
-from osgeo import gdal #, gdalconst
-from scipy.ndimage import generic_filter, median_filter, minimum_filter #, maximum_filter
-from skimage.transform import resize
-import cv2
 
+from HazardMap import (calculate_slope, calculate_roughness, classify_safety, postprocess_safety,
+                       compute_safety_map_batch)
+
+NEW_SIZE = (64, 64)
+# The script opened the safety map with a 2x2 minimum kernel (the server uses 3)
+MIN_KERNEL_SIZE = 2
+
+
+class DEMPatch():
+    def __init__(self, array, transform, crs=None, nodata=None):
+        """
+        Constructor
+        :param array: 2D elevation array
+        :param transform: affine transform of the array's pixel grid (rasterio convention)
+        :param crs: coordinate reference system of the source dataset
+        :param nodata: no data value of the source dataset
+        """
+        self.array = array
+        self.transform = transform
+        self.crs = crs
+        self.nodata = nodata
+
+    def PixelSize(self):
+        # (x, y) resolution, positive like GDAL's gt[1] and -gt[5]
+        return self.transform.a, -self.transform.e
+
+    def Write(self, path):
+        # Single-band GeoTIFF with this patch's georeferencing
+        height, width = self.array.shape
+        with rasterio.open(path, 'w', driver='GTiff', height=height, width=width, count=1,
+                           dtype=self.array.dtype, crs=self.crs, transform=self.transform, nodata=self.nodata) as dst:
+            dst.write(self.array, 1)
+
+
+def read_patch(src, posX, posY, size):
+    """
+    Crop a size x size window from an open dataset (in-memory crop_dem)
+    Windows reaching past the raster are clipped to it, with the transform of the clipped window.
+    :param src: open rasterio dataset
+    :return: DEMPatch of band 1
+    """
+    window = Window(posX, posY, size, size)
+    try:
+        window = window.intersection(Window(0, 0, src.width, src.height))
+    except rasterio.errors.WindowError:
+        raise ValueError("Window %s does not overlap the %dx%d raster" % ((posX, posY, size), src.width, src.height))
+    return DEMPatch(src.read(1, window=window), src.window_transform(window), src.crs, src.nodata)
+
+
+def resample_indices(length, out_size):
+    # Source pixel of each output pixel for nearest-neighbour resizing on the pixel-centre grid,
+    # the pixels scipy.ndimage.zoom(order=0, grid_mode=True) and so skimage's resize(order=0) pick
+    return np.minimum(np.floor((np.arange(out_size) + 0.5) * (length / out_size)).astype(np.int64), length - 1)
+
+
+def resize_patch(patch, new_size=NEW_SIZE):
+    """
+    Nearest-neighbour resize with the resolution scaled to match (in-memory resize_dem)
+    :param new_size: (width, height) of the output
+    :return: float32 DEMPatch
+    """
+    height, width = patch.array.shape
+    rows = resample_indices(height, new_size[1])
+    cols = resample_indices(width, new_size[0])
+    resized = patch.array[np.ix_(rows, cols)].astype(np.float32)
+
+    res_x, res_y = patch.PixelSize()
+    t = patch.transform
+    transform = Affine(res_x * width / new_size[0], t.b, t.c, t.d, -(res_y * height / new_size[1]), t.f)
+    return DEMPatch(resized, transform, patch.crs, patch.nodata)
+
+
+def compute_hazards(patch, min_kernel_size=MIN_KERNEL_SIZE):
+    """
+    Hazard layers of a resized patch
+    :return: slope (degrees), roughness and processed safety map (uint8, 1 = safe)
+    """
+    pixel_size_x = patch.PixelSize()[0]
+    slope_deg = calculate_slope(patch.array, pixel_size_x)
+    roughness_array = calculate_roughness(patch.array)
+    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    return slope_deg, roughness_array, postprocess_safety(safety_map, pixel_size_x, min_kernel_size)
+
+
+def largest_safe_blob(safety_map):
+    """
+    Largest external contour of the safe area and its centroid
+    :return: (contour, (cx, cy)) or (None, None) if there is no safe area
+    """
+    contours, _ = cv2.findContours(safety_map, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None, None
+    largest_contour = max(contours, key=cv2.contourArea)
+    M = cv2.moments(largest_contour)
+    if M['m00'] == 0: # degenerate blob (a line of pixels)
+        return largest_contour, None
+    return largest_contour, (int(M['m10'] / M['m00']), int(M['m01'] / M['m00']))
+
+
+def site_result(window, crop, resized, safety_map, keep=False):
+    # Per-window result; the centroid is also given in map coordinates (centre of the resized pixel)
+    contour, centroid = largest_safe_blob(safety_map)
+    result = {
+        'window': window,
+        'pixel_size': resized.PixelSize(),
+        'safety': safety_map,
+        'contour': contour,
+        'centroid': centroid,
+        'centroid_map': None if centroid is None else tuple(
+            float(v) for v in rasterio.transform.xy(resized.transform, centroid[1], centroid[0])),
+        'resized': resized,
+    }
+    if keep:
+        result['crop'] = crop
+    return result
+
+
+def process_window(src, posX, posY, size, new_size=NEW_SIZE, min_kernel_size=MIN_KERNEL_SIZE, keep=False):
+    """
+    Run the whole pipeline on one crop window of an open dataset
+    :param keep: also return the cropped DEMPatch, slope and roughness
+    :return: dict with window, pixel_size, safety, contour, centroid, centroid_map and resized (DEMPatch)
+    """
+    crop = read_patch(src, posX, posY, size)
+    resized = resize_patch(crop, new_size)
+    slope_deg, roughness_array, safety_map = compute_hazards(resized, min_kernel_size)
+    result = site_result((posX, posY, size), crop, resized, safety_map, keep)
+    if keep:
+        result.update({'slope': slope_deg, 'roughness': roughness_array})
+    return result
+
+
+def process_windows(source, windows, new_size=NEW_SIZE, min_kernel_size=MIN_KERNEL_SIZE, keep=False):
+    """
+    Run the pipeline on many crop windows of one dataset, opened once
+    The resized patches are classified as one stack; results are the same as process_window's
+    (without slope and roughness).
+    :param source: DEM path or open rasterio dataset
+    :param windows: sequence of (posX, posY, size)
+    :return: list of process_window results in the order of windows
+    """
+    if isinstance(source, str):
+        with rasterio.open(source) as src:
+            return process_windows(src, windows, new_size, min_kernel_size, keep)
+
+    crops = [read_patch(source, *window) for window in windows]
+    resized = [resize_patch(crop, new_size) for crop in crops]
+    if not resized:
+        return []
+    safety_maps = compute_safety_map_batch(np.stack([patch.array for patch in resized]),
+                                           [patch.PixelSize()[0] for patch in resized], min_kernel_size)
+    return [site_result(tuple(window), crop, patch, safety_map, keep)
+            for window, crop, patch, safety_map in zip(windows, crops, resized, safety_maps)]
+
+
+def write_outputs(result, out_dir):
+    # The files the script used to produce: crop.tif (needs keep=True), resized.tif and safetymap.png
+    import matplotlib.pyplot as plt
+
+    os.makedirs(out_dir, exist_ok=True)
+    if 'crop' in result:
+        result['crop'].Write(os.path.join(out_dir, 'crop.tif'))
+    result['resized'].Write(os.path.join(out_dir, 'resized.tif'))
+    plt.imsave(os.path.join(out_dir, 'safetymap.png'), result['safety'], cmap='gray', vmin=0, vmax=1)
+
+
+def show_result(result):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(8, 6))
+    plt.imshow(result['safety'], cmap='gray')
+    if result['contour'] is not None:
+        contour = result['contour']
+        plt.plot(contour[:, 0, 0], contour[:, 0, 1], color='red', linewidth=2)
+    if result['centroid'] is not None:
+        plt.scatter(*result['centroid'], color='blue', s=100, label='Centroid')
+        plt.legend()
+    plt.title('Largest Blob with Centroid')
+    plt.axis('off')
+    plt.show()
+
+
+# File-based route of the original script, used as the reference by --compare (needs GDAL and scikit-image)
 def crop_dem(input_filename, output_filename, posX, posY, size):
     with rasterio.open(input_filename) as src:
-
-        # The size in pixels of your desired window
-        #xsize, ysize = 400, 400
-
-        # Generate a random window origin (upper left) that ensures the window
-        # doesn't go outside the image. i.e. origin can only be between
-        # 0 and image width or height less the window width or height
-        # xmin, xmax = 0, src.width - size
-        # ymin, ymax = 0, src.height - size
-        # xoff, yoff = random.randint(xmin, xmax), random.randint(ymin, ymax)
-
         # Create a Window and calculate the transform from the source dataset
-        # window = Window(xoff, yoff, size, size)
         window = Window(posX, posY, size, size)
         transform = src.window_transform(window)
 
@@ -36,7 +227,11 @@ def crop_dem(input_filename, output_filename, posX, posY, size):
             # Read the data from the window and write it to the output raster
             dst.write(src.read(window=window))
 
+
 def resize_dem(input_dem_path, output_dem_path, new_size):
+    from osgeo import gdal
+    from skimage.transform import resize
+
     # Open the input DEM file
     input_dataset = gdal.Open(input_dem_path, gdal.GA_ReadOnly)
 
@@ -93,166 +288,133 @@ def resize_dem(input_dem_path, output_dem_path, new_size):
     output_dataset = None
 
 
-# Example usage:
-input_dem = 'DEMS/dem2.tif'
-output_dem = 'DEMS/crop.tif'
-crop_dem(input_dem, output_dem, 1500, 1025, 200)
-
-# Specify the paths and parameters
-input_dem_path = 'DEMS/crop.tif'
-output_dem_path = 'DEMS/resized.tif'
-new_size = (64,64)
-
-# Call the resize_dem function
-resize_dem(input_dem_path, output_dem_path, new_size)
-
-dem_path = './DEMS/resized.tif'
-ds = gdal.Open(dem_path)
-print("'ds' type", type(ds))
-
-print("Projection: ", ds.GetProjection())  # get projection
-print("Columns:", ds.RasterXSize)  # number of columns
-print("Rows:", ds.RasterYSize)  # number of rows
-print("Band count:", ds.RasterCount)  # number of bands
-
-print("GeoTransform", ds.GetGeoTransform())
-
-dem_array = ds.GetRasterBand(1).ReadAsArray()
-# dem_array.shape     
-# dem_array.dtype
-
-print(np.min(dem_array))
-
-print(np.max(dem_array))
-
-# plt.figure(figsize=(5, 5))
-# plt.imshow(dem_array,cmap="bone")
-# plt.colorbar()
-# plt.title("Complete terrain DEM")
-
-ndv = data_array = ds.GetRasterBand(1).GetNoDataValue()
-print('No data value:', ndv)
-
-# Get the GeoTransform and calculate pixel size
-gt = ds.GetGeoTransform()
-pixel_size_x = gt[1]
-pixel_size_y = -gt[5]  # Note the negative sign for y pixel size
-
-# Calculate slope using NumPy gradient
-dzdx, dzdy = np.gradient(dem_array, pixel_size_x)
-slope_rad = np.arctan(np.sqrt(dzdx**2 + dzdy**2))
-
-# Convert slope to degrees
-slope_deg = np.degrees(slope_rad)
-
-# Visualize the slope map
-# plt.figure(figsize=(5, 5))
-# plt.imshow(slope_deg, cmap='YlOrBr', vmin=0, vmax=np.percentile(slope_deg, 100))  # Adjust the color scale if needed
-# plt.colorbar(label='Slope (degrees)')
-# plt.title('Slope Map')
-# plt.show()
-
-# Function to calculate roughness for a neighborhood
-def calculate_roughness(arr, pixel_size):
-    central_pixel = arr[len(arr) // 2]  # Get the central pixel value
-    max_difference = np.max(np.abs(arr - central_pixel))   # Calculate the maximum difference
-    return max_difference
-
-# Define the size of the neighborhood (e.g., 3x3)
-neighborhood_size = 3
-
-# Calculate surface roughness using a moving window
-roughness_array = generic_filter(dem_array, calculate_roughness, size=neighborhood_size, extra_arguments=(pixel_size_x,))
-
-# Visualize the DEM and mark the areas with higher surface roughness
-# plt.figure(figsize=(5, 5))
-# plt.imshow(roughness_array, cmap='gray',vmin=0, vmax=np.percentile(roughness_array, 100))
-# plt.colorbar(label='Elevation')
-# plt.show()
-
-# Function to classify safety based on slope and roughness
-def classify_safety(slope, roughness):
-    safe_mask = np.logical_and(slope < 5, roughness < pixel_size_x)
-    return safe_mask
-
-# Classify safety based on slope and roughness criteria
-safety_map = classify_safety(slope_deg, roughness_array)
-
-# Visualize the safety map
-# plt.figure(figsize=(5, 5))
-# plt.imshow(safety_map, cmap='gray', vmin=0, vmax=1)
-# plt.colorbar(label='Safety (1: Safe, 0: Not Safe)')
-# plt.title('Safety Map')
-# plt.show()
-
-# Function to apply post-processing steps
-def postprocess_safety(safety_map):
-    # Define the kernel for morphological operations
-    kernel_size = max(2,int(15/pixel_size_x))  # Adjust as needed
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
-
-    # Perform opening operation
-    safety_map_opened = cv2.morphologyEx(safety_map.astype(np.uint8), cv2.MORPH_OPEN, kernel)
-
-    return safety_map_opened
-
-# Post-process the safety map
-safety_map_processed = postprocess_safety(safety_map)
-
-
-# Visualize the processed safety map
-# plt.figure(figsize=(5, 5))
-plt.imsave("DEMS/safetymap.png", safety_map_processed, cmap='gray', vmin=0, vmax=1)
-# plt.imshow(safety_map_processed, cmap='gray', vmin=0, vmax=1)
-# plt.colorbar(label='Safety (1: Safe, 0: Not Safe)')
-# plt.title('Processed Safety Map')
-# plt.show()
-
-# # Visualize the DEM and the processed safety map side by side
-# fig, axes = plt.subplots(1, 4, figsize=(20, 5))
-
-# # Plot the original DEM
-# axes[0].imshow(dem_array, cmap='bone', vmin=np.percentile(dem_array, 2), vmax=np.percentile(dem_array, 98))
-# axes[0].set_title('Original DEM')
-
-# axes[1].imshow(slope_deg, cmap='YlOrBr', vmin=0, vmax=np.percentile(slope_deg, 100))  # Adjust the color scale if needed
-# axes[1].set_title('Slope Map')
-
-# axes[2].imshow(roughness_array, cmap='gray',vmin=0, vmax=np.percentile(roughness_array, 100))
-# axes[2].set_title('Roughness Map')
-
-# # Plot the processed safety map
-# axes[3].imshow(safety_map_processed, cmap='gray', vmin=0, vmax=1)
-# axes[3].set_title('Processed Safety Map')
-
-# plt.show()
-
-# Step 1: Load the binary image
-image = cv2.imread('DEMS/safetymap.png', cv2.IMREAD_GRAYSCALE)
-
-# Step 2: Find contours
-contours, _ = cv2.findContours(image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-# Step 3: Determine the largest blob
-if contours != None:
-  largest_contour = max(contours, key=cv2.contourArea)
-
-  # Step 4: Find a point in the interior of the largest blob
-  M = cv2.moments(largest_contour)
-  cx = int(M['m10'] / M['m00'])
-  cy = int(M['m01'] / M['m00'])
-
-  # Step 5: Plot the image with the identified blob and the point
-  plt.figure(figsize=(8, 6))
-  plt.imshow(image, cmap='gray')
-  plt.plot(largest_contour[:, 0, 0], largest_contour[:, 0, 1], color='red', linewidth=2)
-  plt.scatter(cx, cy, color='blue', s=100, label='Centroid')
-  plt.title('Largest Blob with Centroid')
-  plt.legend()
-  plt.axis('off')
-  plt.show()
-
-  # Print the centroid coordinates
-  print("Centroid coordinates (x, y):", (cx, cy))
+def legacy_process(input_dem, posX, posY, size, work_dir, new_size=NEW_SIZE, min_kernel_size=MIN_KERNEL_SIZE):
+    """
+    The original script for one window: crop.tif -> resized.tif -> safetymap.png -> contours
+    :return: (resized DEM, pixel_size_x, safety map as read back from the PNG, centroid or None)
+    """
+    from osgeo import gdal
+    import matplotlib.pyplot as plt
+
+    crop_path = os.path.join(work_dir, 'crop.tif')
+    resized_path = os.path.join(work_dir, 'resized.tif')
+    png_path = os.path.join(work_dir, 'safetymap.png')
+    crop_dem(input_dem, crop_path, posX, posY, size)
+    resize_dem(crop_path, resized_path, new_size)
+
+    ds = gdal.Open(resized_path)
+    dem_array = ds.GetRasterBand(1).ReadAsArray()
+    pixel_size_x = ds.GetGeoTransform()[1]
+    ds = None
+
+    slope_deg = calculate_slope(dem_array, pixel_size_x)
+    roughness_array = calculate_roughness(dem_array)
+    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    safety_map_processed = postprocess_safety(safety_map, pixel_size_x, min_kernel_size=min_kernel_size)
+    plt.imsave(png_path, safety_map_processed, cmap='gray', vmin=0, vmax=1)
+
+    image = cv2.imread(png_path, cv2.IMREAD_GRAYSCALE)
+    _, centroid = largest_safe_blob(image)
+    return dem_array, pixel_size_x, image, centroid
+
+
+def compare(input_dem, windows, repeat=3):
+    """
+    Run the windows through the file-based route and the in-memory pipeline, check that they agree
+    and time both (best of repeat, per window)
+    """
+    mismatches = 0
+    legacy_best = single_best = batch_best = float('inf')
+    with tempfile.TemporaryDirectory() as work_dir:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            legacy = [legacy_process(input_dem, *window, work_dir) for window in windows]
+            legacy_best = min(legacy_best, time.perf_counter() - start)
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with rasterio.open(input_dem) as src:
+            single = [process_window(src, *window) for window in windows]
+        single_best = min(single_best, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch = process_windows(input_dem, windows)
+        batch_best = min(batch_best, time.perf_counter() - start)
+
+    for (dem_array, pixel_size_x, image, centroid), one, many in zip(legacy, single, batch):
+        for result in (one, many):
+            if not (np.array_equal(dem_array, result['resized'].array, equal_nan=True)
+                    and pixel_size_x == result['pixel_size'][0]
+                    and np.array_equal(image != 0, result['safety'] != 0)
+                    and centroid == result['centroid']):
+                mismatches += 1
+
+    count = len(windows)
+    return {
+        'windows': count,
+        'mismatches': mismatches,
+        'legacy_ms': legacy_best / count * 1e3,
+        'in_memory_ms': single_best / count * 1e3,
+        'batch_ms': batch_best / count * 1e3,
+        'speedup': legacy_best / single_best,
+        'batch_speedup': legacy_best / batch_best,
+    }
+
+
+def random_windows(width, height, count, size, seed=0):
+    # Windows fully inside the raster, like the script's commented-out random crop
+    rng = np.random.default_rng(seed)
+    size = min(size, width, height)
+    return [(int(x), int(y), size) for x, y in zip(rng.integers(0, width - size + 1, count),
+                                                   rng.integers(0, height - size + 1, count))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hazard map and landing site of DEM crop windows, in memory")
+    parser.add_argument('input_dem', nargs='?', default='DEMS/dem2.tif', help="input DEM GeoTIFF")
+    parser.add_argument('--window', type=int, nargs=3, metavar=('X', 'Y', 'SIZE'), default=None,
+                        help="crop window (default: the script's 1500 1025 200)")
+    parser.add_argument('--windows', default=None, help="CSV of x,y,size crop windows, processed as a batch")
+    parser.add_argument('--write', default=None, help="directory for crop.tif, resized.tif and safetymap.png (single window)")
+    parser.add_argument('--show', action='store_true', help="plot the largest blob and its centroid (single window)")
+    parser.add_argument('--json', default=None, help="write the centroids to this JSON file")
+    parser.add_argument('--compare', type=int, default=0, metavar='N',
+                        help="time N random windows against the file-based route and check that the results match")
+    parser.add_argument('--compare-size', type=int, default=200, help="window size for --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        with rasterio.open(args.input_dem) as src:
+            windows = random_windows(src.width, src.height, args.compare, args.compare_size)
+        print(json.dumps(compare(args.input_dem, windows), indent=2))
+        return
 
-ds = None
\ No newline at end of file
+    if args.windows:
+        windows = [tuple(int(v) for v in row) for row in np.loadtxt(args.windows, delimiter=',', ndmin=2)]
+        start = time.perf_counter()
+        results = process_windows(args.input_dem, windows)
+        elapsed = time.perf_counter() - start
+    else:
+        with rasterio.open(args.input_dem) as src:
+            start = time.perf_counter()
+            results = [process_window(src, *(args.window or (1500, 1025, 200)), keep=args.write is not None)]
+            elapsed = time.perf_counter() - start
+        if args.write:
+            write_outputs(results[0], args.write)
+        if args.show:
+            show_result(results[0])
+
+    for result in results:
+        print("Window %s: pixel size %.3f, centroid %s, map %s" % (
+            result['window'], result['pixel_size'][0], result['centroid'], result['centroid_map']))
+    print("Processed %d windows in %.1f ms" % (len(results), elapsed * 1e3))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{'window': list(r['window']), 'pixel_size': list(r['pixel_size']),
+                        'centroid': r['centroid'] and list(r['centroid']),
+                        'centroid_map': r['centroid_map'] and list(r['centroid_map'])} for r in results], f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# FOV-keyed cache of hazard maps for the server
+#
+# The safety map of a FOV only depends on (fovX, fovZ, size), so it can be shared between
+# requests and landers. Keys are snapped to a configurable quantization step, entries are
+# evicted LRU (and optionally after a TTL), and during descent a new FOV that lies inside a
+# recently cached, barely larger FOV is answered by resampling that map instead of recomputing.
+# Maps can also be stored speculatively (see HazardPrefetch.py): such entries are counted as prefetch
+# hits when a request uses them and as wasted when they are evicted or expire unused, and a request
+# for a FOV that is still being prefetched waits for that computation instead of repeating it.
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class HazardCache():
+    def __init__(self, computeFn, maxEntries=1024, ttl=None, quantization=1, reuseTolerance=0.0,
+                 reuseSearch=32, outputSize=64):
+        """
+        Constructor
+        :param computeFn: function (fovX, fovZ, size) -> (safety map or None, pixel size, cropped shape)
+        :param maxEntries: maximum number of cached maps
+        :param ttl: seconds after which an entry is discarded, None keeps entries until evicted
+        :param quantization: FOV origin and size are snapped to multiples of this many DEM pixels (1 = exact)
+        :param reuseTolerance: reuse a cached map whose FOV contains the new one and is at most
+                               (1 + reuseTolerance) times larger; 0 disables reuse
+        :param reuseSearch: number of most recently used entries searched for a containing FOV
+        :param outputSize: edge length of the safety maps
+        """
+        self.computeFn = computeFn
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.quantization = max(1, int(quantization))
+        self.reuseTolerance = reuseTolerance
+        self.reuseSearch = reuseSearch
+        self.outputSize = outputSize
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.reused = 0
+        self.misses = 0
+
+        self.prefetched = {}   # keys of prefetched entries no request has used yet
+        self.inflight = {}     # key -> Event of maps being prefetched
+        self.prefetchStored = 0
+        self.prefetchHits = 0
+        self.prefetchLate = 0  # prefetch hits that had to wait for the computation to finish
+        self.prefetchWasted = 0
+
+    def Quantize(self, fovX, fovZ, size):
+        q = self.quantization
+        if q == 1:
+            return fovX, fovZ, size
+        return (fovX // q) * q, (fovZ // q) * q, max(1, int(round(size / q)) * q)
+
+    def Lookup(self, fovX, fovZ, size):
+        """
+        Return the hazard map for a FOV, from the cache when possible
+        :return: (fovX, fovZ, size, safety map or None, pixel size) with the FOV after quantization
+        """
+        fovX, fovZ, size = self.Quantize(fovX, fovZ, size)
+        key = (fovX, fovZ, size)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if self.ttl is None or now - entry[3] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    self.UsePrefetched(key)
+                    return fovX, fovZ, size, entry[0], entry[1]
+                del self.entries[key]
+                self.Discard(key)
+            pending = self.inflight.get(key)
+            container = None
+            if pending is None and self.reuseTolerance > 0:
+                container = self.FindContaining(fovX, fovZ, size, now)
+                if container is not None:
+                    self.UsePrefetched(container[0])
+
+        if pending is not None:
+            # Being prefetched: wait for it rather than computing the same map twice
+            pending.wait()
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    if self.UsePrefetched(key):
+                        self.prefetchLate += 1
+                    return fovX, fovZ, size, entry[0], entry[1]
+
+        if container is not None:
+            safety_map, pixel_size_x, shape = self.Resample(container, fovX, fovZ, size)
+            with self.lock:
+                self.reused += 1
+        else:
+            safety_map, pixel_size_x, shape = self.computeFn(fovX, fovZ, size)
+            with self.lock:
+                self.misses += 1
+
+        with self.lock:
+            self.Store(key, (safety_map, pixel_size_x, shape, now))
+        return fovX, fovZ, size, safety_map, pixel_size_x
+
+    def LookupBatch(self, fovs, computeBatchFn):
+        """
+        Lookup for many FOVs, computing all misses with one call (see server.TerrainProcessBatch)
+        Misses are reused from maps cached before the batch, FOVs repeated within the batch are computed
+        once, and FOVs that are being prefetched are computed again rather than waited for.
+        :param fovs: sequence of (fovX, fovZ, size)
+        :param computeBatchFn: function (list of FOVs) -> list of computeFn results
+        :return: list of Lookup results
+        """
+        keys = [self.Quantize(*fov) for fov in fovs]
+        now = time.monotonic()
+        results = [None] * len(keys)
+        pending = {} # key -> indices of the FOVs it answers
+        containers = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in pending:
+                    self.hits += 1 # repeated within the batch: answered by the first computation
+                    pending[key].append(i)
+                    continue
+                entry = self.entries.get(key)
+                if entry is not None and (self.ttl is None or now - entry[3] <= self.ttl):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    self.UsePrefetched(key)
+                    results[i] = key + (entry[0], entry[1])
+                    continue
+                if entry is not None:
+                    del self.entries[key]
+                    self.Discard(key)
+                pending[key] = [i]
+                container = self.FindContaining(*key, now) if self.reuseTolerance > 0 else None
+                if container is not None:
+                    self.UsePrefetched(container[0])
+                    containers[key] = container
+
+        computed = {key: self.Resample(container, *key) for key, container in containers.items()}
+        misses = [key for key in pending if key not in containers]
+        if misses:
+            computed.update(zip(misses, computeBatchFn(misses)))
+
+        with self.lock:
+            self.reused += len(containers)
+            self.misses += len(misses)
+            for key, indices in pending.items():
+                safety_map, pixel_size_x, shape = computed[key]
+                self.Store(key, (safety_map, pixel_size_x, shape, now))
+                for i in indices:
+                    results[i] = key + (safety_map, pixel_size_x)
+        return results
+
+    def Prefetch(self, fovX, fovZ, size):
+        """
+        Compute and store the map of a FOV that is expected to be requested soon
+        :return: True if a map was computed, False if the FOV is already cached or being computed
+        """
+        key = self.Quantize(fovX, fovZ, size)
+        with self.lock:
+            if key in self.entries or key in self.inflight:
+                return False
+            done = self.inflight[key] = threading.Event()
+        try:
+            safety_map, pixel_size_x, shape = self.computeFn(*key)
+            with self.lock:
+                self.Store(key, (safety_map, pixel_size_x, shape, time.monotonic()))
+                self.prefetched[key] = True
+                self.prefetchStored += 1
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            done.set()
+        return True
+
+    def Contains(self, key):
+        # True if a quantized FOV key is cached or being prefetched
+        with self.lock:
+            return key in self.entries or key in self.inflight
+
+    def Store(self, key, entry):
+        # Insert an entry and evict the least recently used ones. Caller holds the lock.
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.Discard(evicted)
+
+    def UsePrefetched(self, key):
+        # Count the first use of a prefetched entry. Caller holds the lock.
+        if self.prefetched.pop(key, None) is None:
+            return False
+        self.prefetchHits += 1
+        return True
+
+    def Discard(self, key):
+        # Count a prefetched entry that left the cache unused. Caller holds the lock.
+        if self.prefetched.pop(key, None) is not None:
+            self.prefetchWasted += 1
+
+    def FindContaining(self, fovX, fovZ, size, now):
+        # Search the most recently used entries for an unclipped FOV that contains this one
+        # and is at most (1 + reuseTolerance) times larger. Caller holds the lock.
+        searched = 0
+        for key in reversed(self.entries):
+            if searched >= self.reuseSearch:
+                break
+            searched += 1
+
+            x0, z0, size0 = key
+            safety_map, pixel_size_x, shape, stored = self.entries[key]
+            if safety_map is None or shape != (size0, size0) or x0 < 0 or z0 < 0:
+                continue
+            if self.ttl is not None and now - stored > self.ttl:
+                continue
+            if size0 > size * (1 + self.reuseTolerance):
+                continue
+            if x0 <= fovX and z0 <= fovZ and fovX + size <= x0 + size0 and fovZ + size <= z0 + size0:
+                return key, safety_map, pixel_size_x
+        return None
+
+    def Resample(self, container, fovX, fovZ, size):
+        # Nearest-neighbour sample the containing map over the new FOV
+        (x0, z0, _), safety_map, pixel_size0 = container
+        n = self.outputSize
+        centres = (np.arange(n) + 0.5) * (size / n)
+        cols = np.clip(((fovX - x0 + centres) / pixel_size0).astype(np.intp), 0, n - 1)
+        rows = np.clip(((fovZ - z0 + centres) / pixel_size0).astype(np.intp), 0, n - 1)
+        return safety_map[np.ix_(rows, cols)], size / n, (size, size)
+
+    def Stats(self):
+        """
+        Cache statistics
+        :return: dict with hits, reused, misses, hit_rate and entries
+        """
+        with self.lock:
+            lookups = self.hits + self.reused + self.misses
+            return {
+                'hits': self.hits,
+                'reused': self.reused,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.reused) / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+            }
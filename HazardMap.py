@@ -0,0 +1,316 @@
+# Shared hazard map engine used by server.py, TerrainScanning.py and DEMprocessing.py
+#
+# Every stage works on whole arrays at once (no per-pixel Python callbacks), and the
+# results are bit-identical to the original generic_filter based implementation, NaN
+# (void) cells included (benchmark.py --legacy checks this).
+
+import numpy as np
+import cv2
+
+# Slope threshold in degrees above which a cell is unsafe
+MAX_SAFE_SLOPE = 5
+
+# Size of the neighbourhood used for roughness (3x3)
+NEIGHBORHOOD_SIZE = 3
+
+
+# Function to calculate slope (degrees) using NumPy gradient
+def calculate_slope(dem_array, pixel_size_x):
+    dzdx, dzdy = np.gradient(dem_array, pixel_size_x)
+    slope_rad = np.arctan(np.sqrt(dzdx**2 + dzdy**2))
+    return np.degrees(slope_rad)
+
+
+# Sliding window maximum/minimum. cv2.dilate/erode with BORDER_REFLECT give the same values as scipy's
+# maximum_filter/minimum_filter(mode='reflect'), are faster on small maps and keep scipy.ndimage (about
+# a quarter second to import) off the server's start-up path. scipy remains the fallback for dtypes OpenCV
+# does not support and for arrays with NaN cells, which the two implementations order differently.
+CV_FILTER_DTYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+def use_cv_filter(array):
+    if array.dtype.type not in CV_FILTER_DTYPES:
+        return False
+    return array.dtype.kind != 'f' or not np.isnan(array).any()
+
+
+def maximum_filter(array, size):
+    if use_cv_filter(array):
+        return cv2.dilate(array, np.ones((size, size), np.uint8), borderType=cv2.BORDER_REFLECT)
+    from scipy.ndimage import maximum_filter as scipy_maximum_filter
+    return scipy_maximum_filter(array, size=size, mode='reflect')
+
+
+def minimum_filter(array, size):
+    if use_cv_filter(array):
+        return cv2.erode(array, np.ones((size, size), np.uint8), borderType=cv2.BORDER_REFLECT)
+    from scipy.ndimage import minimum_filter as scipy_minimum_filter
+    return scipy_minimum_filter(array, size=size, mode='reflect')
+
+
+# Function to calculate roughness as the maximum absolute difference between each
+# pixel and its neighbourhood.
+# max(|n - c|) over the window is max(max(n) - c, c - min(n)), so two separable
+# min/max filters replace the old generic_filter(calculate_roughness) callback.
+# Border handling ('reflect') and output dtype match generic_filter's defaults.
+def calculate_roughness(dem_array, neighborhood_size=NEIGHBORHOOD_SIZE):
+    window_max = maximum_filter(dem_array, neighborhood_size)
+    window_min = minimum_filter(dem_array, neighborhood_size)
+
+    # generic_filter hands the callback a float64 buffer, so difference in float64
+    # before casting back to the input dtype to keep the result bit-identical
+    centre = dem_array.astype(np.float64)
+    roughness = np.maximum(window_max.astype(np.float64) - centre, centre - window_min)
+    roughness = roughness.astype(dem_array.dtype, copy=False)
+
+    # The filters skip NaN, while the original np.max(np.abs(window - centre)) is NaN (so unsafe) for
+    # every window holding a void cell
+    if dem_array.dtype.kind == 'f':
+        voids = np.isnan(dem_array)
+        if voids.any():
+            roughness[maximum_filter(voids.view(np.uint8), neighborhood_size).view(bool)] = np.nan
+    return roughness
+
+
+# Function to classify safety based on slope and roughness
+def classify_safety(slope, roughness, pixel_size_x):
+    safe_mask = np.logical_and(slope < MAX_SAFE_SLOPE, roughness < pixel_size_x)
+    return safe_mask
+
+
+# Function to apply post-processing steps
+def postprocess_safety(safety_map, pixel_size_x, min_kernel_size=3):
+    # Define the kernel for morphological operations
+    kernel_size = max(min_kernel_size, int(15/pixel_size_x))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+
+    # Perform opening operation
+    safety_map_opened = cv2.morphologyEx(safety_map.astype(np.uint8), cv2.MORPH_OPEN, kernel)
+
+    return safety_map_opened
+
+
+def compute_safety_map(dem_array, pixel_size_x, min_kernel_size=3):
+    """
+    Run slope, roughness, thresholding and morphological opening over a DEM patch
+    :param dem_array: 2D elevation array (already resized to the working resolution)
+    :param pixel_size_x: size of one cell of dem_array in DEM units
+    :param min_kernel_size: lower bound of the opening kernel size
+    :return: uint8 array with 1 for safe cells and 0 for unsafe cells
+    """
+    slope_deg = calculate_slope(dem_array, pixel_size_x)
+    roughness_array = calculate_roughness(dem_array)
+    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    return postprocess_safety(safety_map, pixel_size_x, min_kernel_size)
+
+
+def rank_landing_sites(safety_map, k=1):
+    """
+    Top-k maximally inscribed safe points of a safety map, best first
+    The distance transform gives every safe cell its distance to the nearest unsafe cell (cells outside
+    the map count as unsafe), so its maxima are the centres of the largest safe disks and always lie
+    inside the safe area. Sites are taken in order of clearance, skipping local maxima that fall inside
+    the disk of a site already picked.
+    :param safety_map: 2D array, non-zero cells are safe
+    :param k: maximum number of sites
+    :return: (n, 3) float32 array of (x, y, clearance in cells) with n <= k, empty if nothing is safe
+    """
+    height, width = safety_map.shape
+    safe = np.zeros((height + 2, width + 2), dtype=np.uint8)
+    np.not_equal(safety_map, 0, out=safe[1:-1, 1:-1].view(bool))
+    distance = cv2.distanceTransform(safe, cv2.DIST_L2, cv2.DIST_MASK_5)[1:-1, 1:-1]
+    return pick_landing_sites(distance, k)
+
+
+def pick_landing_sites(distance, k=1):
+    # Sites from the distance transform of one safety map (see rank_landing_sites)
+    width = distance.shape[1]
+    if k == 1:
+        _, clearance, _, (x, y) = cv2.minMaxLoc(distance)
+        return np.array([[x, y, clearance]], dtype=np.float32) if clearance > 0 else np.empty((0, 3), np.float32)
+
+    # Local maxima (plateaus included), strongest first
+    flat = distance.ravel()
+    peaks = np.flatnonzero(flat == cv2.dilate(distance, None).ravel())
+    clearances = flat[peaks]
+    order = np.argsort(-clearances, kind='stable')
+    order = order[clearances[order] > 0]
+
+    sites = []
+    for index, clearance in zip(peaks[order].tolist(), clearances[order].tolist()):
+        y, x = divmod(index, width)
+        if all((x - sx) ** 2 + (y - sy) ** 2 >= sr * sr for sx, sy, sr in sites):
+            sites.append((x, y, clearance))
+            if len(sites) == k:
+                break
+    return np.array(sites, dtype=np.float32).reshape(-1, 3)
+
+
+# Conservative hazard map from per-cell elevation bounds (see DEMPyramid.py)
+# For any choice of one DEM sample per cell, np.gradient and calculate_roughness of the sampled grid
+# are bounded by the values below, so every cell that nearest-neighbour downsampling could classify
+# as unsafe is unsafe here as well, and hazards between the samples are no longer skipped.
+def gradient_bound(zmin, zmax, pixel_size_x):
+    # Upper bound of |np.gradient| along the first axis: central differences inside, one-sided at the edges
+    gradient = np.empty(zmin.shape, dtype=np.float64)
+    np.maximum(zmax[2:] - zmin[:-2], zmax[:-2] - zmin[2:], out=gradient[1:-1])
+    gradient[1:-1] /= 2 * pixel_size_x
+    gradient[0] = np.maximum(zmax[1] - zmin[0], zmax[0] - zmin[1]) / pixel_size_x
+    gradient[-1] = np.maximum(zmax[-1] - zmin[-2], zmax[-2] - zmin[-1]) / pixel_size_x
+    return gradient
+
+
+def calculate_slope_bound(zmin, zmax, pixel_size_x):
+    # Upper bound of calculate_slope (degrees) over every choice of elevation within the per-cell bounds
+    dzdx = gradient_bound(zmin, zmax, pixel_size_x)
+    dzdy = gradient_bound(zmin.T, zmax.T, pixel_size_x).T
+    return np.degrees(np.arctan(np.sqrt(dzdx**2 + dzdy**2)))
+
+
+def calculate_roughness_bound(zmin, zmax, neighborhood_size=NEIGHBORHOOD_SIZE):
+    # Upper bound of the maximum absolute difference between a cell and its neighbourhood
+    window_max = maximum_filter(zmax, neighborhood_size)
+    window_min = minimum_filter(zmin, neighborhood_size)
+    return np.maximum(window_max - zmin, zmax - window_min)
+
+
+def compute_conservative_safety_map(zmin, zmax, pixel_size_x, min_kernel_size=3):
+    """
+    compute_safety_map for a grid of cells given by their minimum and maximum elevation
+    :param zmin, zmax: 2D arrays of per-cell elevation bounds (e.g. DEMPyramid.Bounds)
+    :param pixel_size_x: size of one cell in DEM units
+    :return: uint8 array with 1 for safe cells and 0 for unsafe cells
+    """
+    slope_deg = calculate_slope_bound(zmin, zmax, pixel_size_x)
+    roughness_array = calculate_roughness_bound(zmin, zmax)
+    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    return postprocess_safety(safety_map, pixel_size_x, min_kernel_size)
+
+
+# Batched stages for stacks of equally sized maps, e.g. the (N, 64, 64) patches of many landers
+# (see server.compute_hazard_maps). Each map gets the same result as the single-map function with
+# its own pixel size; the work is done in a few whole-stack operations instead of N small ones.
+def calculate_slope_batch(dem_stack, pixel_sizes):
+    # calculate_slope of every map: np.gradient's central/one-sided differences with per-map spacing
+    dem_stack = np.asarray(dem_stack)
+    otype = dem_stack.dtype if dem_stack.dtype.kind == 'f' else np.dtype(np.float64)
+    dem_stack = dem_stack.astype(otype, copy=False)
+    # np.gradient divides by 2 * spacing (a Python float, i.e. in the array's precision) inside the map
+    spacing = np.asarray(pixel_sizes, dtype=np.float64).reshape(-1, 1, 1)
+    double = (2.0 * spacing).astype(otype)
+    single = spacing.astype(otype)
+
+    def gradient(axis):
+        out = np.empty_like(dem_stack)
+        inner = [slice(None)] * 3
+        inner[axis] = slice(1, -1)
+        ahead, behind = list(inner), list(inner)
+        ahead[axis], behind[axis] = slice(2, None), slice(None, -2)
+        np.divide(np.subtract(dem_stack[tuple(ahead)], dem_stack[tuple(behind)]), double, out=out[tuple(inner)])
+        for edge, a, b in ((0, 1, 0), (-1, -1, -2)):
+            index = [slice(None)] * 3
+            index[axis] = edge
+            first, second = list(index), list(index)
+            first[axis], second[axis] = a, b
+            out[tuple(index)] = (dem_stack[tuple(first)] - dem_stack[tuple(second)]) / single[:, :, 0]
+        return out
+
+    # Same operations as calculate_slope, in place to keep the stack's temporaries few
+    dzdx, dzdy = gradient(1), gradient(2)
+    np.square(dzdx, out=dzdx)
+    dzdx += np.square(dzdy, out=dzdy)
+    np.sqrt(dzdx, out=dzdx)
+    np.arctan(dzdx, out=dzdx)
+    return np.degrees(dzdx, out=dzdx)
+
+
+def calculate_roughness_batch(dem_stack, neighborhood_size=NEIGHBORHOOD_SIZE):
+    # calculate_roughness of every map. The maps are filtered as one tall image in which each map carries
+    # its own reflected rows above and below; the columns get the filters' reflect border directly.
+    dem_stack = np.asarray(dem_stack)
+    if not use_cv_filter(dem_stack):
+        return np.stack([calculate_roughness(dem, neighborhood_size) for dem in dem_stack])
+    count, height, width = dem_stack.shape
+    pad = neighborhood_size // 2
+    padded = np.pad(dem_stack, ((0, 0), (pad, pad), (0, 0)), mode='symmetric').reshape(-1, width)
+    kernel = np.ones((neighborhood_size, neighborhood_size), np.uint8)
+    inner = (slice(None), slice(pad, pad + height))
+    window_max = cv2.dilate(padded, kernel, borderType=cv2.BORDER_REFLECT).reshape(count, -1, width)[inner]
+    window_min = cv2.erode(padded, kernel, borderType=cv2.BORDER_REFLECT).reshape(count, -1, width)[inner]
+
+    # A float subtraction is correctly rounded, so differencing in the map's own float type gives the
+    # same result as calculate_roughness's float64 difference cast back; integer maps still go through float64
+    if dem_stack.dtype.kind == 'f':
+        return np.maximum(window_max - dem_stack, dem_stack - window_min)
+    centre = dem_stack.astype(np.float64)
+    roughness = np.maximum(window_max.astype(np.float64) - centre, centre - window_min)
+    return roughness.astype(dem_stack.dtype, copy=False)
+
+
+def postprocess_safety_batch(safety_stack, pixel_sizes, min_kernel_size=3):
+    """
+    postprocess_safety of every map
+    Maps sharing a kernel size are opened in one OpenCV call on a tall image with kernel-high separator
+    rows between them, set to the neutral value of each pass (1 for the erosion, 0 for the dilation).
+    :return: (N, height, width) uint8 stack
+    """
+    count, height, width = safety_stack.shape
+    kernel_sizes = np.maximum(min_kernel_size, (15 / np.asarray(pixel_sizes, dtype=np.float64)).astype(np.int64))
+    result = np.empty((count, height, width), dtype=np.uint8)
+    for kernel_size in np.unique(kernel_sizes).tolist():
+        members = np.flatnonzero(kernel_sizes == kernel_size)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
+        tall = np.empty((len(members), height + kernel_size, width), dtype=np.uint8)
+        tall[:, :height] = safety_stack[members]
+        tall[:, height:] = 1
+        eroded = cv2.erode(tall.reshape(-1, width), kernel).reshape(tall.shape)
+        eroded[:, height:] = 0
+        opened = cv2.dilate(eroded.reshape(-1, width), kernel).reshape(tall.shape)
+        result[members] = opened[:, :height]
+    return result
+
+
+def compute_safety_map_batch(dem_stack, pixel_sizes, min_kernel_size=3, chunk=32):
+    """
+    compute_safety_map for a stack of DEM patches
+    :param dem_stack: (N, height, width) elevation patches
+    :param pixel_sizes: (N,) cell size of each patch in DEM units
+    :param chunk: maps processed together; larger stacks are split so the float64 intermediates stay in cache
+    :return: (N, height, width) uint8 stack with 1 for safe cells and 0 for unsafe cells
+    """
+    pixel_sizes = np.asarray(pixel_sizes, dtype=np.float64)
+    result = np.empty(np.shape(dem_stack), dtype=np.uint8)
+    for start in range(0, len(result), chunk):
+        part = slice(start, start + chunk)
+        slope_deg = calculate_slope_batch(dem_stack[part], pixel_sizes[part])
+        roughness_array = calculate_roughness_batch(dem_stack[part])
+        # The single-map comparison with a Python float happens in the roughness precision
+        thresholds = pixel_sizes[part].astype(roughness_array.dtype if roughness_array.dtype.kind == 'f' else np.float64)
+        safety_map = classify_safety(slope_deg, roughness_array, thresholds.reshape(-1, 1, 1))
+        result[part] = postprocess_safety_batch(safety_map, pixel_sizes[part], min_kernel_size)
+    return result
+
+
+def rank_landing_sites_batch(safety_stack, k=1):
+    """
+    rank_landing_sites of every map, with one distance transform over the stack
+    The maps are stacked with a row of unsafe cells between them, which is the border each map gets on its own.
+    :return: list of (n, 3) float32 arrays of (x, y, clearance in cells)
+    """
+    count, height, width = safety_stack.shape
+    safe = np.zeros((count, height + 1, width + 2), dtype=np.uint8)
+    np.not_equal(safety_stack, 0, out=safe[:, 1:, 1:-1].view(bool))
+    tall = np.zeros((count * (height + 1) + 1, width + 2), dtype=np.uint8)
+    tall[:-1] = safe.reshape(-1, width + 2)
+    distance = cv2.distanceTransform(tall, cv2.DIST_L2, cv2.DIST_MASK_5)[:-1].reshape(count, height + 1, width + 2)
+    distance = distance[:, 1:, 1:-1]
+    if k != 1:
+        return [pick_landing_sites(d, k) for d in distance]
+
+    # First maximum in row-major order, like cv2.minMaxLoc
+    flat = distance.reshape(count, -1)
+    best = flat.argmax(axis=1)
+    clearance = flat[np.arange(count), best]
+    y, x = np.divmod(best, width)
+    return [np.array([[x[i], y[i], clearance[i]]], dtype=np.float32) if clearance[i] > 0
+            else np.empty((0, 3), np.float32) for i in range(count)]
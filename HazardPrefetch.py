@@ -0,0 +1,199 @@
+# Velocity-aware speculative computation of hazard maps for the server
+#
+# Landers that send their velocity with the position (see SafetyProtocol.encode_position) move
+# predictably between requests, so the FOVs of their next few positions can be computed in the
+# background while they fly there, and the next request finds its map in the HazardCache.
+#
+# Positions are extrapolated linearly over the lander's step time, the sim time between two of its
+# requests. It is estimated from the displacement along the velocity, so it follows the Unity time
+# scale and the server's coalescing without being configured. A single background thread computes the
+# predicted FOVs in order; when a lander sends a newer position, its predictions that were not
+# computed yet are replaced (counted as stale).
+#
+# The horizon (predicted positions per request) adapts to CPU headroom: every adaptInterval the process
+# CPU time is compared with the wall-clock time and the CPU budget. The horizon grows by one while more
+# than raiseHeadroom of the budget is idle and halves (down to 0, no prefetching) when less than
+# lowerHeadroom is idle or when most predictions go stale before the thread gets to them.
+#
+# Reported: hit rate (share of the requests for a FOV not cached by an earlier request that were served
+# from a prefetched map) and wasted work (prefetched maps evicted or expired without any request using them).
+
+import threading
+import time
+import weakref
+from collections import deque
+
+
+class LanderTrack():
+    def __init__(self, stepTime):
+        # Last position of one lander and the estimated sim time between its requests
+        self.position = None
+        self.stepTime = stepTime
+
+    def Update(self, position, velocity, smoothing=0.2):
+        # Plain floats: a handful of 3-vectors per request is cheaper without numpy
+        if self.position is not None:
+            speed2 = sum(v * v for v in velocity)
+            if speed2 > 1e-6:
+                step = sum((p - q) * v for p, q, v in zip(position, self.position, velocity)) / speed2
+                if 0 < step < 1:
+                    self.stepTime += smoothing * (step - self.stepTime)
+        self.position = position
+
+
+class HazardPrefetcher():
+    def __init__(self, cache, fovFn, maxHorizon=8, stepTime=0.02, cpuBudget=1.0, adaptInterval=1.0,
+                 raiseHeadroom=0.5, lowerHeadroom=0.2, maxQueue=256):
+        """
+        Constructor
+        :param cache: HazardCache the predicted maps are stored in
+        :param fovFn: function (x, altitude, z) -> (fovX, fovZ, size), e.g. server.getFOV
+        :param maxHorizon: maximum number of predicted positions per request
+        :param stepTime: initial sim time between requests (Unity fixedDeltaTime)
+        :param cpuBudget: CPU cores the server process may use; the serving loop and the prefetch
+                          thread share the GIL, so 1 unless the pool does most of the work
+        :param adaptInterval: seconds between horizon adjustments
+        :param raiseHeadroom: grow the horizon while more than this share of the budget is idle
+        :param lowerHeadroom: halve the horizon when less than this share of the budget is idle
+        :param maxQueue: predictions waiting to be computed, the oldest are dropped beyond this
+        """
+        self.cache = cache
+        self.fovFn = fovFn
+        self.maxHorizon = maxHorizon
+        self.stepTime = stepTime
+        self.cpuBudget = cpuBudget
+        self.adaptInterval = adaptInterval
+        self.raiseHeadroom = raiseHeadroom
+        self.lowerHeadroom = lowerHeadroom
+        self.maxQueue = maxQueue
+
+        self.horizon = min(1, maxHorizon)
+        self.headroom = 1.0
+        self.tracks = weakref.WeakKeyDictionary() # owner (e.g. LanderState) -> LanderTrack
+        self.queue = deque()                      # (track, quantized FOV)
+        self.condition = threading.Condition()
+
+        self.requests = 0
+        self.predicted = 0
+        self.skipped = 0   # predicted FOVs already cached, being computed or queued
+        self.stale = 0
+        self.dropped = 0
+        self.computed = 0
+        self.computeTime = 0.0
+        self.windowStale = 0
+        self.windowComputed = 0
+        self.lastWall = time.monotonic()
+        self.lastCpu = time.process_time()
+
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+    def Observe(self, owner, position, velocity):
+        """
+        Record a lander's position and queue the FOVs of its next positions
+        :param owner: per-lander object (e.g. server.LanderState); its newer positions replace its pending predictions
+        :param position: (x, altitude, z) in the server frame
+        :param velocity: (vx, vy, vz) in the same frame, per sim second
+        """
+        px, py, pz = position
+        vx, vy, vz = velocity
+        with self.condition:
+            track = self.tracks.get(owner)
+            if track is None:
+                track = self.tracks[owner] = LanderTrack(self.stepTime)
+            track.Update((px, py, pz), (vx, vy, vz))
+            self.requests += 1
+
+            # Predictions for positions the lander has passed are no longer useful
+            if any(entry[0] is track for entry in self.queue):
+                pending = len(self.queue)
+                self.queue = deque(entry for entry in self.queue if entry[0] is not track)
+                self.stale += pending - len(self.queue)
+                self.windowStale += pending - len(self.queue)
+
+            queued = {key for _, key in self.queue}
+            for k in range(1, self.horizon + 1):
+                dt = k * track.stepTime
+                y = py + vy * dt
+                if y <= 0:
+                    break
+                key = self.cache.Quantize(*self.fovFn(px + vx * dt, y, pz + vz * dt))
+                self.predicted += 1
+                if key in queued or self.cache.Contains(key):
+                    self.skipped += 1
+                    continue
+                queued.add(key)
+                self.queue.append((track, key))
+
+            while len(self.queue) > self.maxQueue:
+                self.queue.popleft()
+                self.dropped += 1
+            self.condition.notify()
+
+    def Run(self):
+        # Background thread: compute queued predictions and adapt the horizon
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait(self.adaptInterval)
+                    self.Adapt()
+                _, key = self.queue.popleft()
+            t0 = time.perf_counter()
+            computed = self.cache.Prefetch(*key)
+            with self.condition:
+                if computed:
+                    self.computed += 1
+                    self.windowComputed += 1
+                    self.computeTime += time.perf_counter() - t0
+                else:
+                    self.skipped += 1
+                self.Adapt()
+            time.sleep(0) # hand the GIL back to the serving loop between maps
+
+    def Adapt(self):
+        # Adjust the horizon to the CPU headroom of the last interval. Caller holds the condition.
+        now = time.monotonic()
+        if now - self.lastWall < self.adaptInterval:
+            return
+        cpu = time.process_time()
+        self.headroom = max(0.0, 1.0 - (cpu - self.lastCpu) / (now - self.lastWall) / self.cpuBudget)
+        self.lastWall, self.lastCpu = now, cpu
+
+        stale = self.windowStale / max(1, self.windowStale + self.windowComputed)
+        self.windowStale = self.windowComputed = 0
+        if self.headroom < self.lowerHeadroom or stale > 0.5:
+            self.horizon //= 2
+        elif self.headroom > self.raiseHeadroom and self.horizon < self.maxHorizon:
+            self.horizon += 1
+
+    def Stats(self):
+        """
+        Prefetch statistics
+        :return: dict with horizon, cpu_headroom, hit_rate, waste_rate and the underlying counts
+        """
+        with self.condition:
+            stats = {
+                'horizon': self.horizon,
+                'cpu_headroom': self.headroom,
+                'step_time': sum(t.stepTime for t in self.tracks.values()) / len(self.tracks) if self.tracks else self.stepTime,
+                'requests': self.requests,
+                'predicted': self.predicted,
+                'skipped': self.skipped,
+                'queued': len(self.queue),
+                'stale': self.stale,
+                'dropped': self.dropped,
+                'computed': self.computed,
+                'compute_ms': self.computeTime / self.computed * 1e3 if self.computed else 0.0,
+            }
+        with self.cache.lock:
+            stats.update({
+                'hits': self.cache.prefetchHits,
+                'late_hits': self.cache.prefetchLate,
+                'wasted': self.cache.prefetchWasted,
+                'unused': len(self.cache.prefetched),
+                'misses': self.cache.misses + self.cache.reused,
+            })
+        needed = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / needed if needed else 0.0
+        stats['waste_rate'] = stats['wasted'] / stats['computed'] if stats['computed'] else 0.0
+        return stats
@@ -0,0 +1,499 @@
+# Vectorized NumPy version of the training lander (TrainingLanderController.cs / TrainingAgentController.cs)
+#
+# Steps thousands of landers at once with the same observation, action and reward contract as the
+# Unity training scene, so rollouts no longer need a Unity instance per environment:
+#   observation (10): altitude, x - targetX, z - targetZ, velocity xyz, pitch (euler x), yaw (euler z),
+#                     angular velocity x, z
+#   action branches (2, 3, 3): main thruster off/on, pitch RCS none/+/-, yaw RCS none/+/-
+# One environment step is one ML-Agents decision: the action is repeated for DecisionPeriod (5)
+# physics steps of 0.02 s and the per-FixedUpdate rewards are summed.
+#
+# Rigid body dynamics follow the prefab (mass 15103 kg, angular drag 0.05, lunar gravity, thruster
+# and RCS application points); the inertia tensor and centre of mass are implicit in Unity and are
+# estimated from the colliders. Ground contact is a simplified inelastic contact with the four feet,
+# so touchdown is the least faithful part; use the parity command to measure the gap.
+#
+#   python LanderEnv.py bench --envs 4096
+#   python LanderEnv.py eval results/finalphase1a/LunarLander/LunarLander-5999955.onnx --envs 1024
+#   python LanderEnv.py parity unity_trajectories.csv     (CSV written by TrajectoryRecorder.cs)
+
+import argparse
+import time
+
+import numpy as np
+
+FIXED_DT = 0.02
+GRAVITY = 1.62
+MASS = 15103.0
+ANGULAR_DRAG = 0.05
+MAX_ANGULAR_VELOCITY = 7.0 # Unity default Rigidbody.maxAngularVelocity
+INERTIA = np.array([9.1e4, 5.2e4, 9.1e4]) # local principal moments estimated from the body capsule (kg m^2)
+CENTER_OF_MASS_Y = 3.9 # implicit centre of mass, dominated by the body capsule at y = 3.95
+
+MAIN_THRUST = 45000.0
+MAIN_THRUST_POINT_Y = 1.0
+RCS_THRUST = 450.0
+RCS_POINT_Y = 5.5
+RCS_SKIP_PROBABILITY = 0.2 # RCSThrusterControl skips a FixedUpdate 20% of the time
+
+# Lowest points of the four foot colliders (local frame) and the altitude raycast offset
+FEET = np.array([[4.6035, 0.162, 0.078], [-4.6035, 0.162, 0.078], [0.078, 0.162, 4.6035], [0.078, 0.162, -4.6035]])
+RAYCAST_OFFSET = 0.5
+CRASH_SPEED = 2.0
+SLEEP_ENERGY = 0.005 # DynamicsManager sleep threshold (mass-normalized kinetic energy)
+SLEEP_STEPS = 20 # PhysX keeps a body awake for 0.4 s once it is below the threshold
+
+OBSERVATION_SIZE = 10
+ACTION_BRANCHES = (2, 3, 3)
+DECISION_PERIOD = 5
+MAX_STEP = 6000
+
+
+def rotation_from_euler(x, y, z):
+    # Unity euler angles (degrees) to rotation matrices, rotation order Z, X, Y: R = Ry Rx Rz
+    x, y, z = np.radians(x), np.radians(y), np.radians(z)
+    cx, sx, cy, sy, cz, sz = np.cos(x), np.sin(x), np.cos(y), np.sin(y), np.cos(z), np.sin(z)
+    R = np.empty(x.shape + (3, 3))
+    R[..., 0, 0] = cy * cz + sy * sx * sz
+    R[..., 0, 1] = -cy * sz + sy * sx * cz
+    R[..., 0, 2] = sy * cx
+    R[..., 1, 0] = cx * sz
+    R[..., 1, 1] = cx * cz
+    R[..., 1, 2] = -sx
+    R[..., 2, 0] = -sy * cz + cy * sx * sz
+    R[..., 2, 1] = sy * sz + cy * sx * cz
+    R[..., 2, 2] = cy * cx
+    return R
+
+
+def euler_from_rotation(R):
+    # Inverse of rotation_from_euler, angles in (-180, 180] like TrainingLanderController.GetRotation
+    x = np.degrees(np.arcsin(np.clip(-R[..., 1, 2], -1, 1)))
+    y = np.degrees(np.arctan2(R[..., 0, 2], R[..., 2, 2]))
+    z = np.degrees(np.arctan2(R[..., 1, 0], R[..., 1, 1]))
+    return x, y, z
+
+
+def reference_velocity(altitude):
+    return 0.3 - 0.5 * np.sqrt(np.maximum(altitude + 1, 0))
+
+
+def vertical_velocity_reward(velocity, reference):
+    deviation = reference - velocity
+    result = 1 - np.abs(deviation)
+    return np.where(deviation > 1, 0.1 * result, result)
+
+
+def horizontal_deviation_reward(position, target, velocity):
+    deviation = position - target
+    target_velocity = -0.45 * np.sign(deviation) * np.abs(deviation) ** 0.45
+    velocity_deviation = velocity - target_velocity
+    result = 1 - np.abs(velocity_deviation)
+    return np.where(velocity_deviation > 1, 0.2 * result, result)
+
+
+def attitude_reward(tilt):
+    return -2 * np.abs(np.tanh(0.1 * np.abs(tilt))) + 1
+
+
+class LanderVecEnv():
+    def __init__(self, numEnvs, seed=None, decisionPeriod=DECISION_PERIOD, maxStep=MAX_STEP, stochasticRcs=True):
+        """
+        Constructor
+        :param numEnvs: number of landers stepped together
+        :param seed: seed of the reset / RCS randomness
+        :param decisionPeriod: physics steps per decision (DecisionRequester.DecisionPeriod)
+        :param maxStep: physics steps before an episode is truncated (Agent.MaxStep)
+        :param stochasticRcs: skip RCS firing at random like Unity; False applies the expected thrust
+                              every step instead (deterministic, used by the parity check)
+        """
+        self.numEnvs = numEnvs
+        self.decisionPeriod = decisionPeriod
+        self.maxStep = maxStep
+        self.stochasticRcs = stochasticRcs
+        self.rng = np.random.default_rng(seed)
+
+        self.observation_shape = (OBSERVATION_SIZE,)
+        self.action_nvec = ACTION_BRANCHES
+
+        self.position = np.zeros((numEnvs, 3))
+        self.velocity = np.zeros((numEnvs, 3))
+        self.angularVelocity = np.zeros((numEnvs, 3))
+        self.rotation = np.tile(np.eye(3), (numEnvs, 1, 1))
+        self.target = np.zeros((numEnvs, 2))
+        self.stepCount = np.zeros(numEnvs, dtype=np.int64)
+        self.sleepCount = np.zeros(numEnvs, dtype=np.int64)
+        self.onGround = np.zeros(numEnvs, dtype=bool)
+        self.episodeReturn = np.zeros(numEnvs)
+
+    def ResetIndices(self, idx):
+        # TrainingLanderController.ResetPosition
+        n = len(idx)
+        if n == 0:
+            return
+        rng = self.rng
+        altitude = rng.uniform(600, 700, n)
+        vref = reference_velocity(altitude)
+        self.position[idx] = np.stack([np.full(n, 500.0), altitude - RAYCAST_OFFSET, np.full(n, 500.0)], axis=1)
+        self.rotation[idx] = rotation_from_euler(rng.uniform(-5, 5, n), np.zeros(n), rng.uniform(-5, 5, n))
+        self.velocity[idx] = np.stack([np.zeros(n), rng.uniform(vref, vref + 2), np.zeros(n)], axis=1)
+        self.angularVelocity[idx] = 0
+        self.target[idx] = 500.0 + rng.uniform(-30, 30, (n, 2))
+        self.stepCount[idx] = 0
+        self.sleepCount[idx] = 0
+        self.onGround[idx] = False
+        self.episodeReturn[idx] = 0
+
+    def SetState(self, idx, position, euler, velocity, angularVelocity, target):
+        """
+        Place landers in a given state (e.g. taken from a Unity recording)
+        :param position: (n, 3) x, altitude, z as reported by GetPosition
+        :param euler: (n, 3) GetRotation angles in degrees
+        """
+        position = np.array(position, dtype=float)
+        position[:, 1] -= RAYCAST_OFFSET
+        euler = np.asarray(euler, dtype=float)
+        self.position[idx] = position
+        self.rotation[idx] = rotation_from_euler(euler[:, 0], euler[:, 1], euler[:, 2])
+        self.velocity[idx] = velocity
+        self.angularVelocity[idx] = angularVelocity
+        self.target[idx] = target
+        self.sleepCount[idx] = 0
+        self.onGround[idx] = self.LowestFoot()[idx] <= 1e-6
+
+    def Altitude(self):
+        return self.position[:, 1] + RAYCAST_OFFSET
+
+    def LowestFoot(self):
+        # World height of the lowest foot (ground plane at 0)
+        return self.position[:, 1] + (self.rotation[:, 1, :] @ FEET.T).min(axis=1)
+
+    def Euler(self):
+        return euler_from_rotation(self.rotation)
+
+    def Observe(self):
+        # TrainingAgentController.CollectObservations
+        pitch, _, yaw = self.Euler()
+        obs = np.empty((self.numEnvs, OBSERVATION_SIZE), dtype=np.float32)
+        obs[:, 0] = self.Altitude()
+        obs[:, 1] = self.position[:, 0] - self.target[:, 0]
+        obs[:, 2] = self.position[:, 2] - self.target[:, 1]
+        obs[:, 3:6] = self.velocity
+        obs[:, 6] = pitch
+        obs[:, 7] = yaw
+        obs[:, 8] = self.angularVelocity[:, 0]
+        obs[:, 9] = self.angularVelocity[:, 2]
+        return obs
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.ResetIndices(np.arange(self.numEnvs))
+        return self.Observe(), {}
+
+    def PhysicsStep(self, actions, active):
+        """
+        One FixedUpdate of every active lander
+        :param actions: (N, 3) int actions
+        :param active: (N,) bool, landers whose episode is still running in this decision
+        :return: (reward, terminated) for this physics step
+        """
+        n = self.numEnvs
+        reward = np.where(active, -2.0 / self.maxStep, 0.0) # OnActionReceived
+        terminated = np.zeros(n, dtype=bool)
+        endReward = np.zeros(n)
+
+        altitude = self.Altitude()
+        pitch, _, yaw = self.Euler()
+        vx, vy, vz = self.velocity.T
+
+        # Out of bounds
+        escaped = active & (altitude > 1200)
+        endReward[escaped] = -1
+        terminated |= escaped
+
+        # Shaping rewards
+        step = np.where(vy > -0.2, -10.0, vertical_velocity_reward(vy, reference_velocity(altitude)))
+        step += horizontal_deviation_reward(self.position[:, 0], self.target[:, 0], vx)
+        step += horizontal_deviation_reward(self.position[:, 2], self.target[:, 1], vz)
+        high = altitude > 2
+        for tilt in (attitude_reward(pitch), attitude_reward(yaw)):
+            step += np.where(high, tilt, np.minimum(0, tilt))
+        reward += np.where(active, step, 0.0)
+
+        # Landing check on a sleeping body
+        landed = active & ~terminated & (self.sleepCount >= SLEEP_STEPS) & (altitude < 1)
+        upright = (np.abs(pitch) < 20) & (np.abs(yaw) < 20)
+        distance = np.hypot(self.position[:, 0] - self.target[:, 0], self.position[:, 2] - self.target[:, 1])
+        endReward[landed & upright & (distance <= 20)] = 1000
+        terminated |= landed
+
+        # Actuators (forces and torques in the lander frame, about the centre of mass)
+        powered = active & (altitude > 0.5)
+        thrust = powered & (actions[:, 0] == 1)
+        reward -= 0.03 * thrust
+
+        if self.stochasticRcs:
+            rcsScale = (self.rng.random(n) >= RCS_SKIP_PROBABILITY).astype(float)
+        else:
+            rcsScale = np.full(n, 1 - RCS_SKIP_PROBABILITY)
+        rcsScale *= powered
+        reward -= 0.003 * rcsScale
+
+        pitchDir = np.select([actions[:, 1] == 1, actions[:, 1] == 2], [1.0, -1.0], 0.0) * rcsScale
+        yawDir = np.select([actions[:, 2] == 1, actions[:, 2] == 2], [1.0, -1.0], 0.0) * rcsScale
+        lever = RCS_POINT_Y - CENTER_OF_MASS_Y
+        forceLocal = np.zeros((n, 3))
+        forceLocal[:, 1] = MAIN_THRUST * thrust
+        forceLocal[:, 2] = 2 * RCS_THRUST * pitchDir
+        forceLocal[:, 0] = 2 * RCS_THRUST * yawDir
+        torqueLocal = np.zeros((n, 3))
+        torqueLocal[:, 0] = 2 * RCS_THRUST * lever * pitchDir
+        torqueLocal[:, 2] = -2 * RCS_THRUST * lever * yawDir
+
+        # Integrate (semi-implicit Euler, like PhysX)
+        moving = active & ~terminated
+        force = np.einsum('nij,nj->ni', self.rotation, forceLocal)
+        force[:, 1] -= MASS * GRAVITY
+        self.velocity[moving] += (force[moving] / MASS) * FIXED_DT
+
+        localAngular = np.einsum('nji,nj->ni', self.rotation, self.angularVelocity)
+        localAngular += torqueLocal / INERTIA * FIXED_DT
+        angular = np.einsum('nij,nj->ni', self.rotation, localAngular) / (1 + ANGULAR_DRAG * FIXED_DT)
+        speed = np.linalg.norm(angular, axis=1, keepdims=True)
+        angular *= np.minimum(1, MAX_ANGULAR_VELOCITY / np.maximum(speed, 1e-12))
+        self.angularVelocity[moving] = angular[moving]
+
+        # The body turns about its centre of mass; position is the transform origin below it
+        center = self.position[moving] + CENTER_OF_MASS_Y * self.rotation[moving, :, 1]
+        center += self.velocity[moving] * FIXED_DT
+        self.rotation[moving] = self.Rotate(self.rotation[moving], self.angularVelocity[moving] * FIXED_DT)
+        self.position[moving] = center - CENTER_OF_MASS_Y * self.rotation[moving, :, 1]
+
+        # Ground contact with the feet: crash on hard impact, otherwise an inelastic stop with friction
+        penetration = -self.LowestFoot()
+        contact = moving & (penetration > 0)
+        touchdown = contact & ~self.onGround
+        crashed = touchdown & (-self.velocity[:, 1] > CRASH_SPEED)
+        pitch, _, yaw = self.Euler()
+        crashed |= touchdown & (np.abs(pitch) > 40) & (np.abs(yaw) > 40)
+        terminated |= crashed
+
+        self.position[contact, 1] += penetration[contact]
+        self.velocity[contact, 1] = np.maximum(self.velocity[contact, 1], 0)
+        self.velocity[contact, 0] *= 0.5
+        self.velocity[contact, 2] *= 0.5
+        self.angularVelocity[contact] *= 0.5
+        self.onGround = (self.onGround | contact) & (penetration > -0.05)
+
+        energy = 0.5 * (self.velocity ** 2).sum(axis=1) + 0.5 * (self.angularVelocity ** 2).sum(axis=1)
+        resting = self.onGround & (energy < SLEEP_ENERGY)
+        self.sleepCount = np.where(resting, self.sleepCount + 1, 0)
+
+        self.stepCount += active
+        return reward + endReward, terminated
+
+    def Rotate(self, R, angle):
+        # Left-multiply by the rotation of the world-frame rotation vector angle (Rodrigues)
+        theta = np.linalg.norm(angle, axis=1)
+        axis = angle / np.maximum(theta, 1e-12)[:, None]
+        K = np.zeros((len(angle), 3, 3))
+        K[:, 0, 1], K[:, 0, 2], K[:, 1, 2] = -axis[:, 2], axis[:, 1], -axis[:, 0]
+        K[:, 1, 0], K[:, 2, 0], K[:, 2, 1] = axis[:, 2], -axis[:, 1], axis[:, 0]
+        s, c = np.sin(theta)[:, None, None], np.cos(theta)[:, None, None]
+        step = np.eye(3) + s * K + (1 - c) * (K @ K)
+        return step @ R
+
+    def step(self, actions):
+        """
+        Gym-style vector step: one decision for every lander, finished landers are reset automatically
+        :param actions: (N, 3) int actions
+        :return: (observations, rewards, terminated, truncated, infos); infos['final_observation'] holds the
+                 last observation of landers that were reset and infos['episode_return'] their return
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.numEnvs)
+        terminated = np.zeros(self.numEnvs, dtype=bool)
+        for _ in range(self.decisionPeriod):
+            reward, ended = self.PhysicsStep(actions, ~terminated)
+            rewards += reward
+            terminated |= ended
+        truncated = ~terminated & (self.stepCount >= self.maxStep)
+        self.episodeReturn += rewards
+
+        infos = {}
+        done = np.flatnonzero(terminated | truncated)
+        if len(done):
+            infos['final_observation'] = self.Observe()[done]
+            infos['final_index'] = done
+            infos['episode_return'] = self.episodeReturn[done].copy()
+            infos['target_deviation'] = np.hypot(self.position[done, 0] - self.target[done, 0],
+                                                 self.position[done, 2] - self.target[done, 1])
+            self.ResetIndices(done)
+        return self.Observe(), rewards.astype(np.float32), terminated, truncated, infos
+
+
+def collect_rollout(env, policy, observations, horizon):
+    """
+    Collect horizon decisions from every lander (PPO-style buffer)
+    :param policy: function (N, obs) observations -> (N, 3) actions
+    :return: (dict of (horizon, N, ...) arrays, next observations)
+    """
+    buffer = {
+        'observations': np.empty((horizon, env.numEnvs, OBSERVATION_SIZE), dtype=np.float32),
+        'actions': np.empty((horizon, env.numEnvs, len(ACTION_BRANCHES)), dtype=np.int64),
+        'rewards': np.empty((horizon, env.numEnvs), dtype=np.float32),
+        'dones': np.empty((horizon, env.numEnvs), dtype=bool),
+    }
+    for t in range(horizon):
+        actions = policy(observations)
+        buffer['observations'][t] = observations
+        buffer['actions'][t] = actions
+        observations, rewards, terminated, truncated, _ = env.step(actions)
+        buffer['rewards'][t] = rewards
+        buffer['dones'][t] = terminated | truncated
+    return buffer, observations
+
+
+def random_policy(rng):
+    def policy(observations):
+        n = len(observations)
+        return np.stack([rng.integers(0, b, n) for b in ACTION_BRANCHES], axis=1)
+    return policy
+
+
+def load_recording(path):
+    # CSV written by TrajectoryRecorder.cs, one row per FixedUpdate
+    data = np.genfromtxt(path, delimiter=',', names=True)
+    return {name: data[name] for name in data.dtype.names}
+
+
+def parity(path, horizon=50):
+    """
+    Compare the environment with a Unity recording
+    One-step error: start every physics step from the recorded state and apply the recorded action.
+    Open-loop drift: from the start of each episode, replay the recorded actions for horizon steps.
+    :return: dict of per-channel RMSE values
+    """
+    rec = load_recording(path)
+    channels = ['altitude', 'px', 'pz', 'vx', 'vy', 'vz', 'rx', 'rz', 'wx', 'wz']
+
+    def state(rows):
+        return (np.stack([rec['px'][rows], rec['altitude'][rows], rec['pz'][rows]], axis=1),
+                np.stack([rec['rx'][rows], rec['ry'][rows], rec['rz'][rows]], axis=1),
+                np.stack([rec['vx'][rows], rec['vy'][rows], rec['vz'][rows]], axis=1),
+                np.stack([rec['wx'][rows], rec['wy'][rows], rec['wz'][rows]], axis=1),
+                np.stack([rec['tx'][rows], rec['tz'][rows]], axis=1))
+
+    def observed(env):
+        pitch, _, yaw = env.Euler()
+        return np.stack([env.Altitude(), env.position[:, 0], env.position[:, 2], env.velocity[:, 0],
+                         env.velocity[:, 1], env.velocity[:, 2], pitch, yaw,
+                         env.angularVelocity[:, 0], env.angularVelocity[:, 2]], axis=1)
+
+    def recorded(rows):
+        return np.stack([rec[c][rows] for c in channels], axis=1)
+
+    actions = np.stack([rec['a0'], rec['a1'], rec['a2']], axis=1).astype(int)
+    rewardSteps = np.diff(rec['reward'])
+
+    # Transitions inside one episode that are not touchdown steps (contact is modelled coarsely)
+    rows = np.flatnonzero((rec['episode'][1:] == rec['episode'][:-1]) & (rec['altitude'][1:] > 1.5))
+    env = LanderVecEnv(len(rows), stochasticRcs=False)
+    env.SetState(np.arange(len(rows)), *state(rows))
+    stepReward, _ = env.PhysicsStep(actions[rows], np.ones(len(rows), dtype=bool))
+    oneStep = observed(env) - recorded(rows + 1)
+    rewardError = stepReward - rewardSteps[rows]
+
+    # Open-loop replay of each episode start
+    starts = np.flatnonzero(np.r_[True, rec['episode'][1:] != rec['episode'][:-1]])
+    starts = starts[starts + horizon < len(rec['episode'])]
+    starts = starts[rec['episode'][starts] == rec['episode'][starts + horizon]]
+    drift = np.zeros((0, len(channels)))
+    if len(starts):
+        env = LanderVecEnv(len(starts), stochasticRcs=False)
+        env.SetState(np.arange(len(starts)), *state(starts))
+        for k in range(horizon):
+            env.PhysicsStep(actions[starts + k], np.ones(len(starts), dtype=bool))
+        drift = observed(env) - recorded(starts + horizon)
+
+    def rmse(errors):
+        return {c: float(np.sqrt(np.mean(errors[:, i] ** 2))) if len(errors) else None for i, c in enumerate(channels)}
+
+    return {
+        'transitions': int(len(rows)),
+        'one_step_rmse': rmse(oneStep),
+        'reward_rmse': float(np.sqrt(np.mean(rewardError ** 2))) if len(rows) else None,
+        'open_loop_steps': horizon,
+        'open_loop_episodes': int(len(starts)),
+        'open_loop_rmse': rmse(drift),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized NumPy lander environment")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    bench_parser = sub.add_parser('bench', help="measure step throughput with random actions")
+    bench_parser.add_argument('--envs', type=int, default=4096)
+    bench_parser.add_argument('--steps', type=int, default=200, help="decisions per lander")
+
+    eval_parser = sub.add_parser('eval', help="roll out an ONNX policy (10 observations) and report outcomes")
+    eval_parser.add_argument('model')
+    eval_parser.add_argument('--envs', type=int, default=1024)
+    eval_parser.add_argument('--steps', type=int, default=1200, help="decisions per lander")
+    eval_parser.add_argument('--config', default='config/LunarLander.yaml',
+                             help="trainer config; its time_horizon sets the rollout chunk length")
+
+    parity_parser = sub.add_parser('parity', help="compare against a Unity recording (TrajectoryRecorder.cs)")
+    parity_parser.add_argument('recording')
+    parity_parser.add_argument('--horizon', type=int, default=50, help="physics steps of open-loop replay")
+
+    for p in (bench_parser, eval_parser):
+        p.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'parity':
+        import json
+        print(json.dumps(parity(args.recording, args.horizon), indent=2))
+        return
+
+    env = LanderVecEnv(args.envs, seed=args.seed)
+    observations, _ = env.reset()
+
+    if args.command == 'bench':
+        policy = random_policy(np.random.default_rng(args.seed))
+        start = time.perf_counter()
+        collect_rollout(env, policy, observations, args.steps)
+        elapsed = time.perf_counter() - start
+        decisions = args.envs * args.steps
+        print("%d landers x %d decisions in %.2fs: %.0f decisions/s, %.0f physics steps/s" % (
+            args.envs, args.steps, elapsed, decisions / elapsed, decisions * env.decisionPeriod / elapsed))
+        return
+
+    import yaml
+    from PolicyService import PolicyModel
+
+    with open(args.config) as f:
+        horizon = yaml.safe_load(f)['behaviors']['LunarLander']['time_horizon']
+    model = PolicyModel(args.model, maxBatch=args.envs)
+    if model.obsSize != OBSERVATION_SIZE:
+        parser.error("policy expects %d observations, the training lander provides %d" % (model.obsSize, OBSERVATION_SIZE))
+
+    returns, deviations, successes = [], [], 0
+    start = time.perf_counter()
+    for _ in range(0, args.steps, horizon):
+        for _ in range(horizon):
+            observations, _, _, _, infos = env.step(model.Infer(observations))
+            if 'episode_return' in infos:
+                returns.extend(infos['episode_return'])
+                deviations.extend(infos['target_deviation'])
+                successes += int((infos['episode_return'] > 900).sum())
+    elapsed = time.perf_counter() - start
+    print("%d episodes finished, mean return %.1f, success %.1f%%, median target deviation %.1f m (%.0f decisions/s)" % (
+        len(returns), np.mean(returns) if returns else float('nan'), 100 * successes / max(1, len(returns)),
+        np.median(deviations) if deviations else float('nan'), args.envs * args.steps / elapsed))
+
+
+if __name__ == '__main__':
+    main()
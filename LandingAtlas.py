@@ -0,0 +1,203 @@
+# Precomputed landing-site atlas
+#
+# For a fixed DEM the server's reply only depends on the lander position, so it can be
+# computed ahead of time on a regular (x, altitude, z) grid. The atlas is a directory with
+#   index.json  grid definition, source DEM and site method (server.select_site)
+#   maps.npy    (N, 512) uint8   bit-packed 64x64 safety masks
+#   sites.npy   (N, 4)   int32   cx, cy, global_cx, global_cy
+#   valid.npy   (N,)     bool    False where the FOV has no safe area
+# where node (ix, ia, iz) is stored at ((ia * nz) + iz) * nx + ix. The arrays are memory-mapped,
+# so a lookup is index arithmetic plus unpacking 512 bytes. Only the selected site is stored, no
+# ranked candidates, so the server refuses an atlas together with --site-candidates or a different
+# --site-method.
+#
+#   python LandingAtlas.py DEMS/dem1.tif DEMS/atlas --x 0 2000 10 --z 0 2000 10 --alt 50 1000 25
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+MAP_SIZE = 64
+PACKED_SIZE = MAP_SIZE * MAP_SIZE // 8
+
+
+def grid_axis(start, stop, step):
+    # Inclusive regular axis definition
+    count = int(np.floor((stop - start) / step + 1e-9)) + 1
+    return {'start': float(start), 'step': float(step), 'count': count}
+
+
+def init_worker(dem_path):
+    import server
+    server.load_dem(dem_path)
+
+
+def build_row(xs, altitude, z, site_method='contour'):
+    # Runs in a worker: compute the nodes of one grid row (all x at one altitude and z)
+    import server
+
+    maps = np.zeros((len(xs), PACKED_SIZE), dtype=np.uint8)
+    sites = np.zeros((len(xs), 4), dtype=np.int32)
+    valid = np.zeros(len(xs), dtype=bool)
+    for i, x in enumerate(xs):
+        fovX, fovZ, size = server.getFOV(x, altitude, z)
+        safety_map, pixel_size_x, _ = server.compute_hazard_map(fovX, fovZ, size)
+        site = None if safety_map is None else server.select_site(safety_map, fovX, fovZ, pixel_size_x, site_method)
+        if site is not None:
+            maps[i] = np.packbits(site[0] != 0)
+            sites[i] = site[1:]
+            valid[i] = True
+    return maps, sites, valid
+
+
+def build_atlas(dem_path, output_dir, x_axis, altitude_axis, z_axis, workers=None, site_method='contour'):
+    """
+    Sweep the grid on a process pool and write the atlas
+    :param x_axis, altitude_axis, z_axis: (start, stop, step) of each grid axis, stop inclusive
+    :param site_method: 'contour' or 'distance', as the server's --site-method
+    :return: number of grid nodes
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index = {
+        'dem': os.path.abspath(dem_path),
+        'x': grid_axis(*x_axis),
+        'altitude': grid_axis(*altitude_axis),
+        'z': grid_axis(*z_axis),
+        'site_method': site_method,
+    }
+    nx, na, nz = index['x']['count'], index['altitude']['count'], index['z']['count']
+    nodes = nx * na * nz
+
+    maps = np.lib.format.open_memmap(os.path.join(output_dir, 'maps.npy'), 'w+', np.uint8, (nodes, PACKED_SIZE))
+    sites = np.lib.format.open_memmap(os.path.join(output_dir, 'sites.npy'), 'w+', np.int32, (nodes, 4))
+    valid = np.lib.format.open_memmap(os.path.join(output_dir, 'valid.npy'), 'w+', bool, (nodes,))
+
+    xs = index['x']['start'] + np.arange(nx) * index['x']['step']
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dem_path,)) as pool:
+        rows = {}
+        for ia in range(na):
+            altitude = index['altitude']['start'] + ia * index['altitude']['step']
+            for iz in range(nz):
+                z = index['z']['start'] + iz * index['z']['step']
+                rows[pool.submit(build_row, xs, altitude, z, site_method)] = (ia * nz + iz) * nx
+        for future in as_completed(rows):
+            offset = rows[future]
+            row_maps, row_sites, row_valid = future.result()
+            maps[offset:offset + nx] = row_maps
+            sites[offset:offset + nx] = row_sites
+            valid[offset:offset + nx] = row_valid
+
+    maps.flush()
+    sites.flush()
+    valid.flush()
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+    return nodes
+
+
+class LandingAtlas():
+    def __init__(self, path):
+        """
+        Open an atlas written by build_atlas (arrays are memory-mapped, nothing is loaded up front)
+        :param path: atlas directory
+        """
+        with open(os.path.join(path, 'index.json')) as f:
+            self.index = json.load(f)
+        self.maps = np.load(os.path.join(path, 'maps.npy'), mmap_mode='r')
+        self.sites = np.load(os.path.join(path, 'sites.npy'), mmap_mode='r')
+        self.valid = np.load(os.path.join(path, 'valid.npy'), mmap_mode='r')
+
+        self.axes = [self.index['x'], self.index['altitude'], self.index['z']]
+        self.nx = self.axes[0]['count']
+        self.nz = self.axes[2]['count']
+        self.siteMethod = self.index.get('site_method', 'contour') # atlases built before it was recorded
+
+    def GridPosition(self, posx, posy, posz):
+        # Fractional grid coordinates, or None if the position is more than half a step off the grid
+        coords = []
+        for value, axis in zip((posx, posy, posz), self.axes):
+            g = (value - axis['start']) / axis['step']
+            if g < -0.5 or g > axis['count'] - 0.5:
+                return None
+            coords.append(min(max(g, 0.0), axis['count'] - 1))
+        return coords
+
+    def Node(self, ix, ia, iz):
+        return (ia * self.nz + iz) * self.nx + ix
+
+    def Lookup(self, posx, posy, posz, interpolate=False):
+        """
+        Answer a position from the atlas
+        The safety map comes from the nearest node. With interpolate, the global centroid is blended
+        bilinearly over the four surrounding nodes at the nearest altitude (nodes without a site are
+        skipped) and the local centroid is recomputed for the lander's own FOV.
+        :return: None if the position is off-grid (compute live), otherwise (safety map, site) where
+                 site is (cx, cy, global_cx, global_cy) or None if the nearest node has no safe area
+        """
+        coords = self.GridPosition(posx, posy, posz)
+        if coords is None:
+            return None
+        gx, ga, gz = coords
+        ix, ia, iz = int(round(gx)), int(round(ga)), int(round(gz))
+
+        node = self.Node(ix, ia, iz)
+        if not self.valid[node]:
+            return np.zeros((MAP_SIZE, MAP_SIZE), dtype=np.uint8), None
+        safety_map = np.unpackbits(self.maps[node]).reshape(MAP_SIZE, MAP_SIZE) * np.uint8(255)
+        site = tuple(int(v) for v in self.sites[node])
+
+        if interpolate:
+            site = self.InterpolateSite(gx, ia, gz, posx, posy, posz) or site
+        return safety_map, site
+
+    def InterpolateSite(self, gx, ia, gz, posx, posy, posz):
+        x0, z0 = int(np.floor(gx)), int(np.floor(gz))
+        fx, fz = gx - x0, gz - z0
+
+        total = 0.0
+        global_cx = global_cy = 0.0
+        for dx, wx in ((0, 1 - fx), (1, fx)):
+            for dz, wz in ((0, 1 - fz), (1, fz)):
+                ix, iz = min(x0 + dx, self.nx - 1), min(z0 + dz, self.nz - 1)
+                node = self.Node(ix, ia, iz)
+                weight = wx * wz
+                if weight > 0 and self.valid[node]:
+                    global_cx += weight * self.sites[node][2]
+                    global_cy += weight * self.sites[node][3]
+                    total += weight
+        if total == 0:
+            return None
+
+        global_cx, global_cy = int(global_cx / total), int(global_cy / total)
+
+        # Express the blended site in the lander's own FOV (same geometry as server.getFOV)
+        width = posy * np.tan(np.pi / 12)
+        pixel_size_x = max(1, int(width * 2)) / MAP_SIZE
+        cx = int((global_cx - int(posx - width)) / pixel_size_x)
+        cy = int((global_cy - int(posz - width)) / pixel_size_x)
+        return cx, cy, global_cx, global_cy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute a landing-site atlas over a grid of lander positions")
+    parser.add_argument('input_dem', help="input DEM GeoTIFF")
+    parser.add_argument('output_dir', help="atlas directory")
+    parser.add_argument('--x', type=float, nargs=3, required=True, metavar=('START', 'STOP', 'STEP'))
+    parser.add_argument('--z', type=float, nargs=3, required=True, metavar=('START', 'STOP', 'STEP'))
+    parser.add_argument('--alt', type=float, nargs=3, required=True, metavar=('START', 'STOP', 'STEP'))
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument('--site-method', choices=('contour', 'distance'), default='contour',
+                        help="landing site rule, must match the server's --site-method")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    nodes = build_atlas(args.input_dem, args.output_dir, args.x, args.alt, args.z, args.workers, args.site_method)
+    print("Built atlas with %d nodes in %.1fs" % (nodes, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
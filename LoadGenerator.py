@@ -0,0 +1,276 @@
+# Headless stand-in for the Unity lander, for end-to-end load testing of server.py
+#
+# Each simulated lander owns a UDP socket and sends its position every FixedUpdate, like
+# LanderController.SendPosition (x + 1000, altitude, z + 1000), at fixed_dt / time_scale
+# wall-clock intervals. Replies are parsed the same way UdpSocket.cs does and matched to the
+# position they answer through the sequence number, giving end-to-end latency, staleness
+# (how far the lander moved since the answered position) and the share of unanswered positions.
+#
+#   python LoadGenerator.py --landers 16 --time-scale 20 --duration 30
+#   python LoadGenerator.py --trajectory descent.csv --protocol text
+#   python LoadGenerator.py --velocity   # also send the velocity, for the server's --prefetch
+
+import argparse
+import heapq
+import json
+import math
+import selectors
+import socket
+import time
+
+import numpy as np
+
+import SafetyProtocol as SP
+
+# Unity defaults: Time.fixedDeltaTime = 0.02 s, LanderController offsets positions by 1000
+FIXED_DT = 0.02
+POSITION_OFFSET = 1000.0
+
+
+def reference_velocity(altitude):
+    # LanderController.ReferenceVelocity: the vertical speed profile the policy is trained to track
+    if altitude > 200:
+        return -30 * math.tanh(0.002 * altitude)
+    return -20 * math.exp(0.01 * altitude - 2) + 2
+
+
+def synthesize_descent(rng, fixed_dt=FIXED_DT, center=100.0, spread=20.0, target_spread=5.0):
+    """
+    Descent following the reference velocity from 500-520 m, drifting towards a target,
+    with the same start randomization as LanderController.ResetPosition
+    :return: (T, 4) array of sim time, x, altitude, z in the frame sent to the server
+    """
+    x, z = center + rng.uniform(-spread, spread, 2)
+    y = rng.uniform(500, 520)
+    target = np.array([x, z]) + rng.uniform(-target_spread, target_spread, 2)
+
+    rows = []
+    t = 0.0
+    while y > 0.5:
+        rows.append((t, x + POSITION_OFFSET, y, z + POSITION_OFFSET))
+        vy = min(reference_velocity(y), -0.5)
+        vx, vz = 0.05 * (target - (x, z))
+        x, y, z = x + vx * fixed_dt, y + vy * fixed_dt, z + vz * fixed_dt
+        t += fixed_dt
+    rows.append((t, x + POSITION_OFFSET, 0.5, z + POSITION_OFFSET))
+    return np.array(rows)
+
+
+def load_trajectory(path):
+    # CSV with columns t, x, y, z (server frame, i.e. as sent by SendPosition); a header line is optional
+    with open(path) as f:
+        first = f.readline()
+    skip = 0 if first.replace(',', '').replace('.', '').replace('-', '').strip().isdigit() else 1
+    return np.loadtxt(path, delimiter=',', skiprows=skip, ndmin=2)[:, :4]
+
+
+def trajectory_velocity(trajectory):
+    # Velocity along a (T, 4) t, x, y, z trajectory, like LanderController.GetVelocity
+    if len(trajectory) < 2:
+        return np.zeros((len(trajectory), 3))
+    return np.gradient(trajectory[:, 1:4], trajectory[:, 0], axis=0)
+
+
+def parse_text_reply(text):
+    # Same parsing as UdpSocket.ProcessInput, plus the optional trailing sequence number ("@" fields are site candidates)
+    dataArray = text.split(';')
+    safetyMapData = [int(v) for v in dataArray[0].split(',')]
+    cx, cy, global_cx, global_cy = (int(v) for v in dataArray[1:5])
+    seq = int(dataArray[5]) if len(dataArray) > 5 and not dataArray[5].startswith('@') else None
+    return seq, safetyMapData, cx, cy, global_cx, global_cy
+
+
+class SimulatedLander():
+    def __init__(self, index, trajectory, server, protocol, bindHost='127.0.0.1', loop=True, velocity=False):
+        self.index = index
+        self.trajectory = trajectory
+        self.velocity = trajectory_velocity(trajectory) if velocity else None
+        self.server = server
+        self.protocol = protocol
+        self.loop = loop
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind((bindHost, 0))
+        self.sock.setblocking(False)
+
+        self.step = 0
+        self.seq = 0
+        self.sent = {} # seq -> (send time, position)
+        self.done = False
+
+        self.sentCount = 0
+        self.replies = 0
+        self.parseErrors = 0
+        self.unmatched = 0
+        self.latencies = []
+        self.staleTicks = []
+        self.staleMeters = []
+        self.replyTimes = []
+
+    def SendNext(self, now):
+        if self.step >= len(self.trajectory):
+            if not self.loop:
+                self.done = True
+                return
+            self.step = 0
+        _, x, y, z = self.trajectory[self.step]
+        velocity = None if self.velocity is None else self.velocity[self.step]
+        self.step += 1
+
+        seq = self.seq
+        if self.protocol == 'binary':
+            message = SP.encode_position(seq, x, y, z, velocity=velocity)
+        else:
+            text = '%s,%s,%s,%d' % (x, y, z, seq)
+            if velocity is not None:
+                text += ';%s,%s,%s' % tuple(velocity)
+            message = text.encode('utf-8')
+        try:
+            self.sock.sendto(message, self.server)
+        except OSError:
+            return
+        # Only sent positions take a sequence number, so seq - 1 is always the newest entry of self.sent
+        self.seq = (seq + 1) & 0xFFFFFFFF
+        self.sent[seq] = (now, (x, y, z))
+        self.sentCount += 1
+
+        # Forget positions that can no longer be answered usefully
+        if len(self.sent) > 4096:
+            for old in list(self.sent)[:1024]:
+                del self.sent[old]
+
+    def Receive(self, now):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            try:
+                if SP.is_binary(data):
+                    seq = SP.decode_reply(data)[0]
+                else:
+                    seq = parse_text_reply(data.decode('utf-8'))[0]
+            except (ValueError, IndexError):
+                self.parseErrors += 1
+                continue
+
+            self.replies += 1
+            self.replyTimes.append(now)
+            entry = self.sent.get(seq)
+            if entry is None:
+                self.unmatched += 1
+                continue
+            sendTime, position = entry
+            self.latencies.append(now - sendTime)
+
+            newest = self.sent[(self.seq - 1) & 0xFFFFFFFF][1] if self.sentCount else position
+            self.staleTicks.append((self.seq - 1 - seq) & 0xFFFFFFFF)
+            self.staleMeters.append(math.dist(position, newest))
+
+
+def percentiles(values, scale=1.0):
+    if not values:
+        return None
+    values = np.asarray(values) * scale
+    return {'p50': float(np.percentile(values, 50)), 'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+
+def summarize(landers):
+    sent = sum(l.sentCount for l in landers)
+    replies = sum(l.replies for l in landers)
+    gaps = []
+    for l in landers:
+        gaps.extend(np.diff(l.replyTimes).tolist())
+    return {
+        'landers': len(landers),
+        'sent': sent,
+        'replies': replies,
+        'reply_ratio': replies / sent if sent else 0.0,
+        'unanswered': sent - replies,
+        'unmatched_replies': sum(l.unmatched for l in landers),
+        'parse_errors': sum(l.parseErrors for l in landers),
+        'latency_ms': percentiles([v for l in landers for v in l.latencies], 1e3),
+        'staleness_ticks': percentiles([v for l in landers for v in l.staleTicks]),
+        'staleness_m': percentiles([v for l in landers for v in l.staleMeters]),
+        'reply_gap_ms': percentiles(gaps, 1e3),
+    }
+
+
+def run(landers, interval, duration):
+    # Single-threaded scheduler: send on each lander's FixedUpdate clock, receive whenever replies arrive
+    selector = selectors.DefaultSelector()
+    for lander in landers:
+        selector.register(lander.sock, selectors.EVENT_READ, lander)
+
+    start = time.perf_counter()
+    end = start + duration
+    # Stagger the landers over one interval, like independent Unity instances
+    schedule = [(start + i * interval / len(landers), i) for i in range(len(landers))]
+    heapq.heapify(schedule)
+    lateSends = 0
+
+    now = start
+    while now < end and schedule:
+        timeout = max(0.0, schedule[0][0] - now)
+        for key, _ in selector.select(timeout):
+            key.data.Receive(time.perf_counter())
+
+        now = time.perf_counter()
+        while schedule and schedule[0][0] <= now:
+            due, i = heapq.heappop(schedule)
+            if now - due > interval:
+                lateSends += 1
+            landers[i].SendNext(now)
+            if not landers[i].done:
+                heapq.heappush(schedule, (due + interval, i))
+
+    # Collect replies still in flight
+    drainEnd = time.perf_counter() + 0.5
+    while time.perf_counter() < drainEnd:
+        for key, _ in selector.select(0.05):
+            key.data.Receive(time.perf_counter())
+    return time.perf_counter() - start, lateSends
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Unity landers sending positions to server.py")
+    parser.add_argument('--server', default='127.0.0.1:8001', help="host:port of the hazard server")
+    parser.add_argument('--landers', type=int, default=1, help="concurrent simulated landers")
+    parser.add_argument('--time-scale', type=float, default=20.0, help="Unity time scale (config engine_settings)")
+    parser.add_argument('--fixed-dt', type=float, default=FIXED_DT, help="Unity fixed timestep in seconds")
+    parser.add_argument('--duration', type=float, default=10.0, help="wall-clock seconds to run")
+    parser.add_argument('--protocol', choices=('binary', 'text'), default='binary')
+    parser.add_argument('--trajectory', default=None, help="CSV trajectory (t,x,y,z) to replay instead of synthesizing")
+    parser.add_argument('--velocity', action='store_true', help="send the lander velocity with every position")
+    parser.add_argument('--no-loop', action='store_true', help="stop each lander at the end of its trajectory")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help="write the summary to this JSON file")
+    args = parser.parse_args()
+
+    host, port = args.server.rsplit(':', 1)
+    server = (host, int(port))
+    rng = np.random.default_rng(args.seed)
+    recorded = load_trajectory(args.trajectory) if args.trajectory else None
+
+    landers = []
+    for i in range(args.landers):
+        trajectory = recorded if recorded is not None else synthesize_descent(rng, args.fixed_dt)
+        landers.append(SimulatedLander(i, trajectory, server, args.protocol, loop=not args.no_loop,
+                                       velocity=args.velocity))
+
+    interval = args.fixed_dt / args.time_scale
+    elapsed, lateSends = run(landers, interval, args.duration)
+
+    summary = summarize(landers)
+    summary.update({'elapsed_s': elapsed, 'late_sends': lateSends, 'send_interval_ms': interval * 1e3,
+                    'offered_rate_hz': args.landers / interval, 'reply_rate_hz': summary['replies'] / elapsed})
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+# Batched CPU inference for the trained lander policies
+#
+# Loads an ML-Agents ONNX export (results/<run>/LunarLander/LunarLander-<step>.onnx) with
+# onnxruntime, gathers observation vectors from many landers into micro-batches (up to
+# max batch requests, or max delay after the first one arrived) and returns one action per
+# action branch for every lander. It can be used in-process, served over UDP with the binary
+# observation/action messages of SafetyProtocol.py (or "o1,...,on[;seq]" text), or benchmarked:
+#
+#   python PolicyService.py serve results/Final1/LunarLander/LunarLander-137633.onnx --port 8101
+#   python PolicyService.py bench results/finalphase5c/LunarLander/*.onnx --clients 64 --threads 1 2
+
+import argparse
+import json
+import selectors
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import onnxruntime as ort
+
+import SafetyProtocol as SP
+import UdpComms as U
+from ServerMetrics import ServerMetrics
+
+
+class PolicyModel():
+    def __init__(self, path, threads=1, deterministic=True, maxBatch=256):
+        """
+        Constructor
+        :param path: ONNX policy exported by ML-Agents
+        :param threads: onnxruntime intra-op threads; the policies are small MLPs, so 1 is usually fastest
+                        and more throughput comes from larger batches rather than more threads
+        :param deterministic: take the most likely action per branch instead of sampling (Unity's deterministic inference)
+        :param maxBatch: rows preallocated for the action mask input (grown on demand)
+        """
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+        inputs = {i.name: i for i in self.session.get_inputs()}
+        outputs = {o.name: o for o in self.session.get_outputs()}
+        self.obsSize = inputs['obs_0'].shape[1]
+        self.maskSize = inputs['action_masks'].shape[1] if 'action_masks' in inputs else 0
+        if deterministic and 'deterministic_discrete_actions' in outputs:
+            self.outputName = 'deterministic_discrete_actions'
+        else:
+            self.outputName = 'discrete_actions'
+        self.branches = outputs[self.outputName].shape[1]
+        self.masks = np.ones((maxBatch, self.maskSize), dtype=np.float32) # every action allowed
+
+    def Infer(self, observations):
+        """
+        Run the policy on a batch
+        :param observations: (N, obsSize) float32
+        :return: (N, branches) int64 actions
+        """
+        n = len(observations)
+        if n > len(self.masks):
+            self.masks = np.ones((n, self.maskSize), dtype=np.float32)
+        feed = {'obs_0': np.ascontiguousarray(observations, dtype=np.float32)}
+        if self.maskSize:
+            feed['action_masks'] = self.masks[:n]
+        return self.session.run([self.outputName], feed)[0]
+
+    def Warmup(self, batchSizes=(1, 8, 64), repeat=3):
+        # The first runs of each shape allocate buffers and pick kernels; keep that off the request path
+        for size in batchSizes:
+            observations = np.zeros((size, self.obsSize), dtype=np.float32)
+            for _ in range(repeat):
+                self.Infer(observations)
+
+
+class PolicyService():
+    def __init__(self, model, maxBatch=64, maxDelay=0.002, metrics=None):
+        """
+        Micro-batching front end for a PolicyModel, fed from any number of threads
+        :param model: PolicyModel
+        :param maxBatch: largest batch passed to the model
+        :param maxDelay: seconds a request may wait for others to join its batch
+        :param metrics: optional ServerMetrics receiving 'queue' and 'inference' timings
+        """
+        self.model = model
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.counters = {'requests': 0, 'batches': 0, 'errors': 0}
+        self.metrics = metrics if metrics is not None else ServerMetrics(self.counters)
+
+        self.observations = np.zeros((maxBatch, model.obsSize), dtype=np.float32)
+        self.queue = deque()
+        self.ready = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.BatchLoop, daemon=True)
+        self.thread.start()
+
+    def Submit(self, observation):
+        """
+        Queue one observation
+        :return: Future resolving to the int64 action per branch
+        """
+        future = Future()
+        with self.ready:
+            self.queue.append((observation, future, time.perf_counter()))
+            self.ready.notify()
+        return future
+
+    def Act(self, observation, timeout=None):
+        return self.Submit(observation).result(timeout)
+
+    def BatchLoop(self):
+        while True:
+            with self.ready:
+                while self.running and not self.queue:
+                    self.ready.wait()
+                if not self.running:
+                    return
+                # Linger until the batch is full or the oldest request reaches the delay budget
+                deadline = self.queue[0][2] + self.maxDelay
+                while len(self.queue) < self.maxBatch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.ready.wait(remaining)
+                batch = [self.queue.popleft() for _ in range(min(self.maxBatch, len(self.queue)))]
+
+            start = time.perf_counter()
+            futures = []
+            for observation, future, submitted in batch:
+                try:
+                    self.observations[len(futures)] = observation
+                except ValueError as e:
+                    # Wrong observation count: fail this request only
+                    self.counters['errors'] += 1
+                    future.set_exception(e)
+                    continue
+                futures.append(future)
+                self.metrics.Observe('queue', start - submitted)
+            if not futures:
+                continue
+            try:
+                actions = self.model.Infer(self.observations[:len(futures)])
+            except Exception as e:
+                self.counters['errors'] += len(futures)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.metrics.Observe('inference', time.perf_counter() - start)
+            self.counters['requests'] += len(futures)
+            self.counters['batches'] += 1
+            for future, action in zip(futures, actions):
+                future.set_result(action)
+
+    def Stats(self):
+        batches = self.counters['batches']
+        return dict(self.counters, mean_batch=self.counters['requests'] / batches if batches else 0.0)
+
+    def Close(self):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        self.thread.join()
+
+
+def parse_observation(data, obsSize):
+    """
+    Parse an observation datagram (binary MSG_OBSERVATION or "o1,...,on[;seq]" text)
+    :return: (binary, seq or None, observation)
+    """
+    if SP.is_binary(data):
+        seq, _, observation = SP.decode_observation(data)
+        binary = True
+    else:
+        values = bytes(data).decode('utf-8').split(';')
+        observation = np.array(values[0].split(','), dtype=np.float32)
+        seq = int(values[1]) if len(values) > 1 else None
+        binary = False
+    if observation.size != obsSize:
+        raise ValueError("Expected %d observations, got %d" % (obsSize, observation.size))
+    return binary, seq, observation
+
+
+def serve(model, host, port, maxBatch=64, maxDelay=0.002, metricsPort=0):
+    """
+    Answer observation datagrams with actions; everything queued on the socket when the loop wakes
+    (plus whatever arrives within maxDelay) is evaluated as one batch
+    Replies go back to the sender: binary MSG_ACTIONS, or "a1,...,ak[;seq]" text
+    Malformed observations and batches the model fails on are dropped (counted as errors), the loop keeps serving.
+    """
+    counters = {'received': 0, 'replied': 0, 'errors': 0, 'batches': 0}
+    metrics = ServerMetrics(counters)
+    sock = U.UdpComms(udpIP=host, portTX=port, portRX=port, enableRX=False, decodeRX=False,
+                      ringSlots=4 * maxBatch, rcvBufSize=4 * 1024 * 1024)
+    metrics.AddGauge('udp', sock.ReceiveStats)
+    if metricsPort:
+        metrics.StartHttpServer(metricsPort)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock.udpSock, selectors.EVENT_READ)
+    observations = np.zeros((maxBatch, model.obsSize), dtype=np.float32)
+    pending = [] # (address, binary, seq, receive time) per row of observations
+
+    print("policy service active: %s (%d observations, %d branches)" % (model.path, model.obsSize, model.branches))
+    while True:
+        selector.select()
+        deadline = time.monotonic() + maxDelay
+        while len(pending) < maxBatch:
+            for data, address, rx_time in sock.ReceiveBatch(maxBatch - len(pending)):
+                counters['received'] += 1
+                try:
+                    binary, seq, observation = parse_observation(data, model.obsSize)
+                except ValueError:
+                    counters['errors'] += 1
+                    continue
+                observations[len(pending)] = observation # copy out of the ring slot
+                pending.append((address, binary, seq, rx_time))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not selector.select(remaining):
+                break
+        if not pending:
+            continue
+
+        start = time.perf_counter()
+        try:
+            actions = model.Infer(observations[:len(pending)])
+        except Exception as e:
+            # Drop the batch rather than the loop; its landers send again with their next step
+            counters['errors'] += len(pending)
+            print("Inference failed for a batch of %d: %r" % (len(pending), e))
+            pending.clear()
+            continue
+        metrics.Observe('inference', time.perf_counter() - start)
+        counters['batches'] += 1
+
+        for (address, binary, seq, rx_time), action in zip(pending, actions):
+            if binary:
+                sock.SendBytes(SP.encode_actions(seq, action), address)
+            else:
+                text = ",".join(str(int(a)) for a in action)
+                sock.SendData(text if seq is None else "%s;%d" % (text, seq), address)
+            metrics.Observe('request', time.monotonic() - rx_time)
+        counters['replied'] += len(pending)
+        pending.clear()
+
+
+def benchmark(path, threads, clients, duration, maxBatch, maxDelay, seed=0):
+    # Closed loop: every client thread submits an observation and waits for its action before the next one
+    model = PolicyModel(path, threads=threads, maxBatch=maxBatch)
+    model.Warmup((1, maxBatch))
+
+    # Raw model cost per batch size, independent of the batching front end
+    rng = np.random.default_rng(seed)
+    sweep = {}
+    for size in sorted({1, 8, 32, maxBatch}):
+        observations = rng.normal(size=(size, model.obsSize)).astype(np.float32)
+        samples = []
+        for _ in range(50):
+            start = time.perf_counter()
+            model.Infer(observations)
+            samples.append(time.perf_counter() - start)
+        sweep[size] = float(np.median(samples) * 1e3)
+
+    service = PolicyService(model, maxBatch, maxDelay)
+    observations = rng.normal(size=(1024, model.obsSize)).astype(np.float32)
+    latencies = [[] for _ in range(clients)]
+    stop = time.perf_counter() + duration
+
+    def client(index):
+        i = index
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            service.Act(observations[i % len(observations)])
+            latencies[index].append(time.perf_counter() - start)
+            i += clients
+
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    service.Close()
+
+    samples = np.concatenate([np.asarray(l) for l in latencies]) * 1e3
+    return {
+        'model': path,
+        'threads': threads,
+        'clients': clients,
+        'observations': model.obsSize,
+        'requests': int(samples.size),
+        'throughput_per_s': samples.size / elapsed,
+        'latency_p50_ms': float(np.percentile(samples, 50)),
+        'latency_p99_ms': float(np.percentile(samples, 99)),
+        'mean_batch': service.Stats()['mean_batch'],
+        'batch_ms': sweep,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched CPU inference for the ONNX lander policies")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = sub.add_parser('serve', help="answer observations over UDP")
+    serve_parser.add_argument('model', help="ONNX policy")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8101)
+    serve_parser.add_argument('--threads', type=int, default=1, help="onnxruntime intra-op threads")
+    serve_parser.add_argument('--stochastic', action='store_true', help="sample actions instead of taking the most likely")
+    serve_parser.add_argument('--metrics-port', type=int, default=0)
+
+    bench_parser = sub.add_parser('bench', help="compare checkpoints under identical closed-loop load")
+    bench_parser.add_argument('models', nargs='+', help="ONNX policies")
+    bench_parser.add_argument('--threads', type=int, nargs='+', default=[1], help="intra-op thread counts to try")
+    bench_parser.add_argument('--clients', type=int, default=32, help="concurrent simulated landers")
+    bench_parser.add_argument('--duration', type=float, default=5.0, help="seconds per configuration")
+    bench_parser.add_argument('--output', default=None, help="write results to this JSON file")
+
+    for p in (serve_parser, bench_parser):
+        p.add_argument('--max-batch', type=int, default=64, help="largest inference batch")
+        p.add_argument('--max-delay-ms', type=float, default=2.0, help="time a request may wait for its batch to fill")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        model = PolicyModel(args.model, args.threads, not args.stochastic, args.max_batch)
+        model.Warmup((1, args.max_batch))
+        serve(model, args.host, args.port, args.max_batch, args.max_delay_ms / 1000, args.metrics_port)
+        return
+
+    results = []
+    for path in args.models:
+        for threads in args.threads:
+            result = benchmark(path, threads, args.clients, args.duration, args.max_batch, args.max_delay_ms / 1000)
+            results.append(result)
+            print('%-60s threads %d  %8.0f req/s  p50 %6.3f ms  p99 %6.3f ms  batch %5.1f' % (
+                path, threads, result['throughput_per_s'], result['latency_p50_ms'], result['latency_p99_ms'],
+                result['mean_batch']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+# Columnar store of the training metrics in results/*/LunarLander/events.out.tfevents.*
+#
+# Ingestion parses the TensorBoard event files (TFRecord framing + Event protobufs, decoded here
+# so TensorFlow is not needed) on a process pool. Event files are append-only, so each file's
+# size, mtime and parsed byte offset are remembered and later runs only read the new tail of
+# files that changed. The scalars of every run are kept as per-file segments and merged into
+#   <store>/index.json            runs, tags and the (run, tag) -> row range index
+#   <store>/{run,tag,step,wall_time,value}.npy   columns sorted by run, tag, step
+# which are memory-mapped by MetricStore, so a query is a dictionary lookup and an array slice.
+#
+#   python RunMetrics.py ingest                       # results/ -> metrics_store/
+#   python RunMetrics.py query "Environment/Cumulative Reward" --runs "finalphase*" --last 10
+
+import argparse
+import fnmatch
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+RECORD_HEADER = struct.Struct('<QI') # length, masked crc of length
+DOUBLE = struct.Struct('<d')
+FLOAT = struct.Struct('<f')
+
+DT_FLOAT = 1
+DT_DOUBLE = 2
+
+COLUMNS = (('run', np.int32), ('tag', np.int32), ('step', np.int64), ('wall_time', np.float64), ('value', np.float32))
+
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def skip_field(data, pos, wire):
+    if wire == 0:
+        return read_varint(data, pos)[1]
+    if wire == 1:
+        return pos + 8
+    if wire == 2:
+        length, pos = read_varint(data, pos)
+        return pos + length
+    if wire == 5:
+        return pos + 4
+    raise ValueError("Unsupported protobuf wire type %d" % wire)
+
+
+def parse_tensor(data, pos, end):
+    # Scalar value of a TensorProto (float_val, double_val or tensor_content), None for other tensors
+    dtype = DT_FLOAT
+    value = content = None
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        field, wire = key >> 3, key & 7
+        if field == 1 and wire == 0:
+            dtype, pos = read_varint(data, pos)
+        elif field == 5 and wire == 5:
+            value = FLOAT.unpack_from(data, pos)[0]
+            pos += 4
+        elif field == 5 and wire == 2: # packed float_val
+            length, pos = read_varint(data, pos)
+            if length >= 4:
+                value = FLOAT.unpack_from(data, pos)[0]
+            pos += length
+        elif field == 6 and wire == 1:
+            value = DOUBLE.unpack_from(data, pos)[0]
+            pos += 8
+        elif field == 6 and wire == 2: # packed double_val
+            length, pos = read_varint(data, pos)
+            if length >= 8:
+                value = DOUBLE.unpack_from(data, pos)[0]
+            pos += length
+        elif field == 4 and wire == 2:
+            length, pos = read_varint(data, pos)
+            content = data[pos:pos + length]
+            pos += length
+        else:
+            pos = skip_field(data, pos, wire)
+    if value is None and content is not None:
+        if dtype == DT_FLOAT and len(content) == 4:
+            value = FLOAT.unpack(content)[0]
+        elif dtype == DT_DOUBLE and len(content) == 8:
+            value = DOUBLE.unpack(content)[0]
+    return value
+
+
+def parse_summary(data, pos, end, out):
+    # Append (tag, value) of every scalar Summary.Value
+    while pos < end:
+        key, pos = read_varint(data, pos)
+        if key != 0x0A: # Summary.value
+            pos = skip_field(data, pos, key & 7)
+            continue
+        length, pos = read_varint(data, pos)
+        valueEnd = pos + length
+        tag = value = None
+        while pos < valueEnd:
+            key, pos = read_varint(data, pos)
+            field, wire = key >> 3, key & 7
+            if field == 1 and wire == 2:
+                length, pos = read_varint(data, pos)
+                tag = data[pos:pos + length].decode('utf-8', 'replace')
+                pos += length
+            elif field == 2 and wire == 5: # simple_value
+                value = FLOAT.unpack_from(data, pos)[0]
+                pos += 4
+            elif field == 8 and wire == 2: # tensor
+                length, pos = read_varint(data, pos)
+                value = parse_tensor(data, pos, pos + length)
+                pos += length
+            else:
+                pos = skip_field(data, pos, wire)
+        if tag is not None and value is not None:
+            out.append((tag, value))
+
+
+def parse_events(path, offset=0):
+    """
+    Parse the scalar events of one event file from a byte offset
+    A truncated record at the end (file still being written) is left for the next ingestion.
+    :return: (tags, dict of tag index / step / wall_time / value arrays, offset after the last complete record)
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+
+    tags = {}
+    tagIds, steps, times, values = [], [], [], []
+    pos = 0
+    while pos + RECORD_HEADER.size <= len(data):
+        length, _ = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        end = start + length
+        if end + 4 > len(data):
+            break
+        pos = end + 4 # skip the masked crc of the data
+
+        wallTime, step, scalars = 0.0, 0, []
+        p = start
+        while p < end:
+            key, p = read_varint(data, p)
+            if key == 0x09: # wall_time
+                wallTime = DOUBLE.unpack_from(data, p)[0]
+                p += 8
+            elif key == 0x10: # step
+                step, p = read_varint(data, p)
+            elif key == 0x2A: # summary
+                size, p = read_varint(data, p)
+                parse_summary(data, p, p + size, scalars)
+                p += size
+            else:
+                p = skip_field(data, p, key & 7)
+        for tag, value in scalars:
+            tagIds.append(tags.setdefault(tag, len(tags)))
+            steps.append(step)
+            times.append(wallTime)
+            values.append(value)
+
+    columns = {
+        'tag': np.array(tagIds, dtype=np.int32),
+        'step': np.array(steps, dtype=np.int64),
+        'wall_time': np.array(times, dtype=np.float64),
+        'value': np.array(values, dtype=np.float32),
+    }
+    return list(tags), columns, offset + pos
+
+
+def find_event_files(results_dir):
+    # (run name, path) of every event file, the run being the first directory below results_dir
+    files = []
+    for root, _, names in os.walk(results_dir):
+        for name in names:
+            if name.startswith('events.out.tfevents'):
+                path = os.path.join(root, name)
+                run = os.path.relpath(path, results_dir).split(os.sep)[0]
+                files.append((run, path))
+    return sorted(files)
+
+
+def ingest(results_dir, store_dir, workers=None):
+    """
+    Parse new and changed event files and rebuild the merged columns
+    :return: (files parsed, files skipped)
+    """
+    segments_dir = os.path.join(store_dir, 'segments')
+    os.makedirs(segments_dir, exist_ok=True)
+    manifest_path = os.path.join(store_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    files = find_event_files(results_dir)
+    work = []
+    for run, path in files:
+        stat = os.stat(path)
+        entry = manifest.get(path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue
+        if entry is None or stat.st_size < entry['offset']: # new or rewritten file: start over
+            entry = {'run': run, 'offset': 0, 'segments': []}
+            manifest[path] = entry
+        entry.update(size=stat.st_size, mtime=stat.st_mtime)
+        work.append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {path: pool.submit(parse_events, path, manifest[path]['offset']) for path in work}
+        for path, future in futures.items():
+            tags, columns, offset = future.result()
+            entry = manifest[path]
+            if len(columns['step']):
+                name = '%s__%s__%d.npz' % (entry['run'], os.path.basename(path), entry['offset'])
+                np.savez(os.path.join(segments_dir, name), tags=np.array(tags, dtype=object), **columns)
+                entry['segments'].append(name)
+            entry['offset'] = offset
+
+    # Forget files that disappeared
+    present = {path for _, path in files}
+    for path in [p for p in manifest if p not in present]:
+        del manifest[path]
+
+    if work or not os.path.exists(os.path.join(store_dir, 'index.json')):
+        merge(store_dir, manifest)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return len(work), len(files) - len(work)
+
+
+def merge(store_dir, manifest):
+    # Combine all segments into sorted, memory-mappable columns and the (run, tag) index
+    runs = sorted({entry['run'] for entry in manifest.values()})
+    runIds = {run: i for i, run in enumerate(runs)}
+    tagIds = {}
+    parts = {name: [] for name, _ in COLUMNS}
+
+    for entry in manifest.values():
+        for name in entry['segments']:
+            with np.load(os.path.join(store_dir, 'segments', name), allow_pickle=True) as segment:
+                mapping = np.array([tagIds.setdefault(tag, len(tagIds)) for tag in segment['tags']], dtype=np.int32)
+                parts['run'].append(np.full(len(segment['step']), runIds[entry['run']], dtype=np.int32))
+                parts['tag'].append(mapping[segment['tag']] if len(mapping) else segment['tag'])
+                for column in ('step', 'wall_time', 'value'):
+                    parts[column].append(segment[column])
+
+    columns = {name: np.concatenate(parts[name]).astype(dtype) if parts[name] else np.zeros(0, dtype)
+               for name, dtype in COLUMNS}
+    order = np.lexsort((columns['wall_time'], columns['step'], columns['tag'], columns['run']))
+    for name, _ in COLUMNS:
+        np.save(os.path.join(store_dir, name + '.npy'), columns[name][order])
+
+    run, tag = columns['run'][order], columns['tag'][order]
+    boundaries = np.flatnonzero(np.r_[True, (run[1:] != run[:-1]) | (tag[1:] != tag[:-1]), True])
+    tags = sorted(tagIds, key=tagIds.get)
+    series = {}
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        series.setdefault(runs[run[start]], {})[tags[tag[start]]] = [int(start), int(end)]
+    with open(os.path.join(store_dir, 'index.json'), 'w') as f:
+        json.dump({'runs': runs, 'tags': tags, 'series': series, 'rows': int(len(run))}, f)
+
+
+class MetricStore():
+    def __init__(self, path):
+        """
+        Read-only view of a store written by ingest (columns are memory-mapped)
+        :param path: store directory
+        """
+        with open(os.path.join(path, 'index.json')) as f:
+            self.index = json.load(f)
+        self.series = self.index['series']
+        self.columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name, _ in COLUMNS}
+
+    def Runs(self, pattern='*'):
+        return [run for run in self.index['runs'] if fnmatch.fnmatch(run, pattern)]
+
+    def Tags(self, run=None):
+        if run is None:
+            return list(self.index['tags'])
+        return sorted(self.series.get(run, {}))
+
+    def Series(self, run, tag):
+        """
+        One metric of one run
+        :return: (steps, values, wall times) arrays, empty if the run never logged the tag
+        """
+        start, end = self.series.get(run, {}).get(tag, (0, 0))
+        return (np.asarray(self.columns['step'][start:end]), np.asarray(self.columns['value'][start:end]),
+                np.asarray(self.columns['wall_time'][start:end]))
+
+    def Compare(self, tag, runs='*', smoothing=0.0):
+        """
+        The same metric across runs (e.g. reward curves), optionally smoothed like TensorBoard
+        :param runs: glob pattern or list of run names
+        :param smoothing: exponential moving average weight in [0, 1)
+        :return: dict run -> (steps, values)
+        """
+        names = self.Runs(runs) if isinstance(runs, str) else runs
+        result = {}
+        for run in names:
+            steps, values, _ = self.Series(run, tag)
+            if len(steps):
+                result[run] = (steps, ema(values, smoothing) if smoothing else values)
+        return result
+
+    def Summary(self, tag, runs='*', last=10):
+        # Per-run final value (mean of the last samples), best value and number of steps
+        table = {}
+        for run, (steps, values) in self.Compare(tag, runs).items():
+            table[run] = {'final': float(values[-last:].mean()), 'max': float(values.max()),
+                          'min': float(values.min()), 'last_step': int(steps[-1]), 'points': int(len(steps))}
+        return table
+
+
+def ema(values, weight):
+    out = np.empty(len(values), dtype=np.float64)
+    last = values[0] if len(values) else 0.0
+    for i, v in enumerate(values):
+        last = weight * last + (1 - weight) * v
+        out[i] = last
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest and query the tfevents metrics of all training runs")
+    parser.add_argument('--store', default='metrics_store', help="store directory")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = sub.add_parser('ingest', help="parse new or changed event files")
+    ingest_parser.add_argument('--results', default='results', help="directory with the run directories")
+    ingest_parser.add_argument('--workers', type=int, default=None, help="parser processes (default: all CPUs)")
+
+    sub.add_parser('list', help="list runs and tags")
+
+    query_parser = sub.add_parser('query', help="compare one metric across runs")
+    query_parser.add_argument('tag', help='e.g. "Environment/Cumulative Reward"')
+    query_parser.add_argument('--runs', default='*', help="glob pattern of run names")
+    query_parser.add_argument('--last', type=int, default=10, help="samples averaged for the final value")
+    query_parser.add_argument('--csv', default=None, help="write run,step,value rows to this file")
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        start = time.perf_counter()
+        parsed, skipped = ingest(args.results, args.store, args.workers)
+        print("Parsed %d event files, %d unchanged, in %.2fs" % (parsed, skipped, time.perf_counter() - start))
+        return
+
+    store = MetricStore(args.store)
+    if args.command == 'list':
+        for run in store.Runs():
+            print(run)
+        print()
+        for tag in store.Tags():
+            print(tag)
+        return
+
+    start = time.perf_counter()
+    table = store.Summary(args.tag, args.runs, args.last)
+    elapsed = time.perf_counter() - start
+    for run, row in table.items():
+        print('%-20s final %12.3f  max %12.3f  steps %9d  points %5d' % (run, row['final'], row['max'],
+                                                                       row['last_step'], row['points']))
+    print("%d runs in %.2f ms" % (len(table), elapsed * 1e3))
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            f.write('run,step,value\n')
+            for run, (steps, values) in store.Compare(args.tag, args.runs).items():
+                for step, value in zip(steps, values):
+                    f.write('%s,%d,%r\n' % (run, step, float(value)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+# Binary wire protocol between the hazard server and Unity (see UdpSocket.cs)
+#
+# Every datagram starts with a 16 byte little-endian header:
+#   magic 'LL' (2s) | version (B) | message type (B) | sequence (I) | timestamp in microseconds (q)
+#
+# Position (Unity -> Python), type MSG_POSITION:
+#   header | x, y, z (3f)                                             = 28 bytes
+#   header | x, y, z (3f) | vx, vy, vz (3f)                           = 40 bytes with the optional velocity
+# Servers that predate the velocity read the first 28 bytes and ignore the rest.
+# Safety map (Python -> Unity), type MSG_SAFETY_MAP:
+#   header | cx, cy, global_cx, global_cy (4i) | width, height (2H) | encoding (B) | site count (B) | mask | sites
+# The mask is either bit-packed (1 bit per cell, row-major, MSB first) or run-length encoded
+# as uint16 run lengths alternating unsafe/safe and starting with unsafe, whichever is smaller.
+# A 64x64 map is at most 536 bytes instead of ~8-16 KB of comma separated text.
+# Optional ranked landing site candidates follow the mask, best first (the count byte was reserved and is 0
+# without them): cx, cy (2H) | global_cx, global_cy (2i) | clearance radius in DEM units (f) = 16 bytes each
+#
+# Policy inference (see PolicyService.py) uses the same header:
+#   observation, type MSG_OBSERVATION: header | count (H) | count x float32
+#   actions,     type MSG_ACTIONS:     header | count (H) | count x int32 (one per action branch)
+#
+# Text messages never start with the magic, so both formats can share a socket.
+
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'LL'
+VERSION = 1
+
+MSG_POSITION = 1
+MSG_SAFETY_MAP = 2
+MSG_OBSERVATION = 3
+MSG_ACTIONS = 4
+
+ENCODING_BITPACKED = 0
+ENCODING_RLE = 1
+
+HEADER = struct.Struct('<2sBBIq')
+POSITION = struct.Struct('<3f')
+VELOCITY = struct.Struct('<3f')
+SAFETY_MAP = struct.Struct('<4iHHBB')
+SITE = struct.Struct('<HHiif')
+MAX_SITES = 255
+VECTOR = struct.Struct('<H')
+
+SAFE_VALUE = 255
+
+
+def timestamp_us():
+    return time.time_ns() // 1000
+
+
+def is_binary(data):
+    # True if data (bytes/memoryview) is a binary protocol message rather than text
+    return len(data) >= HEADER.size and bytes(data[:2]) == MAGIC
+
+
+def decode_header(data):
+    """
+    Decode and validate the common header
+    :return: (message type, sequence, timestamp in microseconds)
+    """
+    magic, version, msgType, seq, timestamp = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary protocol message")
+    if version != VERSION:
+        raise ValueError("Unsupported protocol version %d" % version)
+    return msgType, seq, timestamp
+
+
+def encode_position(seq, x, y, z, timestamp=None, velocity=None):
+    # velocity: optional (vx, vy, vz) of the lander, used by the server to prefetch the next FOVs
+    buffer = bytearray(HEADER.size + POSITION.size + (0 if velocity is None else VELOCITY.size))
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, MSG_POSITION, seq & 0xFFFFFFFF,
+                     timestamp_us() if timestamp is None else timestamp)
+    POSITION.pack_into(buffer, HEADER.size, x, y, z)
+    if velocity is not None:
+        VELOCITY.pack_into(buffer, HEADER.size + POSITION.size, *velocity)
+    return buffer
+
+
+def decode_position(data):
+    """
+    Decode a position message without copying the datagram
+    :return: (sequence, timestamp, x, y, z)
+    """
+    msgType, seq, timestamp = decode_header(data)
+    if msgType != MSG_POSITION:
+        raise ValueError("Expected a position message, got type %d" % msgType)
+    x, y, z = POSITION.unpack_from(data, HEADER.size)
+    return seq, timestamp, x, y, z
+
+
+def decode_velocity(data):
+    # Optional velocity of a position message: (vx, vy, vz), or None if the sender did not include it
+    offset = HEADER.size + POSITION.size
+    if len(data) < offset + VELOCITY.size:
+        return None
+    return VELOCITY.unpack_from(data, offset)
+
+
+def rle_runs(flat_mask):
+    # Run lengths alternating unsafe/safe, starting with an (possibly empty) unsafe run
+    change = np.flatnonzero(flat_mask[1:] != flat_mask[:-1]) + 1
+    runs = np.diff(np.concatenate(([0], change, [flat_mask.size])))
+    if flat_mask[0]:
+        runs = np.concatenate(([0], runs))
+    return runs
+
+
+class ReplyEncoder():
+    def __init__(self, width=64, height=64):
+        """
+        Encoder for safety map replies that reuses one preallocated buffer per message
+        :param width: safety map width in cells
+        :param height: safety map height in cells
+        """
+        self.width = width
+        self.height = height
+        self.cells = width * height
+        self.packedSize = (self.cells + 7) // 8
+        self.payloadOffset = HEADER.size + SAFETY_MAP.size
+
+        self.buffer = bytearray(self.payloadOffset + self.packedSize + MAX_SITES * SITE.size)
+        self.view = memoryview(self.buffer)
+        self.payload = np.frombuffer(self.buffer, dtype=np.uint8, offset=self.payloadOffset)
+        self.mask = np.empty((height, width), dtype=bool)
+
+    def Encode(self, seq, safety_map, cx, cy, global_cx, global_cy, timestamp=None, sites=None):
+        """
+        Encode a safety map reply
+        :param seq: sequence number of the request being answered
+        :param safety_map: (height, width) array, non-zero cells are safe
+        :param sites: optional (n, 5) candidates: cx, cy, global_cx, global_cy, clearance (at most MAX_SITES)
+        :return: memoryview over the internal buffer, valid until the next Encode call
+        """
+        np.not_equal(safety_map, 0, out=self.mask)
+        flat = self.mask.ravel()
+
+        encoding = ENCODING_BITPACKED
+        size = self.packedSize
+        if self.cells <= 0xFFFF:
+            runs = rle_runs(flat)
+            if 2 * runs.size < self.packedSize:
+                encoding = ENCODING_RLE
+                size = 2 * runs.size
+                self.payload[:size] = runs.astype('<u2').view(np.uint8)
+        if encoding == ENCODING_BITPACKED:
+            self.payload[:size] = np.packbits(flat)
+
+        siteCount = 0 if sites is None else min(len(sites), MAX_SITES)
+        offset = self.payloadOffset + size
+        for site in sites[:siteCount] if siteCount else ():
+            SITE.pack_into(self.buffer, offset, int(site[0]), int(site[1]), int(site[2]), int(site[3]), float(site[4]))
+            offset += SITE.size
+
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, MSG_SAFETY_MAP, seq & 0xFFFFFFFF,
+                         timestamp_us() if timestamp is None else timestamp)
+        SAFETY_MAP.pack_into(self.buffer, HEADER.size, int(cx), int(cy), int(global_cx), int(global_cy),
+                             self.width, self.height, encoding, siteCount)
+        return self.view[:offset]
+
+
+def decode_reply(data):
+    """
+    Decode a safety map reply (used by Python clients and tests)
+    :return: (sequence, timestamp, safety_map, cx, cy, global_cx, global_cy) with safe cells set to 255
+    """
+    msgType, seq, timestamp = decode_header(data)
+    if msgType != MSG_SAFETY_MAP:
+        raise ValueError("Expected a safety map message, got type %d" % msgType)
+    cx, cy, global_cx, global_cy, width, height, encoding, siteCount = SAFETY_MAP.unpack_from(data, HEADER.size)
+    payload = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size + SAFETY_MAP.size)
+    payload = payload[:payload.size - siteCount * SITE.size]
+
+    cells = width * height
+    if encoding == ENCODING_BITPACKED:
+        flat = np.unpackbits(payload, count=cells).astype(bool)
+    elif encoding == ENCODING_RLE:
+        runs = payload.view('<u2')
+        values = np.arange(runs.size) % 2 == 1
+        flat = np.repeat(values, runs)
+        if flat.size != cells:
+            raise ValueError("Run lengths do not cover the safety map")
+    else:
+        raise ValueError("Unknown safety map encoding %d" % encoding)
+
+    safety_map = np.where(flat, SAFE_VALUE, 0).astype(np.uint8).reshape(height, width)
+    return seq, timestamp, safety_map, cx, cy, global_cx, global_cy
+
+
+def decode_sites(data):
+    """
+    Decode the landing site candidates carried by a safety map reply
+    :return: list of (cx, cy, global_cx, global_cy, clearance), best first (empty if the reply has none)
+    """
+    siteCount = SAFETY_MAP.unpack_from(data, HEADER.size)[-1]
+    offset = len(data) - siteCount * SITE.size
+    return [SITE.unpack_from(data, offset + i * SITE.size) for i in range(siteCount)]
+
+
+def encode_vector(msgType, seq, values, dtype, timestamp=None):
+    values = np.asarray(values, dtype=dtype).ravel()
+    offset = HEADER.size + VECTOR.size
+    buffer = bytearray(offset + values.nbytes)
+    HEADER.pack_into(buffer, 0, MAGIC, VERSION, msgType, seq & 0xFFFFFFFF,
+                     timestamp_us() if timestamp is None else timestamp)
+    VECTOR.pack_into(buffer, HEADER.size, values.size)
+    buffer[offset:] = values.tobytes()
+    return buffer
+
+
+def decode_vector(data, msgType, dtype):
+    # Returns a numpy view over the datagram (no copy)
+    received, seq, timestamp = decode_header(data)
+    if received != msgType:
+        raise ValueError("Expected message type %d, got type %d" % (msgType, received))
+    count, = VECTOR.unpack_from(data, HEADER.size)
+    values = np.frombuffer(data, dtype=dtype, count=count, offset=HEADER.size + VECTOR.size)
+    return seq, timestamp, values
+
+
+def encode_observation(seq, observation, timestamp=None):
+    return encode_vector(MSG_OBSERVATION, seq, observation, '<f4', timestamp)
+
+
+def decode_observation(data):
+    """
+    Decode an observation message without copying the datagram
+    :return: (sequence, timestamp, float32 observation vector)
+    """
+    return decode_vector(data, MSG_OBSERVATION, '<f4')
+
+
+def encode_actions(seq, actions, timestamp=None):
+    return encode_vector(MSG_ACTIONS, seq, actions, '<i4', timestamp)
+
+
+def decode_actions(data):
+    """
+    Decode an actions message
+    :return: (sequence, timestamp, int32 action per branch)
+    """
+    return decode_vector(data, MSG_ACTIONS, '<i4')
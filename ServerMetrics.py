@@ -0,0 +1,177 @@
+# Instrumentation for the hazard server
+#
+# Fixed-bucket latency histograms per pipeline stage, message counters and gauges (cache
+# statistics, queue age), exported as Prometheus text / JSON over a local HTTP endpoint or
+# written as periodic JSON snapshots. Observing a value is a bucket search and two additions
+# under a lock, so the instrumentation is cheap enough to leave on permanently.
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency buckets, from 20 us to 2 s
+DEFAULT_BUCKETS = (0.00002, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)
+
+
+class Histogram():
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def Observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def Quantile(self, q, counts, count):
+        # Estimate a quantile by linear interpolation inside the bucket that contains it
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def Snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else 0.0,
+            'p50': self.Quantile(0.5, counts, count),
+            'p90': self.Quantile(0.9, counts, count),
+            'p99': self.Quantile(0.99, counts, count),
+            'buckets': counts,
+        }
+
+
+class ServerMetrics():
+    def __init__(self, counters=None, buckets=DEFAULT_BUCKETS):
+        """
+        Constructor
+        :param counters: dict of message counters owned by the server (read when exporting)
+        :param buckets: latency bucket upper bounds in seconds
+        """
+        self.counters = counters if counters is not None else {}
+        self.bucketBounds = tuple(buckets)
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def Observe(self, stage, seconds):
+        # Record one latency sample (seconds) for a stage
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram(self.bucketBounds))
+        histogram.Observe(seconds)
+
+    def AddGauge(self, name, fn):
+        # fn returns a number or a dict of numbers (e.g. HazardCache.Stats) when metrics are exported
+        self.gauges[name] = fn
+
+    def Snapshot(self):
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = {'error': repr(e)}
+        return {
+            'timestamp': time.time(),
+            'uptime_s': time.time() - self.started,
+            'counters': dict(self.counters),
+            'gauges': gauges,
+            'stages': {name: h.Snapshot() for name, h in list(self.histograms.items())},
+            'bucket_bounds_s': list(self.bucketBounds),
+        }
+
+    def PrometheusText(self):
+        # Render the snapshot in the Prometheus text exposition format
+        snapshot = self.Snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE hazard_messages_%s_total counter' % name)
+            lines.append('hazard_messages_%s_total %d' % (name, value))
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            values = value if isinstance(value, dict) else {'': value}
+            for key, v in sorted(values.items()):
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    metric = 'hazard_%s_%s' % (name, key) if key else 'hazard_%s' % name
+                    lines.append('# TYPE %s gauge' % metric)
+                    lines.append('%s %s' % (metric, repr(float(v))))
+
+        lines.append('# TYPE hazard_stage_seconds histogram')
+        for name, h in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, c in zip(self.bucketBounds + (float('inf'),), h['buckets']):
+                cumulative += c
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('hazard_stage_seconds_bucket{stage="%s",le="%s"} %d' % (name, le, cumulative))
+            lines.append('hazard_stage_seconds_sum{stage="%s"} %r' % (name, h['sum']))
+            lines.append('hazard_stage_seconds_count{stage="%s"} %d' % (name, h['count']))
+        return '\n'.join(lines) + '\n'
+
+    def StartHttpServer(self, port, host='127.0.0.1'):
+        """
+        Serve /metrics (Prometheus text) and /metrics.json from a daemon thread
+        :return: the HTTPServer instance
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/metrics.json'):
+                    body = json.dumps(metrics.Snapshot()).encode('utf-8')
+                    contentType = 'application/json'
+                elif self.path.startswith('/metrics'):
+                    body = metrics.PrometheusText().encode('utf-8')
+                    contentType = 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # keep the server console quiet
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+    def StartJsonSnapshots(self, path, interval):
+        # Periodically (every interval seconds) replace path with the latest JSON snapshot
+        def write_loop():
+            while True:
+                time.sleep(interval)
+                tmp = path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(self.Snapshot(), f)
+                os.replace(tmp, path)
+
+        thread = threading.Thread(target=write_loop, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,477 @@
+# Same-host shared-memory transport between the hazard server and local clients
+#
+# UDP stays the transport for Unity and remote clients. Processes on the same host can instead
+# attach to a shared memory segment (multiprocessing.shared_memory, /dev/shm/<name> on Linux) with
+# one lane per client. A lane holds:
+#   request ring  single producer (client) / single consumer (server) ring of position requests:
+#                 seq (I) | flags (I) | timestamp us (q) | x, y, z (3f) | vx, vy, vz (3f)
+#                 The client writes a slot and then advances head, the server reads up to head and
+#                 advances tail; a full ring drops the new request (the server serves the newest anyway).
+#   reply slots   two slots written alternately, each protected by a seqlock (version is odd while the
+#                 server writes it), and a count of published replies selecting the newest slot. Readers
+#                 never block the server: they read the newest slot and retry if its version changed,
+#                 and a zero-copy view stays valid until the server comes back to that slot two replies later.
+# Python cannot issue memory barriers, so the seqlock relies on stores becoming visible in program
+# order, as on x86-64 (the server's host); numpy writes the 8 byte counters with single aligned stores.
+#
+#   python ShmComms.py --bench                    # round trips over UDP text, UDP binary and shared memory
+#   python ShmComms.py --bench --dem DEMS/dem1.tif  # the same against server.py computing real maps
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import SafetyProtocol as SP
+
+MAGIC = b'LLSM'
+VERSION = 1
+DEFAULT_NAME = 'lunar_lander_hazard'
+
+FLAG_VELOCITY = 1
+
+# Busy-waiting yields the CPU so the peer can run when both share a core
+yield_cpu = getattr(os, 'sched_yield', lambda: time.sleep(0))
+
+HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'), ('lanes', '<u4'), ('ringSlots', '<u4'),
+                   ('mapSize', '<u4'), ('maxSites', '<u4'), ('laneBytes', '<u8')], align=True)
+REQUEST = np.dtype([('seq', '<u4'), ('flags', '<u4'), ('timestamp', '<i8'),
+                    ('position', '<f4', 3), ('velocity', '<f4', 3)], align=True)
+HEADER_BYTES = 64
+
+
+def reply_dtype(mapSize, maxSites):
+    return np.dtype([('version', '<u8'), ('seq', '<u4'), ('siteCount', '<u4'), ('timestamp', '<i8'),
+                     ('centroids', '<i4', 4), ('map', 'u1', (mapSize, mapSize)),
+                     ('sites', '<f4', (maxSites, 5))], align=True)
+
+
+def lane_dtype(ringSlots, mapSize, maxSites):
+    # Counters written by different processes sit on separate cache lines
+    replies = reply_dtype(mapSize, maxSites)
+    ringOffset = 192
+    repliesOffset = ringOffset + ringSlots * REQUEST.itemsize
+    size = repliesOffset + 2 * replies.itemsize
+    return np.dtype({'names': ['head', 'tail', 'published', 'ring', 'replies'],
+                     'formats': ['<u8', '<u8', '<u8', (REQUEST, ringSlots), (replies, 2)],
+                     'offsets': [0, 64, 128, ringOffset, repliesOffset],
+                     'itemsize': (size + 63) // 64 * 64})
+
+
+def attach(name):
+    # Open an existing segment without handing it to this process's resource tracker, which would
+    # otherwise unlink it when the client exits (Python < 3.13)
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+
+class ShmLanes():
+    def __init__(self, shm):
+        # Per-field array views over a segment created by ShmServer (indexing plain arrays is much cheaper
+        # than structured records): counters (lanes,), ring fields (lanes, ringSlots, ...), reply fields (lanes, 2, ...)
+        header = np.ndarray((), dtype=HEADER, buffer=shm.buf)
+        if bytes(header['magic']) != MAGIC or int(header['version']) != VERSION:
+            raise ValueError("%s is not a hazard server segment" % shm.name)
+        self.shm = shm
+        self.mapSize = int(header['mapSize'])
+        self.maxSites = int(header['maxSites'])
+        self.ringSlots = int(header['ringSlots'])
+        self.count = int(header['lanes'])
+        lanes = np.ndarray((self.count,), dtype=lane_dtype(self.ringSlots, self.mapSize, self.maxSites),
+                           buffer=shm.buf, offset=HEADER_BYTES)
+        self.head, self.tail, self.published = lanes['head'], lanes['tail'], lanes['published']
+        ring, replies = lanes['ring'], lanes['replies']
+        self.seqs, self.flags, self.timestamps = ring['seq'], ring['flags'], ring['timestamp']
+        self.positions, self.velocities = ring['position'], ring['velocity']
+        self.versions, self.replySeqs, self.replyTimes = replies['version'], replies['seq'], replies['timestamp']
+        self.siteCounts, self.centroids = replies['siteCount'], replies['centroids']
+        self.maps, self.sites = replies['map'], replies['sites']
+
+    def Release(self):
+        # Drop the views so the segment can be closed
+        for name in list(vars(self)):
+            if isinstance(getattr(self, name), np.ndarray):
+                setattr(self, name, None)
+        self.shm.close()
+
+
+def slot_version(reply):
+    # Seqlock version of the slot holding reply number n (1-based) while it is the newest: that slot
+    # (n - 1) % 2 has then been written (n - 1) // 2 + 1 times, two increments per write
+    return 2 * ((reply - 1) // 2 + 1)
+
+
+class ShmServer():
+    def __init__(self, name=DEFAULT_NAME, lanes=8, ringSlots=64, mapSize=64, maxSites=16):
+        """
+        Create the shared memory segment (replacing one left behind by a crashed server)
+        :param name: segment name clients attach to
+        :param lanes: number of clients that can be connected at once, one lane each
+        :param ringSlots: pending requests per lane
+        :param mapSize: safety map edge length
+        :param maxSites: landing site candidates a reply can carry
+        """
+        dtype = lane_dtype(ringSlots, mapSize, maxSites)
+        size = HEADER_BYTES + lanes * dtype.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = attach(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        shm.buf[:size] = bytes(size)
+
+        header = np.ndarray((), dtype=HEADER, buffer=shm.buf)
+        header['lanes'], header['ringSlots'], header['mapSize'] = lanes, ringSlots, mapSize
+        header['maxSites'], header['laneBytes'] = maxSites, dtype.itemsize
+        header['version'] = VERSION
+        header['magic'] = MAGIC # last: clients check it before using the layout
+        del header
+
+        self.name = name
+        self.lanes = ShmLanes(shm)
+        self.received = 0
+        self.published = 0
+        self.polls = 0
+
+    def Poll(self, timeout=0.0, spin=0.0002, maxSleep=0.001):
+        """
+        Collect pending requests of all lanes, waiting up to timeout for the first one
+        Waiting spins (yielding the CPU) for spin seconds and then sleeps with a growing interval up to maxSleep.
+        :return: list of (lane, seq, timestamp us, [x, y, z], velocity or None), oldest first per lane
+        """
+        lanes = self.lanes
+        start = time.perf_counter()
+        delay = 0.0
+        while True:
+            self.polls += 1
+            heads = lanes.head.tolist()
+            tails = lanes.tail.tolist()
+            if heads != tails:
+                break
+            elapsed = time.perf_counter() - start
+            if elapsed >= timeout:
+                return []
+            if elapsed <= spin:
+                yield_cpu()
+                continue
+            delay = min(maxSleep, max(delay * 2, 5e-5))
+            time.sleep(min(delay, max(0.0, timeout - elapsed)))
+
+        requests = []
+        for lane, (head, tail) in enumerate(zip(heads, tails)):
+            for i in range(max(tail, head - lanes.ringSlots), head):
+                slot = i % lanes.ringSlots
+                velocity = lanes.velocities[lane, slot].tolist() if lanes.flags[lane, slot] & FLAG_VELOCITY else None
+                requests.append((lane, int(lanes.seqs[lane, slot]), int(lanes.timestamps[lane, slot]),
+                                 lanes.positions[lane, slot].tolist(), velocity))
+            if head != tail:
+                lanes.tail[lane] = head
+        self.received += len(requests)
+        return requests
+
+    def Publish(self, lane, seq, safety_map, cx, cy, global_cx, global_cy, sites=None, timestamp=None):
+        """
+        Write a reply into the lane's next reply slot
+        :param safety_map: (mapSize, mapSize) array as computed (non-zero cells are safe)
+        :param sites: optional (n, 5) candidates: cx, cy, global_cx, global_cy, clearance (at most maxSites)
+        """
+        lanes = self.lanes
+        published = int(lanes.published[lane])
+        slot = published % 2
+        version = int(lanes.versions[lane, slot])
+        lanes.versions[lane, slot] = version + 1 # odd: being written
+        lanes.replySeqs[lane, slot] = seq & 0xFFFFFFFF
+        lanes.replyTimes[lane, slot] = SP.timestamp_us() if timestamp is None else timestamp
+        lanes.centroids[lane, slot] = (int(cx), int(cy), int(global_cx), int(global_cy))
+        lanes.maps[lane, slot] = safety_map
+        siteCount = 0 if sites is None else min(len(sites), lanes.maxSites)
+        if siteCount:
+            lanes.sites[lane, slot, :siteCount] = np.asarray(sites, dtype=np.float32)[:siteCount]
+        lanes.siteCounts[lane, slot] = siteCount
+        lanes.versions[lane, slot] = version + 2
+        lanes.published[lane] = published + 1
+        self.published += 1
+
+    def Close(self):
+        # Unlink first: clients that are still attached keep their mapping until they close it
+        try:
+            self.lanes.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.lanes.Release()
+
+    def Stats(self):
+        return {
+            'lanes': self.lanes.count,
+            'received': self.received,
+            'published': self.published,
+            'polls': self.polls,
+        }
+
+
+class ShmClient():
+    def __init__(self, name=DEFAULT_NAME, lane=0):
+        """
+        Attach to a running server's segment
+        :param name: segment name given to the server (server.py --shm)
+        :param lane: lane of this client; every co-located client needs its own
+        """
+        self.lanes = ShmLanes(attach(name))
+        if not 0 <= lane < self.lanes.count:
+            raise ValueError("Lane %d does not exist, the server has %d" % (lane, self.lanes.count))
+        self.lane = lane
+        self.head = int(self.lanes.head[lane])
+        self.seq = 0
+        self.dropped = 0
+        self.retries = 0
+
+    def SendPosition(self, x, y, z, velocity=None, seq=None):
+        """
+        Queue a position request
+        :return: its sequence number, or None if the ring is full
+        """
+        lanes, lane = self.lanes, self.lane
+        if self.head - int(lanes.tail[lane]) >= lanes.ringSlots:
+            self.dropped += 1
+            return None
+        seq = self.seq if seq is None else seq
+        self.seq = (seq + 1) & 0xFFFFFFFF
+        slot = self.head % lanes.ringSlots
+        lanes.seqs[lane, slot] = seq
+        lanes.timestamps[lane, slot] = SP.timestamp_us()
+        lanes.positions[lane, slot] = (x, y, z)
+        if velocity is not None:
+            lanes.velocities[lane, slot] = velocity
+        lanes.flags[lane, slot] = FLAG_VELOCITY if velocity is not None else 0
+        self.head += 1
+        lanes.head[lane] = self.head # publishes the slot
+        return seq
+
+    def Latest(self, copy=True):
+        """
+        Read the newest reply
+        With copy=False the map and sites are views into shared memory: check Valid(reply) after using them.
+        :return: (reply number, seq, timestamp, safety_map, cx, cy, global_cx, global_cy, sites),
+                 or None before the first reply
+        """
+        lanes, lane = self.lanes, self.lane
+        while True:
+            published = int(lanes.published[lane])
+            if published == 0:
+                return None
+            slot = (published - 1) % 2
+            version = slot_version(published)
+            if int(lanes.versions[lane, slot]) != version: # being overwritten by a newer reply
+                self.retries += 1
+                continue
+            cx, cy, global_cx, global_cy = lanes.centroids[lane, slot].tolist()
+            safety_map = lanes.maps[lane, slot]
+            sites = lanes.sites[lane, slot, :int(lanes.siteCounts[lane, slot])]
+            reply = (published, int(lanes.replySeqs[lane, slot]), int(lanes.replyTimes[lane, slot]),
+                     safety_map.copy() if copy else safety_map, cx, cy, global_cx, global_cy,
+                     sites.copy() if copy else sites)
+            if int(lanes.versions[lane, slot]) == version:
+                return reply
+            self.retries += 1
+
+    def Valid(self, reply):
+        # True while a zero-copy reply from Latest(copy=False) has not been overwritten
+        return int(self.lanes.versions[self.lane, (reply[0] - 1) % 2]) == slot_version(reply[0])
+
+    def WaitReply(self, seq, timeout=1.0, copy=True):
+        # Poll until a reply answers seq or a later request; None on timeout
+        end = time.perf_counter() + timeout
+        published = -1
+        while True:
+            current = int(self.lanes.published[self.lane])
+            if current != published: # only read the slot when something new was published
+                published = current
+                reply = self.Latest(copy)
+                if reply is not None and ((reply[1] - seq) & 0xFFFFFFFF) < 0x80000000:
+                    return reply
+            if time.perf_counter() > end:
+                return None
+            yield_cpu()
+
+    def Close(self):
+        self.lanes.Release()
+
+    def Stats(self):
+        return {'sent': self.head, 'dropped': self.dropped, 'retries': self.retries}
+
+
+def echo_server(transport, name, port, ready, safety_map):
+    # Reply to every request with a fixed map: isolates transport cost from hazard computation
+    import signal
+    import socket
+    import sys
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # remove the segment when the benchmark stops us
+    if transport == 'shm':
+        server = ShmServer(name, lanes=1)
+        ready.set()
+        try:
+            while True:
+                for lane, seq, _, _, _ in server.Poll(timeout=1.0):
+                    server.Publish(lane, seq, safety_map, 1, 2, 3, 4)
+        finally:
+            server.Close()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', port))
+    encoder = SP.ReplyEncoder(*safety_map.shape)
+    ready.set()
+    while True:
+        data, address = sock.recvfrom(2048)
+        if SP.is_binary(data):
+            seq = SP.decode_position(data)[0]
+            sock.sendto(encoder.Encode(seq, safety_map, 1, 2, 3, 4), address)
+        else:
+            values = data.decode('utf-8').split(',')
+            text = ','.join(map(str, safety_map.flatten())) + ';1;2;3;4;' + values[3]
+            sock.sendto(text.encode('utf-8'), address)
+
+
+def udp_round_trips(port, count, text, trajectory):
+    # Round-trip latencies (s) of blocking request/reply pairs, including decoding the reply like a client would
+    import socket
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    samples = []
+    for seq in range(count):
+        x, y, z = trajectory[seq % len(trajectory)]
+        start = time.perf_counter()
+        if text:
+            sock.sendto(('%s,%s,%s,%d' % (x, y, z, seq)).encode('utf-8'), ('127.0.0.1', port))
+        else:
+            sock.sendto(SP.encode_position(seq, x, y, z), ('127.0.0.1', port))
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                break
+            if text:
+                fields = data.decode('utf-8').split(';')
+                replySeq = int(fields[5])
+                np.array(fields[0].split(','), dtype=np.int32).reshape(64, 64)
+            else:
+                replySeq = SP.decode_reply(data)[0]
+            if replySeq == seq:
+                samples.append(time.perf_counter() - start)
+                break
+    sock.close()
+    return samples
+
+
+def shm_round_trips(name, count, trajectory, copy):
+    client = ShmClient(name)
+    samples = []
+    for seq in range(count):
+        x, y, z = trajectory[seq % len(trajectory)]
+        start = time.perf_counter()
+        client.SendPosition(x, y, z, seq=seq)
+        reply = client.WaitReply(seq, copy=copy)
+        if reply is not None and reply[1] == seq:
+            samples.append(time.perf_counter() - start)
+    client.Close()
+    return samples
+
+
+def summarize(samples):
+    if not samples:
+        return {'round_trips': 0}
+    values = np.asarray(samples) * 1e6
+    return {'round_trips': len(samples), 'p50_us': float(np.percentile(values, 50)),
+            'p90_us': float(np.percentile(values, 90)), 'p99_us': float(np.percentile(values, 99)),
+            'rate_hz': len(samples) / float(np.sum(samples))}
+
+
+def bench(count=5000, dem=None, name=DEFAULT_NAME + '_bench', port=8101):
+    """
+    Round-trip latency of UDP text, UDP binary and shared memory on this host
+    Without a DEM, child processes answer with a fixed map (transport cost only); with a DEM,
+    server.py serves both transports and every request computes a real hazard map.
+    """
+    import multiprocessing
+    import subprocess
+    import sys
+
+    rng = np.random.default_rng(0)
+    trajectory = np.column_stack([1100 + rng.uniform(-20, 20, 256), rng.uniform(50, 500, 256),
+                                  1100 + rng.uniform(-20, 20, 256)]).tolist()
+    cases = [('udp_text', lambda: udp_round_trips(port, count, True, trajectory)),
+             ('udp_binary', lambda: udp_round_trips(port, count, False, trajectory)),
+             ('shm', lambda: shm_round_trips(name, count, trajectory, copy=True)),
+             ('shm_zero_copy', lambda: shm_round_trips(name, count, trajectory, copy=False))]
+
+    results = {}
+    if dem is not None:
+        process = subprocess.Popen([sys.executable, 'server.py', '--dem', dem, '--rx-port', str(port),
+                                    '--shm', name, '--deadline-ms', '0', '--cache-size', '0'],
+                                   stdout=subprocess.PIPE, text=True)
+        try:
+            while 'server active' not in process.stdout.readline():
+                pass
+            for case, fn in cases:
+                results[case] = summarize(fn())
+        finally:
+            process.terminate()
+            process.wait()
+        return results
+
+    safety_map = np.where(rng.random((64, 64)) < 0.7, SP.SAFE_VALUE, 0).astype(np.uint8)
+    for case, fn in cases:
+        ready = multiprocessing.Event()
+        child = multiprocessing.Process(target=echo_server, daemon=True,
+                                        args=('shm' if case.startswith('shm') else 'udp', name, port, ready, safety_map))
+        child.start()
+        ready.wait(10)
+        try:
+            results[case] = summarize(fn())
+        finally:
+            child.terminate()
+            child.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-memory transport of the hazard server")
+    parser.add_argument('--bench', action='store_true', help="compare round trips over UDP and shared memory")
+    parser.add_argument('--count', type=int, default=5000, help="round trips per transport")
+    parser.add_argument('--dem', default=None, help="benchmark against server.py serving this DEM instead of an echo")
+    parser.add_argument('--port', type=int, default=8101, help="UDP port of the benchmark server")
+    parser.add_argument('--json', default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help()
+        return
+
+    results = bench(args.count, args.dem, port=args.port)
+    for case, result in results.items():
+        if result['round_trips']:
+            print('%-14s p50 %8.1f us  p90 %8.1f us  p99 %8.1f us  %8.0f round trips/s' % (
+                case, result['p50_us'], result['p90_us'], result['p99_us'], result['rate_hz']))
+        else:
+            print('%-14s no replies' % case)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
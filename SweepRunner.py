@@ -0,0 +1,607 @@
+# Parallel hyperparameter / curriculum sweeps over the ML-Agents configs in config/
+#
+# A sweep file names a base config and the values to vary, as dotted paths into it. Every grid point
+# (crossed with every random sample, if any) is one trial; with phases, each trial is a chain of
+# runs where phase k starts from phase k-1's model (--initialize-from), like finalphase1a..6a:
+#
+#   base: config/LunarLander.yaml
+#   name: lrsweep
+#   overrides:                 # applied to every run
+#     env_settings.env_path: builds/LunarLander
+#     env_settings.num_envs: 2
+#   grid:
+#     behaviors.LunarLander.hyperparameters.learning_rate: [0.0001, 0.0003]
+#     behaviors.LunarLander.hyperparameters.batch_size: [128, 1024]
+#   random:
+#     count: 4
+#     seed: 0
+#     params:
+#       behaviors.LunarLander.hyperparameters.beta: {log_uniform: [0.001, 0.01]}
+#       behaviors.LunarLander.network_settings.hidden_units: {choice: [64, 128, 256]}
+#   phases:                    # optional curriculum
+#     - {name: 1a, overrides: {behaviors.LunarLander.max_steps: 3000000}}
+#     - {name: 1b, overrides: {behaviors.LunarLander.max_steps: 6000000}}
+#
+#   python SweepRunner.py run sweep.yaml --cpus 16       # mlagents-learn, concurrently
+#   python SweepRunner.py run sweep.yaml --stub          # stub trainer, no Unity build needed
+#   python SweepRunner.py summary sweep.yaml
+#
+# Scheduling: a run needs env_settings.num_envs + 1 cores (Unity instances plus the trainer) unless
+# cpus_per_run is given. Runs start while the cores they need are free, and are pinned to those cores
+# (sched_setaffinity, or SetProcessAffinityMask on Windows right after the trainer starts; the Unity
+# processes inherit it) with the BLAS/torch thread pools sized to match. On Windows machines with more
+# than 64 logical cores the budget is only advisory (no pinning).
+# Every running run gets its own block of num_envs ports (env_settings.base_port), skipping ports
+# something else listens on.
+#
+# State is kept in sweeps/<name>/state.json. Rerunning the same sweep continues it: finished runs are
+# skipped, and interrupted runs (runner stopped, trainer crashed) resume from their checkpoint.pt with
+# --resume. Stopping the runner (Ctrl+C / SIGTERM) sends SIGINT to the trainers, which makes
+# mlagents-learn save a checkpoint before it exits. On Windows the trainers run in their own process
+# groups and get CTRL_BREAK_EVENT instead; mlagents-learn does not handle it and exits at once, so those
+# runs resume from their last checkpoint_interval checkpoint.
+
+import argparse
+import copy
+import itertools
+import json
+import math
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import yaml
+
+BEHAVIOR = 'LunarLander'
+DEFAULT_TRAINER = 'mlagents-learn'
+WINDOWS = sys.platform == 'win32'
+
+
+def set_path(config, path, value):
+    # Set a dotted path (e.g. behaviors.LunarLander.hyperparameters.beta), creating missing levels
+    keys = path.split('.')
+    node = config
+    for key in keys[:-1]:
+        if not isinstance(node.get(key), dict):
+            node[key] = {}
+        node = node[key]
+    node[keys[-1]] = value
+
+
+def get_path(config, path, default=None):
+    node = config
+    for key in path.split('.'):
+        if not isinstance(node, dict) or key not in node:
+            return default
+        node = node[key]
+    return node
+
+
+def sample_value(spec, rng):
+    # One random draw of a sweep parameter: {choice: [...]}, {uniform: [a, b]}, {log_uniform: [a, b]} or {int_uniform: [a, b]}
+    (kind, args), = spec.items()
+    if kind == 'choice':
+        return rng.choice(args)
+    if kind == 'uniform':
+        return rng.uniform(*args)
+    if kind == 'log_uniform':
+        return math.exp(rng.uniform(math.log(args[0]), math.log(args[1])))
+    if kind == 'int_uniform':
+        return rng.randint(*args)
+    raise ValueError("Unknown sampling %r" % kind)
+
+
+def load_sweep(path):
+    with open(path) as f:
+        sweep = yaml.safe_load(f)
+    sweep.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    sweep.setdefault('base', 'config/LunarLander.yaml')
+    return sweep
+
+
+def expand_runs(sweep):
+    """
+    Runs of a sweep, in scheduling order
+    :return: list of dicts with run_id, trial, phase, params (the varied values), overrides (all values
+             set on the base config) and after (run_id whose model this run starts from, or None)
+    """
+    grid = sweep.get('grid') or {}
+    points = [dict(zip(grid, values)) for values in itertools.product(*grid.values())] or [{}]
+
+    samples = [{}]
+    random_spec = sweep.get('random')
+    if random_spec:
+        rng = random.Random(random_spec.get('seed', 0))
+        samples = [{path: sample_value(spec, rng) for path, spec in random_spec['params'].items()}
+                   for _ in range(random_spec.get('count', 1))]
+
+    phases = sweep.get('phases') or [None]
+    runs = []
+    for trial, (point, sample) in enumerate(itertools.product(points, samples)):
+        params = dict(point, **sample)
+        previous = None
+        for phase in phases:
+            run_id = '%s_%03d' % (sweep['name'], trial) + ('_%s' % phase['name'] if phase else '')
+            overrides = dict(sweep.get('overrides') or {}, **params, **((phase or {}).get('overrides') or {}))
+            runs.append({'run_id': run_id, 'trial': trial, 'phase': phase and phase['name'], 'params': params,
+                         'overrides': overrides, 'after': previous})
+            previous = run_id
+    return runs
+
+
+def write_config(base, overrides, path, base_port):
+    # Base config with the run's overrides and its port block
+    config = copy.deepcopy(base)
+    for key, value in overrides.items():
+        set_path(config, key, value)
+    set_path(config, 'env_settings.base_port', base_port)
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return config
+
+
+def port_free(port):
+    # Nothing listens on the port (ML-Agents talks gRPC over TCP)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(('127.0.0.1', port))
+        except OSError:
+            return False
+    return True
+
+
+class PortAllocator():
+    def __init__(self, basePort=5005, maxPort=65000):
+        """
+        Constructor
+        :param basePort: first port handed out (5004 is the Unity Editor's)
+        """
+        self.basePort = basePort
+        self.maxPort = maxPort
+        self.blocks = {} # first port -> count
+
+    def Reserve(self, count):
+        # First block of count ports that no other run holds and nothing listens on
+        port = self.basePort
+        while port + count <= self.maxPort:
+            clash = next((start + n for start, n in self.blocks.items() if start < port + count and port < start + n), None)
+            if clash is not None:
+                port = clash
+                continue
+            busy = next((p for p in range(port, port + count) if not port_free(p)), None)
+            if busy is None:
+                self.blocks[port] = count
+                return port
+            port = busy + 1
+        raise RuntimeError("No free block of %d ports" % count)
+
+    def Release(self, port):
+        self.blocks.pop(port, None)
+
+
+def pin_process(process, cores):
+    # Windows: restrict a started process to cores; the processes it starts later inherit the mask
+    import ctypes
+    kernel32 = ctypes.windll.kernel32
+    kernel32.SetProcessAffinityMask.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+    if not kernel32.SetProcessAffinityMask(int(process._handle), sum(1 << core for core in set(cores))):
+        print("could not pin process %d to cores %s" % (process.pid, cores))
+
+
+def interrupt_process(process):
+    # Ask a trainer started by SweepRunner.Start (and the Unity processes in its group) to save and exit
+    if WINDOWS:
+        process.send_signal(signal.CTRL_BREAK_EVENT)
+    else:
+        os.killpg(process.pid, signal.SIGINT)
+
+
+def kill_process(process):
+    # Kill a trainer and the Unity processes it started
+    if WINDOWS:
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+    else:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+class CoreAllocator():
+    def __init__(self, cpus):
+        """
+        Constructor
+        :param cpus: number of cores the sweep may use, taken from the cores this process may run on;
+                     more than that oversubscribes them round-robin
+        """
+        self.pinning = hasattr(os, 'sched_setaffinity') or (WINDOWS and (os.cpu_count() or 1) <= 64)
+        available = sorted(os.sched_getaffinity(0)) if self.pinning else list(range(os.cpu_count() or 1))
+        self.free = sorted(available[i % len(available)] for i in range(cpus or len(available)))
+        self.total = len(self.free)
+
+    def Reserve(self, count):
+        # count cores, or None if not enough are free
+        if count > len(self.free):
+            return None
+        cores, self.free = self.free[:count], self.free[count:]
+        return cores
+
+    def Release(self, cores):
+        self.free = sorted(self.free + cores)
+
+
+class SweepRunner():
+    def __init__(self, sweep, resultsDir='results', sweepsDir='sweeps', cpus=None, cpusPerRun=None,
+                 trainer=DEFAULT_TRAINER, trainerArgs='', basePort=5005, maxAttempts=3, poll=1.0, grace=60.0):
+        """
+        Constructor
+        :param sweep: sweep description (see load_sweep)
+        :param cpus: core budget of the whole sweep (default: every core this process may use)
+        :param cpusPerRun: cores per run (default: env_settings.num_envs + 1)
+        :param trainer: trainer command, called as <trainer> <config> --run-id=<id> --results-dir=<dir> [...]
+        :param trainerArgs: extra trainer arguments, e.g. "--env=builds/LunarLander --no-graphics"
+        :param maxAttempts: launches per run before it is given up (resumed launches included)
+        :param grace: seconds trainers get to save a checkpoint after SIGINT when the sweep is stopped
+        """
+        self.sweep = sweep
+        self.resultsDir = resultsDir
+        self.sweepDir = os.path.join(sweepsDir, sweep['name'])
+        self.trainer = shlex.split(trainer) if isinstance(trainer, str) else list(trainer)
+        self.trainerArgs = shlex.split(trainerArgs)
+        self.cpusPerRun = cpusPerRun or sweep.get('cpus_per_run')
+        self.maxAttempts = maxAttempts
+        self.poll = poll
+        self.grace = grace
+        self.cores = CoreAllocator(cpus)
+        self.ports = PortAllocator(basePort)
+
+        with open(sweep['base']) as f:
+            self.base = yaml.safe_load(f)
+        self.runs = expand_runs(sweep)
+        self.statePath = os.path.join(self.sweepDir, 'state.json')
+        self.state = self.LoadState()
+        self.running = {} # run_id -> (Popen, cores, base port, log file)
+        self.stopping = False
+
+    def LoadState(self):
+        # Per-run status, attempts and timing; runs left 'running' by a stopped runner count as interrupted
+        state = {}
+        if os.path.exists(self.statePath):
+            with open(self.statePath) as f:
+                state = json.load(f)
+        for run in self.runs:
+            entry = state.setdefault(run['run_id'], {'status': 'pending', 'attempts': 0, 'elapsed_s': 0.0})
+            entry['params'] = run['params']
+            if entry['status'] == 'running':
+                entry['status'] = 'interrupted'
+        return state
+
+    def SaveState(self):
+        os.makedirs(self.sweepDir, exist_ok=True)
+        tmp = self.statePath + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.statePath)
+
+    def Checkpoint(self, run_id):
+        return os.path.join(self.resultsDir, run_id, BEHAVIOR, 'checkpoint.pt')
+
+    def CoresNeeded(self, config):
+        needed = self.cpusPerRun or (get_path(config, 'env_settings.num_envs', 1) + 1)
+        return max(1, min(needed, self.cores.total))
+
+    def Ready(self):
+        # Runs that can start now, in order; runs behind a failed phase are skipped
+        ready = []
+        for run in self.runs:
+            entry = self.state[run['run_id']]
+            if entry['status'] not in ('pending', 'interrupted') or run['run_id'] in self.running:
+                continue
+            if run['after'] is not None:
+                status = self.state[run['after']]['status']
+                if status in ('failed', 'skipped'):
+                    entry['status'] = 'skipped'
+                    continue
+                if status != 'done':
+                    continue
+            ready.append(run)
+        return ready
+
+    def Start(self, run):
+        run_id = run['run_id']
+        entry = self.state[run_id]
+        config = copy.deepcopy(self.base)
+        for key, value in run['overrides'].items():
+            set_path(config, key, value)
+        cores = self.cores.Reserve(self.CoresNeeded(config))
+        if cores is None:
+            return False
+        num_envs = get_path(config, 'env_settings.num_envs', 1)
+        port = self.ports.Reserve(num_envs)
+
+        os.makedirs(os.path.join(self.sweepDir, 'configs'), exist_ok=True)
+        os.makedirs(os.path.join(self.sweepDir, 'logs'), exist_ok=True)
+        config_path = os.path.join(self.sweepDir, 'configs', run_id + '.yaml')
+        write_config(self.base, run['overrides'], config_path, port)
+
+        command = self.trainer + [config_path, '--run-id=%s' % run_id, '--results-dir=%s' % self.resultsDir]
+        if os.path.exists(self.Checkpoint(run_id)):
+            command.append('--resume')
+            entry['resumed'] = entry.get('resumed', 0) + 1
+        else:
+            if os.path.exists(os.path.join(self.resultsDir, run_id)):
+                command.append('--force') # a failed start left a results directory without checkpoint
+            if run['after'] is not None:
+                command.append('--initialize-from=%s' % run['after'])
+        command += self.trainerArgs
+
+        # Thread pools of the trainer sized to its cores
+        env = dict(os.environ, OMP_NUM_THREADS=str(len(cores)), MKL_NUM_THREADS=str(len(cores)))
+        log = open(os.path.join(self.sweepDir, 'logs', run_id + '.log'), 'a')
+        log.write('\n$ %s\n' % ' '.join(shlex.quote(c) for c in command))
+        log.flush()
+        if WINDOWS:
+            # Own process group, so CTRL_BREAK_EVENT reaches only this trainer and its Unity processes
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                       creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+            if self.cores.pinning:
+                pin_process(process, cores)
+        else:
+            pin = (lambda: os.sched_setaffinity(0, cores)) if self.cores.pinning else None
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env, preexec_fn=pin,
+                                       start_new_session=True)
+        self.running[run_id] = (process, cores, port, log)
+        entry.update({'status': 'running', 'attempts': entry['attempts'] + 1, 'base_port': port, 'cores': cores,
+                      'started': time.time()})
+        print("started %s (cores %s, ports %d-%d%s)" % (run_id, ','.join(map(str, cores)), port, port + num_envs - 1,
+                                                        ', resumed' if '--resume' in command else ''), flush=True)
+        return True
+
+    def Reap(self):
+        # Collect finished trainers and free their cores and ports
+        for run_id, (process, cores, port, log) in list(self.running.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del self.running[run_id]
+            self.cores.Release(cores)
+            self.ports.Release(port)
+            log.close()
+            entry = self.state[run_id]
+            entry['elapsed_s'] += time.time() - entry.pop('started')
+            entry['exit_code'] = code
+            if code == 0 and not self.stopping:
+                entry['status'] = 'done'
+            elif self.stopping or entry['attempts'] < self.maxAttempts:
+                entry['status'] = 'interrupted'
+            else:
+                entry['status'] = 'failed'
+            print("%s %s (exit %d)" % (run_id, entry['status'], code), flush=True)
+
+    def Stop(self, *_):
+        # Ask the trainers to save a checkpoint and exit; the main loop waits for them
+        if not self.stopping:
+            self.stopping = True
+            self.stopDeadline = time.monotonic() + self.grace
+            print("stopping: interrupting %d trainers" % len(self.running), flush=True)
+            for process, _, _, _ in self.running.values():
+                interrupt_process(process)
+
+    def Run(self):
+        signal.signal(signal.SIGINT, self.Stop)
+        signal.signal(signal.SIGTERM, self.Stop)
+        if WINDOWS:
+            signal.signal(signal.SIGBREAK, self.Stop)
+        self.SaveState()
+        while True:
+            self.Reap()
+            if self.stopping:
+                if not self.running:
+                    break
+                if time.monotonic() > self.stopDeadline:
+                    for process, _, _, _ in self.running.values():
+                        kill_process(process)
+            else:
+                for run in self.Ready():
+                    if not self.Start(run):
+                        break # wait for cores; keep the sweep order
+                if not self.running and not self.Ready():
+                    break
+            self.SaveState()
+            time.sleep(self.poll)
+        self.SaveState()
+        return summarize(self.runs, self.state, self.resultsDir)
+
+
+def training_status(results_dir, run_id):
+    # Checkpoints (steps, reward) mlagents-learn recorded in run_logs/training_status.json
+    path = os.path.join(results_dir, run_id, 'run_logs', 'training_status.json')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        status = json.load(f)
+    behavior = status.get(BEHAVIOR, {})
+    checkpoints = list(behavior.get('checkpoints', []))
+    final = behavior.get('final_checkpoint')
+    if final and final not in checkpoints:
+        checkpoints.append(final)
+    return [(c['steps'], c['reward']) for c in checkpoints if c.get('reward') is not None]
+
+
+def summarize(runs, state, results_dir):
+    # One row per run with its varied parameters, status and rewards, best final reward first
+    rows = []
+    for run in runs:
+        entry = state.get(run['run_id'], {})
+        checkpoints = training_status(results_dir, run['run_id'])
+        rows.append({
+            'run_id': run['run_id'],
+            'phase': run['phase'],
+            'params': run['params'],
+            'status': entry.get('status', 'pending'),
+            'attempts': entry.get('attempts', 0),
+            'resumed': entry.get('resumed', 0),
+            'elapsed_s': round(entry.get('elapsed_s', 0.0), 1),
+            'steps': checkpoints[-1][0] if checkpoints else None,
+            'final_reward': checkpoints[-1][1] if checkpoints else None,
+            'best_reward': max(r for _, r in checkpoints) if checkpoints else None,
+        })
+    rows.sort(key=lambda r: -math.inf if r['final_reward'] is None else r['final_reward'], reverse=True)
+    return rows
+
+
+def print_summary(rows):
+    for row in rows:
+        params = ' '.join('%s=%s' % (key.rsplit('.', 1)[-1], value) for key, value in row['params'].items())
+        reward = '%10.1f' % row['final_reward'] if row['final_reward'] is not None else '%10s' % '-'
+        print('%-28s %-11s %9s steps  reward %s  %s' % (row['run_id'], row['status'], row['steps'] or '-', reward, params))
+
+
+def stub_trainer(argv):
+    """
+    Stand-in for mlagents-learn with the same command line, for testing sweeps without a Unity build
+    Listens on the config's ports, writes checkpoint.pt and run_logs/training_status.json every
+    checkpoint_interval steps at --rate simulated steps per second (rewards are a made-up function of
+    the hyperparameters), resumes from checkpoint.pt and saves one on SIGINT like mlagents-learn
+    (and on CTRL_BREAK_EVENT on Windows).
+    """
+    parser = argparse.ArgumentParser(prog='SweepRunner.py stub-trainer')
+    parser.add_argument('config')
+    parser.add_argument('--run-id', required=True)
+    parser.add_argument('--results-dir', default='results')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--force', action='store_true')
+    parser.add_argument('--initialize-from', default=None)
+    parser.add_argument('--rate', type=float, default=2e6, help="simulated steps per second")
+    parser.add_argument('--fail-at', type=int, default=None, help="exit with an error at this step (tests resume)")
+    args, _ = parser.parse_known_args(argv)
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    behavior = config['behaviors'][BEHAVIOR]
+    base_port = config['env_settings']['base_port']
+    run_dir = os.path.join(args.results_dir, args.run_id)
+    model_dir = os.path.join(run_dir, BEHAVIOR)
+    checkpoint = os.path.join(model_dir, 'checkpoint.pt')
+    if os.path.exists(run_dir) and not (args.resume or args.force):
+        print("Previous data from this run ID was found. Use --resume or --force.")
+        return 1
+    os.makedirs(model_dir, exist_ok=True)
+    os.makedirs(os.path.join(run_dir, 'run_logs'), exist_ok=True)
+    with open(os.path.join(run_dir, 'configuration.yaml'), 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+
+    # Hold the run's ports like the Unity environments would; a clash fails the run
+    listeners = []
+    for port in range(base_port, base_port + config['env_settings'].get('num_envs', 1)):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('127.0.0.1', port))
+        s.listen()
+        listeners.append(s)
+
+    step = 0
+    status_path = os.path.join(run_dir, 'run_logs', 'training_status.json')
+    checkpoints = []
+    if args.resume and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            step = json.load(f)['step']
+        if os.path.exists(status_path):
+            with open(status_path) as f:
+                checkpoints = json.load(f)[BEHAVIOR]['checkpoints']
+    start_reward = -5000.0
+    if args.initialize_from:
+        with open(os.path.join(args.results_dir, args.initialize_from, BEHAVIOR, 'checkpoint.pt')) as f:
+            start_reward = json.load(f)['reward']
+
+    hp = behavior['hyperparameters']
+    quality = -abs(math.log10(hp['learning_rate']) + 3.5) - 0.3 * abs(math.log2(hp['batch_size'] / 512))
+    rng = random.Random(args.run_id)
+
+    def reward_at(steps):
+        return start_reward + (9000 + 3000 * quality) * (1 - math.exp(-steps / 1e6)) + rng.gauss(0, 100)
+
+    def save(steps):
+        reward = reward_at(steps)
+        with open(checkpoint + '.tmp', 'w') as f:
+            json.dump({'step': steps, 'reward': reward}, f)
+        os.replace(checkpoint + '.tmp', checkpoint)
+        checkpoints.append({'steps': steps, 'file_path': os.path.join(model_dir, '%s-%d.onnx' % (BEHAVIOR, steps)),
+                            'reward': reward, 'creation_time': time.time(), 'auxillary_file_paths': []})
+        with open(status_path, 'w') as f:
+            json.dump({BEHAVIOR: {'checkpoints': checkpoints[-behavior.get('keep_checkpoints', 5):]},
+                       'metadata': {'stats_format_version': '0.3.0', 'mlagents_version': 'stub'}}, f, indent=4)
+
+    interrupted = []
+    signal.signal(signal.SIGINT, lambda *_: interrupted.append(True))
+    if WINDOWS:
+        signal.signal(signal.SIGBREAK, lambda *_: interrupted.append(True)) # what SweepRunner sends there
+    max_steps = behavior['max_steps']
+    interval = behavior.get('checkpoint_interval', 500000)
+    while step < max_steps and not interrupted:
+        chunk = min(behavior.get('summary_freq', 10000), max_steps - step)
+        time.sleep(chunk / args.rate)
+        step += chunk
+        if args.fail_at is not None and step >= args.fail_at and not args.resume:
+            print("stub trainer failing at step %d" % step, flush=True)
+            return 1
+        if step % interval < chunk:
+            save(step)
+    save(step)
+    print("%s: %d steps, cores %s, ports %d+%d" % (args.run_id, step, sorted(os.sched_getaffinity(0))
+                                                 if hasattr(os, 'sched_getaffinity') else '-', base_port, len(listeners)))
+    return 0
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'stub-trainer':
+        sys.exit(stub_trainer(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Run ML-Agents training sweeps concurrently")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help="run (or continue) a sweep")
+    run_parser.add_argument('sweep', help="sweep YAML file")
+    run_parser.add_argument('--cpus', type=int, default=None, help="cores the sweep may use (default: all)")
+    run_parser.add_argument('--cpus-per-run', type=int, default=None, help="cores per run (default: num_envs + 1)")
+    run_parser.add_argument('--trainer', default=DEFAULT_TRAINER, help="trainer command")
+    run_parser.add_argument('--trainer-args', default='', help='extra trainer arguments, e.g. "--env=builds/Lander --no-graphics"')
+    run_parser.add_argument('--stub', action='store_true', help="use the stub trainer instead of mlagents-learn")
+    run_parser.add_argument('--base-port', type=int, default=5005, help="first port handed to the runs")
+    run_parser.add_argument('--max-attempts', type=int, default=3, help="launches per run before it counts as failed")
+    run_parser.add_argument('--dry-run', action='store_true', help="only list the runs")
+    summary_parser = sub.add_parser('summary', help="rewards and status of a sweep's runs")
+    summary_parser.add_argument('sweep', help="sweep YAML file")
+    for p in (run_parser, summary_parser):
+        p.add_argument('--results', default='results', help="directory with the run directories")
+        p.add_argument('--sweeps', default='sweeps', help="directory for sweep state, generated configs and logs")
+        p.add_argument('--json', default=None, help="write the summary to this JSON file")
+    args = parser.parse_args()
+
+    sweep = load_sweep(args.sweep)
+    if args.command == 'summary':
+        runs = expand_runs(sweep)
+        state_path = os.path.join(args.sweeps, sweep['name'], 'state.json')
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+        rows = summarize(runs, state, args.results)
+    elif args.dry_run:
+        for run in expand_runs(sweep):
+            print(run['run_id'], run['overrides'], 'after %s' % run['after'] if run['after'] else '')
+        return
+    else:
+        trainer = [sys.executable, os.path.abspath(__file__), 'stub-trainer'] if args.stub else args.trainer
+        runner = SweepRunner(sweep, args.results, args.sweeps, args.cpus, args.cpus_per_run, trainer,
+                             args.trainer_args, args.base_port, args.max_attempts)
+        rows = runner.Run()
+
+    print_summary(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+# Append-only binary log of what the hazard server saw and answered during descents
+#
+# Every answered request is one fixed 104 byte little-endian record (RECORD): reply wall time, sender
+# timestamp, lander position and velocity as received, the FOV from getFOV, the reply's
+# cx/cy/global_cx/global_cy, and the request's queueing, compute and total server latency.
+#
+#   python server.py --telemetry descent.tlog
+#   python TelemetryLog.py descent.tlog                          # summary
+#   python TelemetryLog.py descent.tlog --replay --dem DEMS/dem1.tif   # re-run through TerrainProcess
+#
+# Writing is cheap enough for the serving loop: a record is one struct.pack_into into one of two
+# preallocated buffers; a background thread writes a full buffer (or whatever is there every
+# flushInterval) with a single os.write while the serving loop fills the other one.
+#
+# The file is a header (magic, header size, record size, JSON metadata of the run that created it,
+# padded to 512 bytes) followed by the records, so it loads as a memory-mapped NumPy structured
+# array without parsing: millions of records open instantly and fields are column views.
+# A record torn by a crash is cut off when the log is reopened for appending.
+
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b'HZTLOG01'
+HEADER = struct.Struct('<8sII') # magic | header size | record size, followed by JSON metadata
+HEADER_ALIGN = 512
+
+RECORD = np.dtype([
+    ('time', '<f8'),            # wall-clock time the reply was sent (time.time())
+    ('sent_us', '<u8'),         # sender timestamp of binary and shared memory requests, 0 for text
+    ('position', '<f8', (3,)),  # x, altitude, z as received
+    ('velocity', '<f4', (3,)),  # zeros unless FLAG_VELOCITY
+    ('latency', '<f4'),         # seconds from receipt to reply
+    ('queue', '<f4'),           # seconds from receipt to the start of processing
+    ('compute', '<f4'),         # seconds in process_position
+    ('lander', '<u4'),          # UDP session or shared memory lane
+    ('seq', '<u4'),             # NO_SEQ for text requests without a sequence number
+    ('fov_x', '<i4'),
+    ('fov_y', '<i4'),
+    ('fov_size', '<i4'),        # FOV fields are 0 unless FLAG_FOV (atlas answers have none)
+    ('cx', '<i4'),
+    ('cy', '<i4'),
+    ('global_cx', '<i4'),
+    ('global_cy', '<i4'),
+    ('transport', 'u1'),        # TRANSPORT_*
+    ('flags', 'u1'),            # FLAG_*
+    ('reserved', 'V2'),
+])
+RECORD_FORMAT = struct.Struct('<dQ3d3f3fII3i4iBB2x')
+assert RECORD_FORMAT.size == RECORD.itemsize
+
+TRANSPORT_TEXT, TRANSPORT_BINARY, TRANSPORT_SHM = 0, 1, 2
+FLAG_VELOCITY = 1
+FLAG_FOV = 2
+NO_SEQ = 0xFFFFFFFF
+
+
+def create_log(path, metadata):
+    # Open path for appending records, writing the header if the file is new (binary mode on Windows)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0), 0o644)
+    size = os.fstat(fd).st_size
+    if size == 0:
+        text = json.dumps(metadata or {}).encode('utf-8')
+        header_size = -(-(HEADER.size + len(text)) // HEADER_ALIGN) * HEADER_ALIGN
+        os.write(fd, HEADER.pack(MAGIC, header_size, RECORD.itemsize) + text.ljust(header_size - HEADER.size, b'\0'))
+        return fd
+
+    os.lseek(fd, 0, os.SEEK_SET) # os.pread is not available on Windows; O_APPEND writes still go to the end
+    magic, header_size, record_size = HEADER.unpack(os.read(fd, HEADER.size))
+    if magic != MAGIC or record_size != RECORD.itemsize:
+        os.close(fd)
+        raise ValueError("%s is not a telemetry log of this version" % path)
+    torn = (size - header_size) % record_size
+    if torn:
+        os.ftruncate(fd, size - torn)
+    return fd
+
+
+def load_log(path):
+    """
+    Open a log for analysis
+    :return: (metadata dict, read-only memory-mapped RECORD array)
+    """
+    with open(path, 'rb') as f:
+        magic, header_size, record_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.itemsize:
+            raise ValueError("%s is not a telemetry log of this version" % path)
+        metadata = json.loads(f.read(header_size - HEADER.size).rstrip(b'\0') or b'{}')
+    count = (os.path.getsize(path) - header_size) // record_size
+    if count == 0:
+        return metadata, np.empty(0, dtype=RECORD)
+    return metadata, np.memmap(path, dtype=RECORD, mode='r', offset=header_size, shape=(count,))
+
+
+class TelemetryWriter():
+    def __init__(self, path, metadata=None, bufferRecords=4096, flushInterval=1.0):
+        """
+        Constructor
+        :param path: log file, appended to if it exists
+        :param metadata: JSON-serializable description of the run, stored when the log is created
+        :param bufferRecords: records per buffer; the serving loop only waits for the disk when both are full
+        :param flushInterval: seconds after which buffered records are written even if the buffer is not full
+        """
+        self.path = path
+        self.fd = create_log(path, metadata)
+        self.capacity = bufferRecords
+        self.flushInterval = flushInterval
+        self.buffers = [bytearray(bufferRecords * RECORD.itemsize) for _ in range(2)]
+        self.active = 0
+        self.count = 0
+        self.pending = None # (buffer index, records) handed to the flush thread
+        self.closed = False
+        self.condition = threading.Condition()
+
+        self.records = 0
+        self.flushes = 0
+        self.bytes = 0
+        self.stalls = 0 # appends that waited for the flush thread
+
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+    def Append(self, lander, transport, seq, sentUs, position, velocity, fov, site, latency, queue, compute):
+        """
+        Record one answered request
+        :param seq: request sequence number or None
+        :param sentUs: sender timestamp in microseconds or None
+        :param velocity: (vx, vy, vz) or None
+        :param fov: (fovX, fovY, size) or None when no hazard map was computed
+        :param site: (cx, cy, global_cx, global_cy) of the reply
+        """
+        flags = 0
+        if velocity is None:
+            velocity = (0.0, 0.0, 0.0)
+        else:
+            flags |= FLAG_VELOCITY
+        if fov is None:
+            fov = (0, 0, 0)
+        else:
+            flags |= FLAG_FOV
+        cx, cy, global_cx, global_cy = site
+        with self.condition:
+            if self.closed:
+                return
+            if self.count == self.capacity:
+                self.Swap()
+            RECORD_FORMAT.pack_into(self.buffers[self.active], self.count * RECORD.itemsize, time.time(),
+                                    sentUs or 0, *position, *velocity, latency, queue, compute, lander,
+                                    NO_SEQ if seq is None else seq, *fov,
+                                    int(cx), int(cy), int(global_cx), int(global_cy), transport, flags)
+            self.count += 1
+            self.records += 1
+
+    def Swap(self):
+        # Hand the active buffer to the flush thread, waiting if it still writes the other one. Caller holds the condition.
+        while self.pending is not None:
+            self.stalls += 1
+            self.condition.wait()
+        self.pending = (self.active, self.count)
+        self.active ^= 1
+        self.count = 0
+        self.condition.notify_all()
+
+    def Run(self):
+        # Flush thread: write handed-over buffers, and the partial buffer every flushInterval
+        while True:
+            with self.condition:
+                if self.pending is None and not self.closed:
+                    self.condition.wait(self.flushInterval)
+                if self.pending is None and self.count:
+                    self.Swap()
+                if self.pending is None:
+                    if self.closed:
+                        return
+                    continue
+                index, count = self.pending
+
+            data = memoryview(self.buffers[index])[:count * RECORD.itemsize]
+            while data:
+                data = data[os.write(self.fd, data):]
+
+            with self.condition:
+                self.pending = None
+                self.flushes += 1
+                self.bytes += count * RECORD.itemsize
+                self.condition.notify_all()
+
+    def Close(self):
+        # Write what is buffered and close the file
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        os.close(self.fd)
+
+    def Stats(self):
+        with self.condition:
+            return {'records': self.records, 'buffered': self.count, 'flushes': self.flushes,
+                    'bytes': self.bytes, 'stalls': self.stalls}
+
+
+def percentiles(values, scale=1.0):
+    if len(values) == 0:
+        return None
+    values = np.asarray(values, dtype=np.float64) * scale
+    p50, p90, p99 = np.percentile(values, (50, 90, 99))
+    return {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(values.max())}
+
+
+def summarize(records):
+    # Counts, rates and latency distributions of a log (or any slice of one)
+    if len(records) == 0:
+        return {'records': 0}
+    duration = float(records['time'][-1] - records['time'][0])
+    landers = np.unique(records['transport'].astype(np.uint64) << 32 | records['lander'])
+    altitude = records['position'][:, 1]
+    return {
+        'records': len(records),
+        'duration_s': duration,
+        'rate_hz': len(records) / duration if duration > 0 else None,
+        'landers': len(landers),
+        'transports': {name: int((records['transport'] == code).sum())
+                       for name, code in (('text', TRANSPORT_TEXT), ('binary', TRANSPORT_BINARY), ('shm', TRANSPORT_SHM))},
+        'with_velocity': int((records['flags'] & FLAG_VELOCITY != 0).sum()),
+        'without_fov': int((records['flags'] & FLAG_FOV == 0).sum()),
+        'altitude': {'min': float(altitude.min()), 'max': float(altitude.max())},
+        'fov_size': percentiles(records['fov_size'][records['flags'] & FLAG_FOV != 0]),
+        'latency_ms': percentiles(records['latency'], 1e3),
+        'queue_ms': percentiles(records['queue'], 1e3),
+        'compute_ms': percentiles(records['compute'], 1e3),
+    }
+
+
+def replay(records, limit=None):
+    """
+    Run the logged positions through server.TerrainProcess again, one LanderState per logged lander,
+    and compare FOVs and landing sites with the logged replies (the server module must be set up:
+    DEM loaded, cache and site ranking enabled as for the logged run)
+    Records answered without a hazard map (atlas) are not replayed, but their logged site is applied to the
+    lander state as server.atlas_result does, so later fallbacks to the previous site replay correctly.
+    :return: dict with counts, mismatches (record indices) and logged vs replayed compute times
+    """
+    import server
+
+    states = {}
+    fov_mismatches = []
+    site_mismatches = []
+    compute = []
+    replayed = 0
+    count = len(records) if limit is None else min(limit, len(records))
+    for i in range(count):
+        record = records[i]
+        key = (int(record['transport']), int(record['lander']))
+        state = states.get(key)
+        if state is None:
+            state = states[key] = server.LanderState()
+        if not record['flags'] & FLAG_FOV:
+            state.prev_cx, state.prev_cy, state.prev_global_cx, state.prev_global_cy = (
+                int(record[k]) for k in ('cx', 'cy', 'global_cx', 'global_cy'))
+            continue
+
+        x, y, z = record['position'].tolist()
+        fov = server.getFOV(x, y, z)
+        if fov != (int(record['fov_x']), int(record['fov_y']), int(record['fov_size'])):
+            fov_mismatches.append(i)
+            fov = (int(record['fov_x']), int(record['fov_y']), int(record['fov_size']))
+        t0 = time.perf_counter()
+        _, cx, cy, global_cx, global_cy = server.TerrainProcess(*fov, state)
+        compute.append(time.perf_counter() - t0)
+        if (cx, cy, global_cx, global_cy) != tuple(int(record[k]) for k in ('cx', 'cy', 'global_cx', 'global_cy')):
+            site_mismatches.append(i)
+        replayed += 1
+
+    logged = records['compute'][:count][records['flags'][:count] & FLAG_FOV != 0]
+    return {
+        'replayed': replayed,
+        'skipped': count - replayed,
+        'fov_mismatches': len(fov_mismatches),
+        'site_mismatches': len(site_mismatches),
+        'first_mismatches': sorted(fov_mismatches + site_mismatches)[:20],
+        'logged_compute_ms': percentiles(logged, 1e3),
+        'replay_compute_ms': percentiles(compute, 1e3),
+        'replay_rate_hz': replayed / sum(compute) if compute else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or replay a hazard server telemetry log")
+    parser.add_argument('log', help="telemetry log written by server.py --telemetry")
+    parser.add_argument('--replay', action='store_true', help="re-run the logged positions through TerrainProcess")
+    parser.add_argument('--dem', default=None, help="DEM for --replay (default: the one in the log metadata)")
+    parser.add_argument('--cache-size', type=int, default=None, help="hazard cache for --replay (default: as logged)")
+    parser.add_argument('--site-method', choices=('contour', 'distance'), default=None)
+    parser.add_argument('--site-candidates', type=int, default=None)
+    parser.add_argument('--limit', type=int, default=None, help="replay only the first records")
+    parser.add_argument('--json', default=None, help="write the summary (and replay report) to this JSON file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    metadata, records = load_log(args.log)
+    report = {'metadata': metadata, 'load_ms': (time.perf_counter() - start) * 1e3, 'summary': summarize(records)}
+
+    if args.replay:
+        import server
+
+        server.load_dem(args.dem or metadata['dem'])
+        server.enable_pyramid(metadata.get('pyramid'), metadata.get('pyramid_min_fov', 128))
+        cache_size = args.cache_size if args.cache_size is not None else metadata.get('cache_size', 1024)
+        server.enable_cache(cache_size, None, metadata.get('fov_quantization', 1), metadata.get('reuse_tolerance', 0.0))
+        server.enable_site_ranking(args.site_method or metadata.get('site_method', 'contour'),
+                                   args.site_candidates if args.site_candidates is not None
+                                   else metadata.get('site_candidates', 0))
+        report['replay'] = replay(records, args.limit)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
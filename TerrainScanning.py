@@ -2,8 +2,8 @@ import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
 from rasterio.windows import Window
-from scipy.ndimage import generic_filter, median_filter, minimum_filter #, maximum_filter
 import cv2
+from HazardMap import calculate_slope, calculate_roughness, classify_safety, postprocess_safety
 
 def crop_dem(dem_array, posX, posY, size):
     cropped_dem = dem_array[posY:posY+size, posX:posX+size]
@@ -33,46 +33,17 @@ cropped_dem = crop_dem(dem_array, posX, posY, size)
 # Step 2: Resize the cropped DEM array
 resized_dem, pixel_size_x = resize_dem(cropped_dem, new_size, 1)
 
-# Calculate slope using NumPy gradient
-dzdx, dzdy = np.gradient(resized_dem, pixel_size_x)
-slope_rad = np.arctan(np.sqrt(dzdx**2 + dzdy**2))
+# Calculate slope (degrees)
+slope_deg = calculate_slope(resized_dem, pixel_size_x)
 
-# Convert slope to degrees
-slope_deg = np.degrees(slope_rad)
-
-# Function to calculate roughness for a neighborhood
-def calculate_roughness(arr, pixel_size):
-    central_pixel = arr[len(arr) // 2]  # Get the central pixel value
-    max_difference = np.max(np.abs(arr - central_pixel))   # Calculate the maximum difference
-    return max_difference
-
-# Define the size of the neighborhood (e.g., 3x3)
-neighborhood_size = 3
-
-# Calculate surface roughness using a moving window
-roughness_array = generic_filter(resized_dem, calculate_roughness, size=neighborhood_size, extra_arguments=(pixel_size_x,))
-
-# Function to classify safety based on slope and roughness
-def classify_safety(slope, roughness):
-    safe_mask = np.logical_and(slope < 5, roughness < pixel_size_x)
-    return safe_mask
+# Calculate surface roughness over a 3x3 neighbourhood
+roughness_array = calculate_roughness(resized_dem)
 
 # Classify safety based on slope and roughness criteria
-safety_map = classify_safety(slope_deg, roughness_array)
-
-# Function to apply post-processing steps
-def postprocess_safety(safety_map):
-    # Define the kernel for morphological operations
-    kernel_size = max(3, int(15/pixel_size_x))  # Adjust as needed
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
-
-    # Perform opening operation
-    safety_map_opened = cv2.morphologyEx(safety_map.astype(np.uint8), cv2.MORPH_OPEN, kernel)
-
-    return safety_map_opened
+safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
 
 # Post-process the safety map
-safety_map_processed = postprocess_safety(safety_map)
+safety_map_processed = postprocess_safety(safety_map, pixel_size_x)
 
 # Step 1: Load the binary image
 # binary_image_path = 'DEMS/safetymap.png'
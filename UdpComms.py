@@ -6,15 +6,138 @@
 # Use at your own risk
 # Use under the Apache License 2.0
 
+class UdpRing():
+    def __init__(self, slots=4096, slotSize=2048):
+        """
+        Bounded ring of preallocated receive buffers, filled with recvfrom_into (one producer, one consumer)
+        Nothing is lost silently: while the ring is full datagrams stay queued in the kernel socket buffer
+        (whose overflows are reported by UdpComms.KernelDrops) and datagrams larger than a slot are
+        counted as truncated.
+        :param slots: number of datagrams the ring can hold
+        :param slotSize: largest datagram in bytes
+        """
+        import threading
+
+        self.slots = slots
+        self.slotSize = slotSize
+        self.buffer = bytearray(slots * slotSize)
+        self.view = memoryview(self.buffer)
+        self.slotViews = [self.view[i * slotSize:(i + 1) * slotSize] for i in range(slots)]
+        self.lengths = [0] * slots
+        self.addresses = [None] * slots
+        self.times = [0.0] * slots
+        self.head = 0 # datagrams stored (next slot is head % slots)
+        self.tail = 0 # datagrams handed out by Read
+        self.released = 0 # slots below this may be overwritten
+        self.truncated = 0
+        self.highWater = 0 # most slots in use at once
+        self.ready = threading.Condition()
+
+    def Fill(self, sock, maxMessages=1024, wait=False):
+        """
+        Move queued datagrams from the socket into the ring, stopping when the socket is empty
+        :param wait: block for the first datagram and for free slots (receive thread), otherwise the
+                     socket must be non-blocking and filling stops when the ring is full
+        :return: number of datagrams stored
+        """
+        import socket
+        import time
+
+        trunc = getattr(socket, 'MSG_TRUNC', 0) # Linux: report the real size of oversized datagrams
+        dontwait = getattr(socket, 'MSG_DONTWAIT', 0)
+        head = self.head
+        for i in range(maxMessages):
+            if i > 0 and wait and not dontwait:
+                break # cannot drain without blocking on this platform
+            flags = trunc | (dontwait if i > 0 or not wait else 0)
+
+            if head - self.released >= self.slots: # full: leave the rest in the socket buffer
+                if not wait or i > 0:
+                    break
+                with self.ready:
+                    while head - self.released >= self.slots:
+                        self.ready.wait()
+            try:
+                nbytes, address = sock.recvfrom_into(self.slotViews[head % self.slots], self.slotSize, flags)
+            except BlockingIOError: # socket drained
+                break
+            except ConnectionResetError: # Windows reports an unreachable peer (10054) on the next receive
+                continue
+            except OSError as e:
+                if getattr(e, 'winerror', None) == 10040: # Windows: datagram larger than the buffer
+                    self.truncated += 1
+                    continue
+                raise
+
+            if nbytes > self.slotSize:
+                self.truncated += 1
+            else:
+                slot = head % self.slots
+                self.lengths[slot] = nbytes
+                self.addresses[slot] = address
+                self.times[slot] = time.monotonic()
+                head += 1
+
+        stored = head - self.head
+        if stored:
+            with self.ready:
+                self.head = head
+                self.highWater = max(self.highWater, head - self.released)
+                self.ready.notify_all()
+        return stored
+
+    def Read(self, maxMessages=1024, timeout=0):
+        """
+        Hand out the oldest unread datagrams without copying
+        The views stay valid until the next Read or Release, so copy anything kept longer
+        :param timeout: seconds to wait for a datagram if none is pending (needs a filling thread)
+        :return: list of (memoryview, address, receive time from time.monotonic())
+        """
+        with self.ready:
+            self.released = self.tail
+            self.ready.notify_all()
+            if self.head == self.tail and timeout:
+                self.ready.wait(timeout)
+            start = self.tail
+            self.tail = min(self.head, start + maxMessages)
+            end = self.tail
+
+        batch = []
+        for i in range(start, end):
+            slot = i % self.slots
+            batch.append((self.slotViews[slot][:self.lengths[slot]], self.addresses[slot], self.times[slot]))
+        return batch
+
+    def Release(self):
+        # Give the slots of the last Read back to the producer
+        with self.ready:
+            self.released = self.tail
+            self.ready.notify_all()
+
+    def Stats(self):
+        return {
+            'received': self.head,
+            'pending': self.head - self.tail,
+            'truncated': self.truncated,
+            'high_water': self.highWater,
+            'slots': self.slots,
+        }
+
+
 class UdpComms():
-    def __init__(self,udpIP,portTX,portRX,enableRX=False,suppressWarnings=True):
+    def __init__(self,udpIP,portTX,portRX,enableRX=False,suppressWarnings=True,decodeRX=True,
+                 ringSlots=0,slotSize=2048,rcvBufSize=None):
         """
         Constructor
         :param udpIP: Must be string e.g. "127.0.0.1"
         :param portTX: integer number e.g. 8000. Port to transmit from i.e From Python to other application
         :param portRX: integer number e.g. 8001. Port to receive on i.e. From other application to Python
-        :param enableRX: When False you may only send from Python and not receive. If set to True a thread is created to enable receiving of data
+        :param enableRX: When False no receive thread is started (use ReceiveAvailable for event-driven receiving). If set to True a thread is created to enable receiving of data
         :param suppressWarnings: Stop printing warnings if not connected to other application
+        :param decodeRX: When True received data is decoded to a string, when False the raw bytes are returned (needed for the binary protocol in SafetyProtocol.py)
+        :param ringSlots: When > 0 datagrams are received into a UdpRing of this many slots instead of the single dataRX slot (read them with ReceiveBatch)
+        :param slotSize: largest datagram accepted by the ring, in bytes
+        :param rcvBufSize: kernel receive buffer size (SO_RCVBUF) in bytes, None keeps the system default
         """
 
         import socket
@@ -24,13 +147,23 @@ class UdpComms():
         self.udpRcvPort = portRX
         self.enableRX = enableRX
         self.suppressWarnings = suppressWarnings # when true warnings are suppressed
+        self.decodeRX = decodeRX
         self.isDataReceived = False
         self.dataRX = None
+        self.nonBlocking = False
+        self.received = 0 # datagrams received by the thread
+        self.overwritten = 0 # datagrams replaced by a newer one before ReadReceivedData read them
+        self.rxTime = None # time.monotonic() when dataRX was received
+        self.lastRxTime = None # receive time of the data last returned by ReadReceivedData
 
         # Connect via UDP
         self.udpSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # internet protocol, udp (DGRAM) socket
         self.udpSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # allows the address/port to be reused immediately instead of it being stuck in the TIME_WAIT state waiting for late packets to arrive.
+        if rcvBufSize:
+            self.udpSock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvBufSize)
+        self.rcvBufSize = self.udpSock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) # Linux reports double the requested size
         self.udpSock.bind((udpIP, portRX))
+        self.ring = UdpRing(ringSlots, slotSize) if ringSlots > 0 else None
 
         # Create Receiving thread if required
         if enableRX:
@@ -45,9 +178,13 @@ class UdpComms():
         # Function to close socket
         self.udpSock.close()
 
-    def SendData(self, strToSend):
-        # Use this function to send string to C#
-        self.udpSock.sendto(bytes(strToSend,'utf-8'), (self.udpIP, self.udpSendPort))
+    def SendData(self, strToSend, address=None):
+        # Use this function to send string to C# (to address if given, e.g. the sender of a request)
+        self.udpSock.sendto(bytes(strToSend,'utf-8'), address or (self.udpIP, self.udpSendPort))
+
+    def SendBytes(self, dataToSend, address=None):
+        # Use this function to send binary data (bytes, bytearray or memoryview) to C#
+        self.udpSock.sendto(dataToSend, address or (self.udpIP, self.udpSendPort))
 
     def ReceiveData(self):
         """
@@ -57,7 +194,7 @@ class UdpComms():
             - Warning: Not connected to C# application yet. Warning can be suppressed by setting suppressWarning=True in constructor
             - Error: If data receiving procedure or conversion to string goes wrong
             - Error: If user attempts to use this without enabling RX
-        :return: returns None on failure or the received string on success
+        :return: returns None on failure or the received string (bytes if decodeRX is False) on success
         """
         if not self.enableRX: # if RX is not enabled, raise error
             raise ValueError("Attempting to receive data without enabling this setting. Ensure this is enabled from the constructor")
@@ -65,17 +202,95 @@ class UdpComms():
         data = None
         try:
             data, _ = self.udpSock.recvfrom(1024)
-            data = data.decode('utf-8')
-        except WindowsError as e:
-            if e.winerror == 10054: # An error occurs if you try to receive before connecting to other application
+            if self.decodeRX:
+                data = data.decode('utf-8')
+        except ConnectionResetError: # WinError 10054: An error occurs if you try to receive before connecting to other application
+            if not self.suppressWarnings:
+                print("Are You connected to the other application? Connect to it!")
+        except (OSError, UnicodeDecodeError):
+            raise ValueError("Unexpected Error. Are you sure that the received data can be converted to a string")
+
+        return data
+
+    def ReceiveAvailable(self, maxMessages=1024):
+        """
+        Non-blocking receive for event-driven callers (e.g. waiting on udpSock with selectors)
+        Use with enableRX=False so no receive thread competes for the socket
+        Returns every datagram already queued on the socket, oldest first
+        :param maxMessages: upper bound on the number of datagrams returned by one call
+        :return: list of (data, address, receive time from time.monotonic())
+        """
+        import time
+
+        if not self.nonBlocking:
+            self.udpSock.setblocking(False)
+            self.nonBlocking = True
+
+        messages = []
+        while len(messages) < maxMessages:
+            try:
+                data, address = self.udpSock.recvfrom(1024)
+            except BlockingIOError: # nothing left in the socket buffer
+                break
+            except ConnectionResetError: # Windows reports an unreachable peer (10054) on the next receive
                 if not self.suppressWarnings:
                     print("Are You connected to the other application? Connect to it!")
-                else:
-                    pass
-            else:
-                raise ValueError("Unexpected Error. Are you sure that the received data can be converted to a string")
+                continue
+            if self.decodeRX:
+                data = data.decode('utf-8')
+            messages.append((data, address, time.monotonic()))
 
-        return data
+        return messages
+
+    def ReceiveBatch(self, maxMessages=1024, timeout=0):
+        """
+        High-rate receive through the ring (requires ringSlots > 0)
+        Without the receive thread, datagrams queued on the socket are first drained into the ring.
+        The returned memoryviews point into the ring and are reused after the next call, so copy
+        (bytes(view)) anything kept longer. Data is never decoded here.
+        :param maxMessages: upper bound on the number of datagrams returned by one call
+        :param timeout: with the receive thread, seconds to wait if nothing is pending
+        :return: list of (memoryview, address, receive time from time.monotonic()), oldest first
+        """
+        if self.ring is None:
+            raise ValueError("Receive ring is disabled. Set ringSlots in the constructor")
+
+        self.ring.Release()
+        if not self.enableRX:
+            if not self.nonBlocking:
+                self.udpSock.setblocking(False)
+                self.nonBlocking = True
+            self.ring.Fill(self.udpSock, maxMessages)
+            timeout = 0
+        return self.ring.Read(maxMessages, timeout)
+
+    def ReceiveStats(self):
+        """
+        Receive counters: ring statistics (or the single slot counters) and, on Linux, datagrams
+        the kernel dropped because the socket buffer was full
+        :return: dict of counters
+        """
+        if self.ring is not None:
+            stats = self.ring.Stats()
+        else:
+            stats = {'received': self.received, 'overwritten': self.overwritten}
+        stats['kernel_drops'] = self.KernelDrops()
+        stats['rcvbuf'] = self.rcvBufSize
+        return stats
+
+    def KernelDrops(self):
+        # Drop counter of this socket from /proc/net/udp (last column, matched by inode); None elsewhere
+        import os
+        try:
+            inode = str(os.fstat(self.udpSock.fileno()).st_ino)
+            with open('/proc/net/udp') as f:
+                for line in f.readlines()[1:]:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        return int(fields[-1])
+        except (OSError, IndexError, ValueError):
+            pass
+        return None
 
     def ReadUdpThreadFunc(self): # Should be called from thread
         """
@@ -88,8 +303,18 @@ class UdpComms():
 
         self.isDataReceived = False # Initially nothing received
 
+        import time
+
+        if self.ring is not None: # lossless mode: block for a datagram, then drain the socket into the ring
+            while True:
+                self.ring.Fill(self.udpSock, wait=True)
+
         while True:
             data = self.ReceiveData()  # Blocks (in thread) until data is returned (OR MAYBE UNTIL SOME TIMEOUT AS WELL)
+            if self.isDataReceived: # previous data was never read
+                self.overwritten += 1
+            self.received += 1
+            self.rxTime = time.monotonic()
             self.dataRX = data # Populate AFTER new data is received
             self.isDataReceived = True
             # When it reaches here, data received is available
@@ -104,9 +329,19 @@ class UdpComms():
 
         data = None
 
+        if self.ring is not None: # oldest datagram from the ring, copied so it outlives the slot
+            batch = self.ring.Read(1)
+            if batch:
+                view, _, self.lastRxTime = batch[0]
+                data = view.tobytes()
+                if self.decodeRX:
+                    data = data.decode('utf-8')
+            return data
+
         if self.isDataReceived: # if data has been received
             self.isDataReceived = False
             data = self.dataRX
+            self.lastRxTime = self.rxTime
             self.dataRX = None # Empty receive buffer
 
         return data
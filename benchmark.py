@@ -0,0 +1,261 @@
+# Benchmark suite for the terrain hazard pipeline
+#
+# Times every stage of the server pipeline (crop, resize, slope, roughness, classification,
+# morphology, contour/centroid and distance-transform site selection), the pyramid based conservative hazard
+# map and the full TerrainProcess on synthetic DEMs, and N landers' FOVs processed one by one against
+# TerrainProcessBatch, reports latency percentiles and allocations, and stores the results as a JSON baseline:
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --compare bench.json       # exit code 1 if any stage regressed
+#   python benchmark.py --legacy                   # also check parity with generic_filter (exit code 1 if not)
+#
+# Runs offline on a CPU-only machine; no Unity project or DEM files are needed.
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import server
+from DEMTiles import TiledDEM
+from DEMPyramid import DEMPyramid
+from HazardMap import (calculate_slope, calculate_roughness, classify_safety, postprocess_safety, compute_safety_map,
+                       compute_safety_map_batch)
+
+
+def synthetic_dem(size, seed=0):
+    # Smooth rolling terrain with scattered boulders and a few craters (float32, like the GeoTIFF DEMs)
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    dem = 3 * np.sin(xx / 25.0) * np.cos(yy / 30.0) + 0.002 * (xx + yy)
+    dem += (rng.random((size, size)) < 0.003) * rng.normal(0, 1.5, (size, size))
+    for _ in range(max(1, size // 256)):
+        cx, cy, r = rng.integers(0, size), rng.integers(0, size), rng.integers(5, 40)
+        dist = np.hypot(xx - cx, yy - cy)
+        dem -= np.where(dist < r, 2.0 * (1 - (dist / r) ** 2), 0)
+    return dem.astype(np.float32)
+
+
+def legacy_roughness(dem_array):
+    # Original per-pixel generic_filter implementation, kept as a reference point
+    from scipy.ndimage import generic_filter
+
+    def calculate_roughness_pixel(arr):
+        central_pixel = arr[len(arr) // 2]
+        return np.max(np.abs(arr - central_pixel))
+
+    return generic_filter(dem_array, calculate_roughness_pixel, size=3)
+
+
+def parity_dems(seed=0):
+    # DEMs the vectorized pipeline must reproduce exactly: float terrain, integer elevations and voids (NaN)
+    rng = np.random.default_rng(seed)
+    dem = synthetic_dem(96, seed)
+    voids = dem.copy()
+    voids[rng.integers(0, 96, 20), rng.integers(0, 96, 20)] = np.nan
+    voids[0, 5] = voids[40:43, 60] = voids[-1, -1] = np.nan
+    single = np.zeros((16, 16), dtype=np.float32)
+    single[7, 7] = np.nan
+    return {'float32': dem, 'int16': (dem * 100).astype(np.int16), 'float32_voids': voids,
+            'float64_voids': voids.astype(np.float64), 'single_void': single}
+
+
+def check_parity(pixel_sizes=(1.0, 2.0, 5.0)):
+    # Roughness and safety maps (single and batched) against the generic_filter implementation
+    failures = []
+    for name, dem in parity_dems().items():
+        expected = legacy_roughness(dem)
+        if not np.array_equal(calculate_roughness(dem), expected, equal_nan=dem.dtype.kind == 'f'):
+            failures.append('roughness/%s' % name)
+        for pixel_size in pixel_sizes:
+            safety = postprocess_safety(classify_safety(calculate_slope(dem, pixel_size), expected, pixel_size), pixel_size)
+            if not np.array_equal(compute_safety_map(dem, pixel_size), safety):
+                failures.append('safety/%s/px=%g' % (name, pixel_size))
+            if not np.array_equal(compute_safety_map_batch(np.stack([dem, dem]), [pixel_size] * 2)[1], safety):
+                failures.append('safety_batch/%s/px=%g' % (name, pixel_size))
+    print('generic_filter parity: %s' % (', '.join(failures) + ' differ' if failures else 'ok'))
+    return failures
+
+
+def measure(fn, repeat, warmup=3):
+    # Latency percentiles (ms) over repeat calls and allocations of a single traced call
+    for _ in range(warmup):
+        fn()
+
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples[i] = (time.perf_counter_ns() - start) / 1e6
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+        'alloc_peak_bytes': int(peak),
+        'alloc_blocks': int(blocks),
+    }
+
+
+def stage_cases(dem, fov, pyramid):
+    # Build (name, callable) pairs for every stage of one FOV, with inputs prepared up front
+    size = dem.shape[0]
+    fovX = fovY = (size - fov) // 2
+    tiled = TiledDEM(dem)
+
+    cropped = server.crop_dem(tiled, fovX, fovY, fov)
+    resized, pixel_size_x = server.resize_dem(cropped, (64, 64), 1)
+    slope = calculate_slope(resized, pixel_size_x)
+    roughness = calculate_roughness(resized)
+    safety = classify_safety(slope, roughness, pixel_size_x)
+    processed = postprocess_safety(safety, pixel_size_x)
+
+    def terrain_process(dem_pyramid=None):
+        server.dem_array = tiled
+        server.dem_pyramid = dem_pyramid
+        server.TerrainProcess(fovX, fovY, fov, server.LanderState())
+
+    cases = [
+        ('crop_dem', lambda: server.crop_dem(tiled, fovX, fovY, fov)),
+        ('resize_dem', lambda: server.resize_dem(cropped, (64, 64), 1)),
+        ('slope', lambda: calculate_slope(resized, pixel_size_x)),
+        ('roughness', lambda: calculate_roughness(resized)),
+        ('classify_safety', lambda: classify_safety(slope, roughness, pixel_size_x)),
+        ('postprocess_safety', lambda: postprocess_safety(safety, pixel_size_x)),
+        ('select_site', lambda: server.select_site(processed, fovX, fovY, pixel_size_x, method='contour')),
+        ('select_site_distance', lambda: server.select_site(processed, fovX, fovY, pixel_size_x, method='distance')),
+        ('landing_sites_k5', lambda: server.landing_sites(processed, fovX, fovY, pixel_size_x, 5)),
+        ('TerrainProcess', terrain_process),
+    ]
+    if fov >= server.pyramid_min_size:
+        cases += [
+            ('pyramid_bounds', lambda: pyramid.Bounds(fovY, fovY + fov, fovX, fovX + fov)),
+            ('TerrainProcess_pyramid', lambda: terrain_process(pyramid)),
+        ]
+    return cases, resized
+
+
+def batch_cases(dem, fov, count, seed=0):
+    # count FOVs of this size scattered over the DEM: a TerrainProcess loop against one TerrainProcessBatch call
+    tiled = TiledDEM(dem)
+    rng = np.random.default_rng(seed)
+    fovs = [(int(x), int(y), fov) for x, y in rng.integers(0, dem.shape[0] - fov + 1, (count, 2))]
+
+    def loop():
+        server.dem_array = tiled
+        server.dem_pyramid = None
+        for fovX, fovY, size in fovs:
+            server.TerrainProcess(fovX, fovY, size, server.LanderState())
+
+    def batch():
+        server.dem_array = tiled
+        server.dem_pyramid = None
+        server.TerrainProcessBatch(fovs)
+
+    return [('TerrainProcess_loop/n=%d' % count, loop), ('TerrainProcessBatch/n=%d' % count, batch)]
+
+
+def run(dem_sizes, fov_sizes, repeat, legacy=False, batch_sizes=()):
+    server.enable_cache(0)
+    results = {}
+    for dem_size in dem_sizes:
+        dem = synthetic_dem(dem_size)
+        pyramid = DEMPyramid(dem)
+        for fov in fov_sizes:
+            if fov > dem_size:
+                continue
+            cases, resized = stage_cases(dem, fov, pyramid)
+            if legacy:
+                cases.append(('roughness_generic_filter', lambda: legacy_roughness(resized)))
+            for name, fn in cases:
+                key = '%s/dem=%d/fov=%d' % (name, dem_size, fov)
+                results[key] = measure(fn, repeat)
+                print('%-45s p50 %8.3f ms  p99 %8.3f ms  peak %9d B' % (
+                    key, results[key]['p50_ms'], results[key]['p99_ms'], results[key]['alloc_peak_bytes']))
+            for count in batch_sizes:
+                for name, fn in batch_cases(dem, fov, count):
+                    key = '%s/dem=%d/fov=%d' % (name, dem_size, fov)
+                    results[key] = measure(fn, max(5, repeat // 10), warmup=1)
+                    results[key]['per_map_us'] = results[key]['p50_ms'] * 1e3 / count
+                    print('%-45s p50 %8.3f ms  %8.1f us/map' % (key, results[key]['p50_ms'], results[key]['per_map_us']))
+    return results
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    # Return the keys whose p50 latency grew by more than threshold (ratio) and min_delta_ms against the baseline
+    regressions = []
+    print('\n%-45s %10s %10s %7s' % ('stage', 'base p50', 'new p50', 'ratio'))
+    for key, new in results.items():
+        old = baseline['results'].get(key)
+        if old is None:
+            continue
+        ratio = new['p50_ms'] / old['p50_ms'] if old['p50_ms'] > 0 else float('inf')
+        regressed = ratio > threshold and new['p50_ms'] - old['p50_ms'] > min_delta_ms
+        flag = '  REGRESSION' if regressed else ''
+        print('%-45s %10.3f %10.3f %7.2f%s' % (key, old['p50_ms'], new['p50_ms'], ratio, flag))
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the terrain hazard pipeline on synthetic DEMs")
+    parser.add_argument('--dem-sizes', type=int, nargs='+', default=[1024, 4096], help="synthetic DEM edge lengths")
+    parser.add_argument('--fov-sizes', type=int, nargs='+', default=[64, 256, 1024], help="FOV sizes in DEM pixels")
+    parser.add_argument('--repeat', type=int, default=50, help="timed calls per stage")
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=[32, 256],
+                        help="lander counts for the TerrainProcess loop vs TerrainProcessBatch comparison")
+    parser.add_argument('--legacy', action='store_true',
+                        help="also time the original generic_filter roughness and check parity with it")
+    parser.add_argument('--output', default=None, help="write results to this JSON file")
+    parser.add_argument('--compare', default=None, help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="p50 ratio counted as a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=0.02,
+                        help="ignore p50 increases smaller than this (timer noise on tiny stages)")
+    args = parser.parse_args()
+
+    failures = check_parity() if args.legacy else []
+    results = run(args.dem_sizes, args.fov_sizes, args.repeat, args.legacy, args.batch_sizes)
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print('\n%d stage(s) regressed beyond %.2fx' % (len(regressions), args.threshold))
+            sys.exit(1)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,26 +8,139 @@
 
 # Example of a Python UDP server
 
-import UdpComms as U
 import time
+process_start = time.perf_counter() # start-up is timed from here, see startup below
+
+import UdpComms as U
+import argparse
+import itertools
+import selectors
+import threading
 import math
+import os
+import signal
+import sys
 
-#safety map imports
-import rasterio
+#safety map imports (rasterio is only imported when a GeoTIFF is opened, see DEMTiles.py)
 import numpy as np
-import matplotlib.pyplot as plt
-from rasterio.windows import Window
-from scipy.ndimage import generic_filter, median_filter, minimum_filter #, maximum_filter
 import cv2
-
-# Create UDP socket to use for sending (and receiving)
-sock = U.UdpComms(udpIP="127.0.0.1", portTX=8000, portRX=8001, enableRX=True, suppressWarnings=True)
-
-# load dataset
-# Load the DEM array
+from HazardMap import calculate_slope, calculate_roughness, classify_safety, postprocess_safety, rank_landing_sites
+from HazardMap import compute_conservative_safety_map, compute_safety_map_batch, rank_landing_sites_batch
+from DEMTiles import TiledDEM
+from DEMPyramid import DEMPyramid, write_pyramid
+from HazardCache import HazardCache
+from HazardPrefetch import HazardPrefetcher
+from LandingAtlas import LandingAtlas
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import SafetyProtocol as SP
+from ServerMetrics import ServerMetrics
+from ShmComms import ShmServer
+from TelemetryLog import TelemetryWriter, TRANSPORT_BINARY, TRANSPORT_SHM, TRANSPORT_TEXT
+
+# Start-up timing in milliseconds since process_start, printed with "server active" and exported as a gauge
+startup = {'imports_ms': (time.perf_counter() - process_start) * 1e3, 'dem_ms': None, 'ready_ms': None,
+           'first_reply_ms': None}
+
+# Loaded by load_dem() when the server starts
 input_dem_path = 'DEMS/dem1.tif'
-with rasterio.open(input_dem_path) as src:
-    dem_array = src.read(1)  # Read the first band
+dem_array = None
+
+# Optional FOV-keyed hazard map cache, set up by enable_cache()
+hazard_cache = None
+
+# Optional speculative computation of the next FOVs of landers that send their velocity, set up by enable_prefetch()
+prefetcher = None
+
+# Optional min/max elevation pyramid used for FOVs of at least pyramid_min_size pixels, set up by enable_pyramid()
+# (DEMPyramid.Cells needs a window of at least two pixels per cell of the 64x64 hazard grid)
+dem_pyramid = None
+PYRAMID_MIN_FOV = 2 * 64
+pyramid_min_size = PYRAMID_MIN_FOV
+
+# Optional precomputed landing-site atlas, set up by enable_atlas()
+landing_atlas = None
+atlas_interpolate = False
+
+# Landing site selection: 'contour' (centroid of the largest safe blob) or 'distance' (most inscribed safe point),
+# and how many ranked candidate sites replies carry (0 = none), set up by enable_site_ranking()
+site_method = 'contour'
+site_candidates = 0
+
+# Optional append-only log of every answered request (see TelemetryLog.py), set up by enable_telemetry()
+telemetry = None
+
+# Preallocated encoder for binary safety map replies
+reply_encoder = SP.ReplyEncoder(64, 64)
+
+# Message counters of the serving loop
+counters = {'received': 0, 'coalesced': 0, 'expired': 0, 'replied': 0, 'errors': 0}
+counters_lock = threading.Lock()
+
+def count(name, n=1):
+    with counters_lock:
+        counters[name] += n
+
+# Per-stage latency histograms, counters and cache gauges (always on, exported with --metrics-port/--metrics-json)
+metrics = ServerMetrics(counters)
+metrics.AddGauge('dem_tiles', lambda: dem_array.Stats() if dem_array is not None else {})
+metrics.AddGauge('hazard_cache', lambda: hazard_cache.Stats() if hazard_cache is not None else {})
+metrics.AddGauge('startup', lambda: startup)
+metrics.AddGauge('prefetch', lambda: prefetcher.Stats() if prefetcher is not None else {})
+metrics.AddGauge('dem_pyramid', lambda: dem_pyramid.Stats() if dem_pyramid is not None else {})
+metrics.AddGauge('telemetry', lambda: telemetry.Stats() if telemetry is not None else {})
+
+def load_dem(path):
+    # Open the DEM for windowed reads; only tiles overlapping the FOV are decoded and cached
+    global dem_array
+    dem_array = TiledDEM(path, tileSize=256, maxCacheBytes=256 * 1024 * 1024)
+    return dem_array
+
+def enable_cache(max_entries=1024, ttl=None, quantization=1, reuse_tolerance=0.0):
+    global hazard_cache
+    if max_entries <= 0:
+        hazard_cache = None
+    else:
+        hazard_cache = HazardCache(compute_hazard_map, maxEntries=max_entries, ttl=ttl,
+                                   quantization=quantization, reuseTolerance=reuse_tolerance)
+    return hazard_cache
+
+def enable_prefetch(max_horizon=0, cpu_budget=1.0):
+    # Prefetched maps are stored in (and served from) the hazard cache, so it has to be enabled
+    global prefetcher
+    if max_horizon <= 0 or hazard_cache is None:
+        prefetcher = None
+    else:
+        prefetcher = HazardPrefetcher(hazard_cache, getFOV, maxHorizon=max_horizon, cpuBudget=cpu_budget)
+    return prefetcher
+
+def enable_pyramid(path, min_size=PYRAMID_MIN_FOV):
+    # Memory-map the pyramid in path, building it from the loaded DEM first (in row strips) if the directory has none
+    global dem_pyramid, pyramid_min_size
+    if min_size < PYRAMID_MIN_FOV:
+        raise ValueError("Pyramid FOVs must be at least %d pixels wide, got %d" % (PYRAMID_MIN_FOV, min_size))
+    if path and not os.path.exists(os.path.join(path, 'index.json')):
+        write_pyramid(lambda row0, row1: dem_array[row0:row1, 0:dem_array.shape[1]], dem_array.shape, path)
+    dem_pyramid = DEMPyramid(path) if path else None
+    pyramid_min_size = min_size
+    return dem_pyramid
+
+def enable_atlas(path, interpolate=False):
+    global landing_atlas, atlas_interpolate
+    landing_atlas = LandingAtlas(path) if path else None
+    atlas_interpolate = interpolate
+    return landing_atlas
+
+def enable_telemetry(path, metadata=None, buffer_records=4096):
+    global telemetry
+    if telemetry is not None:
+        telemetry.Close()
+    telemetry = TelemetryWriter(path, metadata, bufferRecords=buffer_records) if path else None
+    return telemetry
+
+def enable_site_ranking(method='contour', candidates=0):
+    global site_method, site_candidates
+    site_method = method
+    site_candidates = candidates
 
 def getFOV(posx, posy, posz):
     width = posy * math.tan(math.pi/12)
@@ -48,82 +161,186 @@ def resize_dem(dem_array, new_size, original_pixel_size):
     
     return resized_dem, new_pixel_size_x
 
-# Function to calculate roughness for a neighborhood
-def calculate_roughness(arr, pixel_size):
-    central_pixel = arr[len(arr) // 2]  # Get the central pixel value
-    max_difference = np.max(np.abs(arr - central_pixel))   # Calculate the maximum difference
-    return max_difference
+def compute_hazard_map(fovX, fovY, size):
+    """
+    Crop, resize and classify one FOV; does not depend on the lander, so results can be cached
+    :return: (processed safety map or None if the FOV is outside the DEM, pixel size, cropped shape)
+    """
+    if dem_pyramid is not None and size >= pyramid_min_size:
+        # Same window as crop_dem's slicing, classified from the elevation bounds of each cell
+        row0, row1, _ = slice(fovY, fovY + size).indices(dem_array.shape[0])
+        col0, col1, _ = slice(fovX, fovX + size).indices(dem_array.shape[1])
+        shape = (max(0, row1 - row0), max(0, col1 - col0))
+        if min(shape) >= pyramid_min_size:
+            t0 = time.perf_counter()
+            zmin, zmax = dem_pyramid.Bounds(row0, row1, col0, col1, 64)
+            t1 = time.perf_counter()
+            pixel_size_x = shape[1] / 64
+            safety_map_processed = compute_conservative_safety_map(zmin, zmax, pixel_size_x)
+            metrics.Observe('pyramid', t1 - t0)
+            metrics.Observe('conservative_map', time.perf_counter() - t1)
+            return safety_map_processed, pixel_size_x, shape
 
-# Function to classify safety based on slope and roughness
-def classify_safety(slope, roughness, pixel_size_x):
-    safe_mask = np.logical_and(slope < 5, roughness < pixel_size_x)
-    return safe_mask
-
-# Function to apply post-processing steps
-def postprocess_safety(safety_map, pixel_size_x):
-    # Define the kernel for morphological operations
-    kernel_size = max(3, int(15/pixel_size_x))  # Adjust as needed
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_size, kernel_size))
-
-    # Perform opening operation
-    safety_map_opened = cv2.morphologyEx(safety_map.astype(np.uint8), cv2.MORPH_OPEN, kernel)
-
-    return safety_map_opened
-
-prev_cx = None
-prev_cy = None
-prev_global_cx = None
-prev_global_cy = None
-
-def TerrainProcess(fovX, fovY, size):
-    global prev_cx, prev_cy, prev_global_cx, prev_global_cy
-    
-    if size == 0:
-        # If no contour is found, return previous values
-        if prev_cx is not None and prev_cy is not None and prev_global_cx is not None and prev_global_cy is not None:
-            return np.zeros((64, 64), dtype=np.uint8), prev_cx, prev_cy, prev_global_cx, prev_global_cy
-        else:
-            # If there are no previous values, return zeros
-            return np.zeros((64, 64), dtype=np.uint8), 0, 0, 0, 0
-        
     # Step 1: Crop the DEM array
+    t0 = time.perf_counter()
     cropped_dem = crop_dem(dem_array, fovX, fovY, size)
-
-
-    if ( len(cropped_dem) != 0):
-        # Step 2: Resize the cropped DEM array
-        resized_dem, pixel_size_x = resize_dem(cropped_dem, (64, 64), 1)
-    else:
-        if prev_cx is not None and prev_cy is not None and prev_global_cx is not None and prev_global_cy is not None:
-            return np.zeros((64, 64), dtype=np.uint8), prev_cx, prev_cy, prev_global_cx, prev_global_cy
+    t1 = time.perf_counter()
+    metrics.Observe('crop', t1 - t0)
+    if cropped_dem.size == 0:
+        return None, 0, cropped_dem.shape
+
+    # Step 2: Resize the cropped DEM array
+    resized_dem, pixel_size_x = resize_dem(cropped_dem, (64, 64), 1)
+    t2 = time.perf_counter()
+    metrics.Observe('resize', t2 - t1)
+
+    # Slope, roughness, safety classification and opening (see HazardMap.compute_safety_map)
+    slope_deg = calculate_slope(resized_dem, pixel_size_x)
+    t3 = time.perf_counter()
+    roughness_array = calculate_roughness(resized_dem)
+    t4 = time.perf_counter()
+    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    t5 = time.perf_counter()
+    safety_map_processed = postprocess_safety(safety_map, pixel_size_x)
+    t6 = time.perf_counter()
+    metrics.Observe('slope', t3 - t2)
+    metrics.Observe('roughness', t4 - t3)
+    metrics.Observe('classify', t5 - t4)
+    metrics.Observe('morphology', t6 - t5)
+
+    return safety_map_processed, pixel_size_x, cropped_dem.shape
+
+def sample_indices(start, length, out_size=64):
+    # DEM pixel each output cell samples along one axis, as cv2.resize INTER_NEAREST picks it: floor(j * (1 / scale))
+    # start and length may be (N,) arrays of windows, giving (N, out_size) indices
+    start = np.asarray(start, dtype=np.int64)[..., None]
+    length = np.asarray(length, dtype=np.int64)[..., None]
+    index = np.floor(np.arange(out_size) * (1.0 / (out_size / length))).astype(np.int64)
+    return start + np.minimum(index, length - 1)
+
+def compute_hazard_maps(fovs):
+    """
+    compute_hazard_map for many FOVs: the resampled patches are gathered straight from the DEM into one
+    (N, 64, 64) stack and classified together (see HazardMap.compute_safety_map_batch)
+    FOVs served from the pyramid are computed one by one.
+    :param fovs: sequence of (fovX, fovY, size)
+    :return: list with the compute_hazard_map result of every FOV
+    """
+    results = [None] * len(fovs)
+    windows = []
+    for i, (fovX, fovY, size) in enumerate(fovs):
+        if dem_pyramid is not None and size >= pyramid_min_size:
+            results[i] = compute_hazard_map(fovX, fovY, size)
+            continue
+        # Same window as crop_dem's slicing
+        row0, row1, _ = slice(fovY, fovY + size).indices(dem_array.shape[0])
+        col0, col1, _ = slice(fovX, fovX + size).indices(dem_array.shape[1])
+        shape = (max(0, row1 - row0), max(0, col1 - col0))
+        if shape[0] == 0 or shape[1] == 0:
+            results[i] = (None, 0, shape)
         else:
-            # If there are no previous values, return zeros
-            return np.zeros((64, 64), dtype=np.uint8), 0, 0, 0, 0
+            windows.append((i, row0, col0, shape))
+    if not windows:
+        return results
+
+    t0 = time.perf_counter()
+    _, row0, col0, shapes = zip(*windows)
+    heights, widths = zip(*shapes)
+    patches = dem_array.Gather(sample_indices(row0, heights), sample_indices(col0, widths))
+    pixel_sizes = [shape[1] / 64 for _, _, _, shape in windows]
+    t1 = time.perf_counter()
+    safety_maps = compute_safety_map_batch(patches, pixel_sizes)
+    metrics.Observe('gather_batch', t1 - t0)
+    metrics.Observe('classify_batch', time.perf_counter() - t1)
+
+    for (i, _, _, shape), safety_map, pixel_size_x in zip(windows, safety_maps, pixel_sizes):
+        results[i] = (safety_map, pixel_size_x, shape)
+    return results
+
+# Per-lander fallback centroid, returned when no safe area is found in the current FOV
+class LanderState():
+    def __init__(self):
+        self.prev_cx = None
+        self.prev_cy = None
+        self.prev_global_cx = None
+        self.prev_global_cy = None
+        self.sites = None # ranked candidates of the latest reply (see landing_sites), None when not requested
+        self.fov = None   # FOV of the latest request, None when it was answered from the atlas
+        self.computeTime = 0.0
+
+# State used when TerrainProcess is called without one (single lander)
+default_state = LanderState()
+
+def TerrainProcess(fovX, fovY, size, state=None):
+    if state is None:
+        state = default_state
+    state.sites = np.empty((0, 5)) if site_candidates > 0 else None
+
+    if size == 0:
+        # If no contour is found, return previous values (zeros if there are none)
+        return fallback_result(state)
         
-    # Calculate slope using NumPy gradient
-    dzdx, dzdy = np.gradient(resized_dem, pixel_size_x)
-    slope_rad = np.arctan(np.sqrt(dzdx**2 + dzdy**2))
+    # Steps 1-2: crop, resize and classify the FOV (served from the cache when enabled)
+    if hazard_cache is not None:
+        fovX, fovY, size, safety_map_processed, pixel_size_x = hazard_cache.Lookup(fovX, fovY, size)
+    else:
+        safety_map_processed, pixel_size_x, _ = compute_hazard_map(fovX, fovY, size)
 
-    # Convert slope to degrees
-    slope_deg = np.degrees(slope_rad)
+    if safety_map_processed is None:
+        return fallback_result(state)
 
-    # Define the size of the neighborhood (e.g., 3x3)
-    neighborhood_size = 3
+    # Rank candidate sites once; the best one is also the site when selecting by distance
+    sites = None
+    if site_candidates > 0 or site_method == 'distance':
+        t0 = time.perf_counter()
+        sites = landing_sites(safety_map_processed, fovX, fovY, pixel_size_x, max(1, site_candidates))
+        metrics.Observe('sites', time.perf_counter() - t0)
+        if site_candidates > 0:
+            state.sites = sites
 
-    # Calculate surface roughness using a moving window
-    roughness_array = generic_filter(resized_dem, calculate_roughness, size=neighborhood_size, extra_arguments=(pixel_size_x,))
+    t0 = time.perf_counter()
+    site = select_site(safety_map_processed, fovX, fovY, pixel_size_x, sites=sites)
+    metrics.Observe('contours', time.perf_counter() - t0)
 
-    # Classify safety based on slope and roughness criteria
-    safety_map = classify_safety(slope_deg, roughness_array, pixel_size_x)
+    if site is not None:
+        _, cx, cy, global_cx, global_cy = site
+
+        # Print the centroid coordinates
+        #print("Centroid coordinates (x, y):", (cx, cy, pixel_size_x))
+        #print("Global Centroid coordinates (x, y):", (global_cx, global_cy))
 
-    # Post-process the safety map
-    safety_map_processed = postprocess_safety(safety_map,pixel_size_x)   
+        # Update previous values
+        state.prev_cx = cx
+        state.prev_cy = cy
+        state.prev_global_cx = global_cx
+        state.prev_global_cy = global_cy
 
-    # Step 2: Find contours
-    contours, _ = cv2.findContours(safety_map_processed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return site
+    else:
+        # If no contour is found, return previous values (zeros if there are none)
+        return fallback_result(state)
+
+def select_site(safety_map_processed, fovX, fovY, pixel_size_x, method=None, sites=None):
+    """
+    Pick the landing site as the centroid of the largest safe blob ('contour') or as the safe point
+    farthest from any hazard ('distance'); the centroid of a concave blob can fall outside the safe area
+    :param method: 'contour' or 'distance', defaults to the server's site_method
+    :param sites: landing_sites() of this map if already computed (used by the 'distance' method)
+    :return: (safety map scaled to 0/255, cx, cy, global_cx, global_cy) or None if there is no safe area
+    """
+    if (method or site_method) == 'distance':
+        if sites is None:
+            sites = landing_sites(safety_map_processed, fovX, fovY, pixel_size_x, 1)
+        if len(sites) == 0:
+            return None
+        cx, cy, global_cx, global_cy = (int(v) for v in sites[0, :4])
+    else:
+        # Step 2: Find contours
+        contours, _ = cv2.findContours(safety_map_processed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    # Step 3: Determine the largest blob
-    if contours:
+        # Step 3: Determine the largest blob
+        if not contours:
+            return None
         largest_contour = max(contours, key=cv2.contourArea)
 
         # Step 4: Find a point in the interior of the largest blob
@@ -131,59 +348,528 @@ def TerrainProcess(fovX, fovY, size):
         cx = int(M['m10'] / M['m00'])
         cy = int(M['m01'] / M['m00'])
 
-        # reduce size
-        safety_map_processed = np.uint8((safety_map_processed  / safety_map_processed.max()) * 255)
-
         # Calculate global centroid
         global_cx = int(fovX + cx * pixel_size_x)
         global_cy = int(fovY + cy * pixel_size_x)
 
-        # Print the centroid coordinates
-        #print("Centroid coordinates (x, y):", (cx, cy, pixel_size_x))
-        #print("Global Centroid coordinates (x, y):", (global_cx, global_cy))
-
-        # Update previous values
-        prev_cx = cx
-        prev_cy = cy
-        prev_global_cx = global_cx
-        prev_global_cy = global_cy
-
-        return safety_map_processed, cx, cy, global_cx, global_cy
+    # reduce size (processed maps are 0/1, where scaling is a plain multiply)
+    peak = safety_map_processed.max()
+    if peak == 1:
+        safety_map_processed = safety_map_processed * np.uint8(255)
     else:
-        # If no contour is found, return previous values
-        if prev_cx is not None and prev_cy is not None and prev_global_cx is not None and prev_global_cy is not None:
-            return np.zeros((64, 64), dtype=np.uint8), prev_cx, prev_cy, prev_global_cx, prev_global_cy
-        else:
-            # If there are no previous values, return zeros
-            return np.zeros((64, 64), dtype=np.uint8), 0, 0, 0, 0
-
-
-
-print("server active")
-while True:
-    #sock.SendData('Sent from Python: ' + str(i)) # Send this string to other application
-    #i += 1
-
-    data = sock.ReadReceivedData() # read data
-
-    if data != None: # if NEW data has been received since last ReadReceivedData function call
-        position = [float(val) for val in data.split(",")]
-        
-        # print(data) # print new received data
-        # Print the received FOV values
-        #print("Received Position values:", position)
-        fovCoords = getFOV(position[0],position[1],position[2])
-        #print("Calculated FOV: ", fovCoords)
+        safety_map_processed = np.uint8((safety_map_processed  / peak) * 255)
+
+    return safety_map_processed, cx, cy, global_cx, global_cy
+
+def landing_sites(safety_map_processed, fovX, fovY, pixel_size_x, k):
+    """
+    Top-k maximally inscribed safe points of a processed safety map (see HazardMap.rank_landing_sites)
+    :return: (n, 5) array of cx, cy, global_cx, global_cy and clearance radius in DEM units, best first
+    """
+    return global_sites(rank_landing_sites(safety_map_processed, k), fovX, fovY, pixel_size_x)
+
+def global_sites(ranked, fovX, fovY, pixel_size_x):
+    # (n, 3) map cell sites with clearance in cells -> (n, 5) rows of landing_sites
+    sites = [(x, y, int(fovX + x * pixel_size_x), int(fovY + y * pixel_size_x), clearance * pixel_size_x)
+             for x, y, clearance in ranked.tolist()]
+    return np.array(sites).reshape(-1, 5)
+
+def fallback_result(state):
+    # Empty map with the lander's previous site (zeros if it never had one)
+    if state.prev_cx is not None and state.prev_cy is not None and state.prev_global_cx is not None and state.prev_global_cy is not None:
+        return np.zeros((64, 64), dtype=np.uint8), state.prev_cx, state.prev_cy, state.prev_global_cx, state.prev_global_cy
+    return np.zeros((64, 64), dtype=np.uint8), 0, 0, 0, 0
+
+def TerrainProcessBatch(fovs, states=None):
+    """
+    TerrainProcess for many FOVs at once, e.g. the latest request of every lander
+    Hazard maps are computed as one stack (cache misses only when the cache is enabled) and candidate
+    sites are ranked with one distance transform; contours are still found map by map.
+    :param fovs: sequence of (fovX, fovY, size)
+    :param states: LanderState of each FOV (updated like TerrainProcess does), None gives every FOV a fresh state
+    :return: list with the TerrainProcess result of every FOV
+    """
+    if states is None:
+        states = [LanderState() for _ in fovs]
+    results = [None] * len(fovs)
+    for state in states:
+        state.sites = np.empty((0, 5)) if site_candidates > 0 else None
+
+    todo = [i for i, fov in enumerate(fovs) if fov[2] != 0]
+    for i in range(len(fovs)):
+        if fovs[i][2] == 0:
+            results[i] = fallback_result(states[i])
+    if not todo:
+        return results
+
+    if hazard_cache is not None:
+        maps = hazard_cache.LookupBatch([fovs[i] for i in todo], compute_hazard_maps)
+    else:
+        maps = [(fovs[i][0], fovs[i][1], fovs[i][2], safety_map, pixel_size_x)
+                for i, (safety_map, pixel_size_x, _) in zip(todo, compute_hazard_maps([fovs[i] for i in todo]))]
 
-        landingSite, cx, cy, global_cx, global_cy = TerrainProcess(fovCoords[0], fovCoords[1], fovCoords[2])
-        
-        # Pack the processed safety map and centroid coordinates into a byte array
-        # You may need to adjust the data types depending on the size and range of values
+    valid = []
+    for i, (fovX, fovY, size, safety_map_processed, pixel_size_x) in zip(todo, maps):
+        if safety_map_processed is None:
+            results[i] = fallback_result(states[i])
+        else:
+            valid.append((i, fovX, fovY, safety_map_processed, pixel_size_x))
+
+    ranked = [None] * len(valid)
+    if valid and (site_candidates > 0 or site_method == 'distance'):
+        t0 = time.perf_counter()
+        ranked = rank_landing_sites_batch(np.stack([v[3] for v in valid]), max(1, site_candidates))
+        ranked = [global_sites(r, fovX, fovY, pixel_size_x) for r, (_, fovX, fovY, _, pixel_size_x) in zip(ranked, valid)]
+        metrics.Observe('sites_batch', time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    for (i, fovX, fovY, safety_map_processed, pixel_size_x), sites in zip(valid, ranked):
+        state = states[i]
+        if site_candidates > 0:
+            state.sites = sites
+        site = select_site(safety_map_processed, fovX, fovY, pixel_size_x, sites=sites)
+        if site is None:
+            results[i] = fallback_result(state)
+            continue
+        _, state.prev_cx, state.prev_cy, state.prev_global_cx, state.prev_global_cy = site
+        results[i] = site
+    metrics.Observe('contours_batch', time.perf_counter() - t0)
+    return results
+
+def parse_position(data):
+    """
+    Parse a position request
+    Binary messages carry a sequence number; text messages are "x,y,z" with an optional ",seq",
+    both optionally followed by the lander velocity (text: ";vx,vy,vz")
+    :return: (binary, seq or None, sender timestamp in microseconds or None, [x, y, z], velocity or None)
+    """
+    if SP.is_binary(data):
+        seq, timestamp, posx, posy, posz = SP.decode_position(data)
+        return True, seq, timestamp, [posx, posy, posz], SP.decode_velocity(data)
+
+    text, _, velocity = bytes(data).decode('utf-8').partition(";")
+    values = text.split(",")
+    if len(values) < 3:
+        raise ValueError("Expected x,y,z, got %r" % text[:32])
+    position = [float(val) for val in values[:3]]
+    seq = int(values[3]) if len(values) > 3 else None
+    velocity = [float(val) for val in velocity.split(",")[:3]] if velocity else None
+    return False, seq, None, position, velocity
+
+def process_position(position, state, velocity=None):
+    # Compute the hazard map for one lander position; runs in a worker when a pool is used
+    t0 = time.perf_counter()
+    if landing_atlas is not None:
+        entry = landing_atlas.Lookup(position[0], position[1], position[2], atlas_interpolate)
+        if entry is not None:
+            result = atlas_result(entry, state)
+            state.fov = None
+            state.computeTime = time.perf_counter() - t0
+            metrics.Observe('atlas', state.computeTime)
+            return result, state
+
+    # Print the received FOV values
+    #print("Received Position values:", position)
+    fovCoords = getFOV(position[0],position[1],position[2])
+    #print("Calculated FOV: ", fovCoords)
+
+    result = TerrainProcess(fovCoords[0], fovCoords[1], fovCoords[2], state)
+    state.fov = fovCoords
+    state.computeTime = time.perf_counter() - t0
+    metrics.Observe('terrain_process', state.computeTime)
+
+    # Start on the maps of the next positions while the lander flies there
+    if prefetcher is not None and velocity is not None:
+        prefetcher.Observe(state, position, velocity)
+    return result, state
+
+def atlas_result(entry, state):
+    # Turn an atlas entry into a TerrainProcess style result, with the same fallback to previous values
+    safety_map, site = entry
+    state.sites = None
+    if site is not None:
+        state.prev_cx, state.prev_cy, state.prev_global_cx, state.prev_global_cy = site
+        return (safety_map,) + tuple(site)
+    if state.prev_cx is not None:
+        return safety_map, state.prev_cx, state.prev_cy, state.prev_global_cx, state.prev_global_cy
+    return safety_map, 0, 0, 0, 0
+
+def send_reply(sock, binary, seq, result, encoder, address=None, sites=None):
+    t0 = time.perf_counter()
+    landingSite, cx, cy, global_cx, global_cy = result
+
+    # Binary requests are answered in binary, text requests in text (older Unity builds)
+    if binary:
+        # Pack the safety map as a bit-packed/RLE mask with the centroids, tagged with the request sequence
+        sock.SendBytes(encoder.Encode(seq, landingSite, cx, cy, global_cx, global_cy, sites=sites), address)
+    else:
         # Pack the processed safety map and centroid coordinates into a string
         data_to_send = f"{','.join(map(str, landingSite.flatten()))}"
         data_to_send = f"{data_to_send};{cx};{cy};{global_cx};{global_cy}"
-        sock.SendData(data_to_send)  # Send the string to Unity
-        #print(f"Sent data to Unity: Processed safety map and centroid coordinates ({cx}, {cy}, {global_cx}, {global_cy})")
-
-    time.sleep(1)
-
+        if seq is not None:
+            data_to_send = f"{data_to_send};{seq}"
+        if sites is not None:
+            # Candidate sites as "@cx,cy,global_cx,global_cy,clearance" fields (ignored by older parsers)
+            for s in sites:
+                data_to_send = f"{data_to_send};@{int(s[0])},{int(s[1])},{int(s[2])},{int(s[3])},{s[4]:.2f}"
+        sock.SendData(data_to_send, address)  # Send the string to Unity
+    #print(f"Sent data to Unity: Processed safety map and centroid coordinates ({cx}, {cy}, {global_cx}, {global_cy})")
+    metrics.Observe('send', time.perf_counter() - t0)
+    count('replied')
+    if startup['first_reply_ms'] is None:
+        startup['first_reply_ms'] = (time.perf_counter() - process_start) * 1e3
+        print("first reply %.0f ms after start" % startup['first_reply_ms'], flush=True)
+
+def log_request(lander, transport, seq, timestamp, position, velocity, state, result, queue, latency):
+    # Append an answered request to the telemetry log, if enabled
+    if telemetry is not None:
+        telemetry.Append(lander, transport, seq, timestamp, position, velocity, state.fov, result[1:],
+                         latency, queue, state.computeTime)
+
+def handle_request(sock, data, session=None, rx_time=None):
+    # Process one request synchronously and reply (to the session's address if given)
+    if session is None:
+        state, encoder, address, lander = default_state, reply_encoder, None, 0
+    else:
+        state, encoder, address, lander = session.state, session.encoder, session.address, session.id
+    queue = time.monotonic() - rx_time if rx_time is not None else 0.0
+    if rx_time is not None:
+        metrics.Observe('queue_age', queue)
+
+    try:
+        binary, seq, timestamp, position, velocity = parse_position(data)
+        result, _ = process_position(position, state, velocity)
+        send_reply(sock, binary, seq, result, encoder, address, state.sites)
+    except Exception as e:
+        # A malformed datagram (or a failing map) must not stop the loop serving the other landers
+        count('errors')
+        print("Request from %s failed: %r" % (address, e))
+        return
+    latency = time.monotonic() - rx_time if rx_time is not None else state.computeTime
+    if rx_time is not None:
+        metrics.Observe('request', latency)
+    log_request(lander, TRANSPORT_BINARY if binary else TRANSPORT_TEXT, seq, timestamp, position, velocity,
+                state, result, queue, latency)
+
+def request_age(rx_time):
+    # Seconds since the request was received. The sender timestamp of binary requests is not used: a
+    # remote lander's clock can be skewed by more than the deadline.
+    return time.monotonic() - rx_time
+
+def serve_polling(sock, poll_interval):
+    # Original loop: read the latest position from the receive thread and sleep between requests
+    while True:
+        data = sock.ReadReceivedData() # read data
+
+        if data != None: # if NEW data has been received since last ReadReceivedData function call
+            count('received')
+            handle_request(sock, data, rx_time=sock.lastRxTime)
+
+        time.sleep(poll_interval)
+
+# Serving state of one lander, keyed by the address its positions come from
+session_ids = itertools.count(1) # 0 is the single lander of the polling loop
+
+class ClientSession():
+    def __init__(self, address):
+        self.address = address
+        self.id = next(session_ids)
+        self.state = LanderState()
+        self.encoder = SP.ReplyEncoder(64, 64)
+        self.busy = False      # a request of this lander is being processed by the pool
+        self.pending = None    # newest request that arrived while busy (latest-wins)
+        self.lastSeen = time.monotonic()
+
+def serve_event(sock, deadline, executor=None, session_timeout=60.0):
+    """
+    Event-driven loop: wake as soon as datagrams arrive, keep only the newest position of each
+    lander (latest-wins) and drop it if it is older than the deadline by the time it would be processed
+    Each lander (client address) has its own state and replies go back to that address. With an
+    executor, landers are processed concurrently with at most one request in flight per lander.
+    :param deadline: maximum request age in seconds, 0 disables the check
+    :param executor: optional ThreadPoolExecutor/ProcessPoolExecutor, None processes inline
+    :param session_timeout: forget landers that have been silent for this many seconds
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(sock.udpSock, selectors.EVENT_READ)
+
+    sessions = {}
+    lock = threading.Lock()
+    last_purge = time.monotonic()
+
+    def expired(request):
+        data, rx_time = request
+        if deadline > 0 and request_age(rx_time) > deadline:
+            count('expired')
+            return True
+        return False
+
+    def release(session):
+        # Called when a lander's request finished: start its pending request or mark it idle
+        while True:
+            with lock:
+                request = session.pending
+                session.pending = None
+                if request is None:
+                    session.busy = False
+                    return
+            if not expired(request) and dispatch(session, request):
+                return
+
+    def dispatch(session, request):
+        # Hand a request to the pool; False if it could not be (the caller releases the session)
+        data, rx_time = request
+        queue = time.monotonic() - rx_time
+        metrics.Observe('queue_age', queue)
+        try:
+            parsed = parse_position(data)
+            future = executor.submit(process_position, parsed[3], session.state, parsed[4])
+        except Exception as e:
+            count('errors')
+            print("Request from %s failed: %r" % (session.address, e))
+            return False
+        future.add_done_callback(lambda f: finish(session, parsed, rx_time, queue, f))
+        return True
+
+    def finish(session, parsed, rx_time, queue, future):
+        binary, seq, timestamp, position, velocity = parsed
+        try:
+            result, session.state = future.result()
+            send_reply(sock, binary, seq, result, session.encoder, session.address, session.state.sites)
+            latency = time.monotonic() - rx_time
+            metrics.Observe('request', latency)
+            log_request(session.id, TRANSPORT_BINARY if binary else TRANSPORT_TEXT, seq, timestamp, position,
+                        velocity, session.state, result, queue, latency)
+        except Exception as e:
+            count('errors')
+            print("Request from %s failed: %r" % (session.address, e))
+        release(session)
+
+    while True:
+        selector.select(timeout=session_timeout)
+
+        latest = {}
+        batch = sock.ReceiveBatch() if sock.ring is not None else sock.ReceiveAvailable()
+        for data, address, rx_time in batch:
+            count('received')
+            if address in latest:
+                count('coalesced')
+            latest[address] = (data, rx_time)
+        if sock.ring is not None:
+            # Ring slots are reused by the next batch: copy only the request kept for each lander
+            latest = {address: (data.tobytes(), rx_time) for address, (data, rx_time) in latest.items()}
+
+        now = time.monotonic()
+        for address, request in latest.items():
+            session = sessions.get(address)
+            if session is None:
+                session = sessions[address] = ClientSession(address)
+            session.lastSeen = now
+
+            if executor is None:
+                if not expired(request):
+                    handle_request(sock, request[0], session, request[1])
+                continue
+
+            with lock:
+                if session.busy:
+                    if session.pending is not None:
+                        count('coalesced')
+                    session.pending = request
+                    continue
+                session.busy = True
+            if expired(request) or not dispatch(session, request):
+                release(session)
+
+        if now - last_purge > session_timeout:
+            last_purge = now
+            with lock:
+                for address in [a for a, s in sessions.items() if not s.busy and now - s.lastSeen > session_timeout]:
+                    del sessions[address]
+
+def serve_shm(transport, deadline, stop):
+    """
+    Serve co-located clients over shared memory (see ShmComms.py), next to the UDP loop
+    Each lane is one lander: only its newest request is processed (latest-wins) and requests older
+    than the deadline (since they were polled) are dropped, like in serve_event. Replies are published in
+    place, without encoding.
+    :param deadline: maximum request age in seconds, 0 disables the check
+    :param stop: threading.Event that ends the loop, checked between polls (at least every 0.1 s)
+    """
+    states = {}
+    while not stop.is_set():
+        latest = {}
+        requests = transport.Poll(timeout=0.1)
+        rx_time = time.monotonic()
+        for request in requests:
+            count('received')
+            if request[0] in latest:
+                count('coalesced')
+            latest[request[0]] = request
+
+        for lane, seq, timestamp, position, velocity in latest.values():
+            age = request_age(rx_time)
+            if deadline > 0 and age > deadline:
+                count('expired')
+                continue
+            metrics.Observe('queue_age', age)
+            state = states.get(lane)
+            if state is None:
+                state = states[lane] = LanderState()
+            try:
+                result, _ = process_position(position, state, velocity)
+                t0 = time.perf_counter()
+                transport.Publish(lane, seq, *result, sites=state.sites)
+                metrics.Observe('send', time.perf_counter() - t0)
+                count('replied')
+                latency = time.monotonic() - rx_time
+                metrics.Observe('request', latency)
+                log_request(lane, TRANSPORT_SHM, seq, timestamp, position, velocity, state, result, age, latency)
+            except Exception as e:
+                count('errors')
+                print("Shared memory request from lane %d failed: %r" % (lane, e))
+
+def init_worker(dem_path, cache_args, atlas_args, site_args, pyramid_args):
+    # Process pool initializer: open the DEM (read-only) and set up a per-process cache, atlas and site ranking
+    load_dem(dem_path)
+    enable_pyramid(*pyramid_args)
+    enable_cache(*cache_args)
+    enable_atlas(*atlas_args)
+    enable_site_ranking(*site_args)
+
+def make_executor(pool, workers, dem_path, cache_args, atlas_args=(None,), site_args=('contour', 0), pyramid_args=(None,)):
+    # Pool for concurrent hazard processing; process workers open the DEM themselves (read-only)
+    if workers <= 0:
+        return None
+    if pool == 'process':
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dem_path, cache_args, atlas_args, site_args, pyramid_args))
+    return ThreadPoolExecutor(max_workers=workers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hazard detection server for the Unity lander")
+    parser.add_argument('--dem', default=input_dem_path,
+                        help="DEM GeoTIFF to serve, or its .npy snapshot for fast start-up (see DEMTiles.py)")
+    parser.add_argument('--mode', choices=('event', 'poll'), default='event',
+                        help="event: wake on datagram arrival, poll: original sleep-based loop")
+    parser.add_argument('--deadline-ms', type=float, default=100.0,
+                        help="drop requests older than this in event mode (0 disables)")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="sleep between reads in poll mode")
+    parser.add_argument('--host', default="127.0.0.1", help="address to receive positions on")
+    parser.add_argument('--rx-port', type=int, default=8001, help="port to receive positions on")
+    parser.add_argument('--tx-port', type=int, default=8000, help="port replies are sent to in poll mode")
+    parser.add_argument('--rx-ring', type=int, default=4096,
+                        help="event mode: receive into a ring of this many preallocated slots (0 = one recvfrom per datagram)")
+    parser.add_argument('--rcvbuf', type=int, default=4 * 1024 * 1024, help="kernel socket receive buffer in bytes")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="concurrent hazard workers in event mode (0 processes requests inline)")
+    parser.add_argument('--pool', choices=('thread', 'process'), default='thread', help="worker pool type")
+    parser.add_argument('--cache-size', type=int, default=1024, help="cached hazard maps (0 disables the cache)")
+    parser.add_argument('--cache-ttl', type=float, default=None, help="seconds before a cached map expires")
+    parser.add_argument('--fov-quantization', type=int, default=1,
+                        help="snap FOV origin and size to multiples of this many pixels (1 = exact)")
+    parser.add_argument('--reuse-tolerance', type=float, default=0.0,
+                        help="reuse a cached map whose FOV contains the new one and is at most this fraction larger")
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help="precompute the maps of up to this many predicted next FOVs of landers that send their velocity "
+                             "(0 disables; needs the cache and inline or thread workers)")
+    parser.add_argument('--prefetch-cpu', type=float, default=1.0,
+                        help="CPU cores the prefetch horizon adapts to (headroom = idle share of this budget)")
+    parser.add_argument('--atlas', default=None, help="precomputed landing-site atlas directory (see LandingAtlas.py); "
+                             "its site method must match --site-method and --site-candidates is not supported")
+    parser.add_argument('--atlas-interpolate', action='store_true',
+                        help="blend atlas sites over neighbouring grid nodes")
+    parser.add_argument('--pyramid', default=None,
+                        help="min/max elevation pyramid directory (see DEMPyramid.py), built from --dem if it does not exist")
+    parser.add_argument('--pyramid-min-fov', type=int, default=PYRAMID_MIN_FOV,
+                        help="use the pyramid's conservative hazard map for FOVs at least this many pixels wide (>= %d)"
+                        % PYRAMID_MIN_FOV)
+    parser.add_argument('--site-method', choices=('contour', 'distance'), default='contour',
+                        help="landing site: centroid of the largest safe blob or the safe point farthest from hazards")
+    parser.add_argument('--site-candidates', type=int, default=0,
+                        help="append this many ranked candidate sites with clearance radii to every reply")
+    parser.add_argument('--shm', default=None,
+                        help="also serve co-located clients over this shared memory segment (see ShmComms.py)")
+    parser.add_argument('--shm-lanes', type=int, default=8, help="shared memory clients that can connect at once")
+    parser.add_argument('--telemetry', default=None,
+                        help="append every answered request to this binary log (see TelemetryLog.py)")
+    parser.add_argument('--telemetry-buffer', type=int, default=4096, help="records buffered between telemetry writes")
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve Prometheus text on http://127.0.0.1:PORT/metrics (and /metrics.json)")
+    parser.add_argument('--metrics-json', default=None, help="write periodic JSON metric snapshots to this file")
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help="seconds between JSON snapshots")
+    args = parser.parse_args()
+    if args.pyramid_min_fov < PYRAMID_MIN_FOV:
+        parser.error("--pyramid-min-fov must be at least %d (two DEM pixels per hazard map cell)" % PYRAMID_MIN_FOV)
+
+    # Create UDP socket to use for sending (and receiving); event mode reads the socket itself
+    sock = U.UdpComms(udpIP=args.host, portTX=args.tx_port, portRX=args.rx_port, enableRX=(args.mode == 'poll'),
+                      suppressWarnings=True, decodeRX=False, rcvBufSize=args.rcvbuf,
+                      ringSlots=args.rx_ring if args.mode == 'event' else 0)
+
+    # load dataset
+    t0 = time.perf_counter()
+    load_dem(args.dem)
+    startup['dem_ms'] = (time.perf_counter() - t0) * 1e3
+    enable_pyramid(args.pyramid, args.pyramid_min_fov)
+    cache_args = (args.cache_size, args.cache_ttl, args.fov_quantization, args.reuse_tolerance)
+    enable_cache(*cache_args)
+    if args.prefetch > 0 and (hazard_cache is None or (args.workers > 0 and args.pool == 'process')):
+        # Process workers have their own caches and receive copies of the lander state
+        print("--prefetch needs the hazard cache and inline or thread workers, prefetching disabled")
+    else:
+        enable_prefetch(args.prefetch, args.prefetch_cpu)
+    atlas = enable_atlas(args.atlas, args.atlas_interpolate)
+    if atlas is not None:
+        # Atlas answers must follow the same site rule as live ones and it stores no candidates
+        if args.site_candidates > 0:
+            parser.error("--site-candidates cannot be used with --atlas (the atlas stores no candidates)")
+        if atlas.siteMethod != args.site_method:
+            parser.error("--atlas was built with --site-method %s, not %s" % (atlas.siteMethod, args.site_method))
+    enable_site_ranking(args.site_method, args.site_candidates)
+    # The settings that replaying the log through TerrainProcess needs to reproduce the replies
+    enable_telemetry(args.telemetry, {
+        'dem': os.path.abspath(args.dem), 'started': time.time(), 'mode': args.mode, 'workers': args.workers,
+        'cache_size': args.cache_size, 'fov_quantization': args.fov_quantization, 'reuse_tolerance': args.reuse_tolerance,
+        'pyramid': args.pyramid and os.path.abspath(args.pyramid), 'pyramid_min_fov': args.pyramid_min_fov,
+        'atlas': args.atlas, 'site_method': args.site_method, 'site_candidates': args.site_candidates,
+        'prefetch': args.prefetch}, args.telemetry_buffer)
+
+    # Export instrumentation
+    metrics.AddGauge('udp', sock.ReceiveStats)
+    if args.metrics_port:
+        metrics.StartHttpServer(args.metrics_port)
+    if args.metrics_json:
+        metrics.StartJsonSnapshots(args.metrics_json, args.metrics_interval)
+
+    if args.shm or args.telemetry:
+        # Remove the shared memory segment and flush the telemetry log on exit, including when stopped with SIGTERM
+        def terminate(*_):
+            signal.signal(signal.SIGTERM, signal.SIG_IGN) # a repeated SIGTERM must not interrupt the cleanup
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, terminate)
+    if args.shm:
+        shm_transport = ShmServer(args.shm, lanes=args.shm_lanes)
+        metrics.AddGauge('shm', shm_transport.Stats)
+        shm_stop = threading.Event()
+        shm_thread = threading.Thread(target=serve_shm, args=(shm_transport, args.deadline_ms / 1000, shm_stop), daemon=True)
+        shm_thread.start()
+
+    startup['ready_ms'] = (time.perf_counter() - process_start) * 1e3
+    print("server active (imports %.0f ms, DEM %.0f ms, ready after %.0f ms)" % (
+        startup['imports_ms'], startup['dem_ms'], startup['ready_ms']), flush=True)
+    try:
+        if args.mode == 'event':
+            serve_event(sock, args.deadline_ms / 1000, make_executor(args.pool, args.workers, args.dem, cache_args,
+                                                                    (args.atlas, args.atlas_interpolate),
+                                                                    (args.site_method, args.site_candidates),
+                                                                    (args.pyramid, args.pyramid_min_fov)))
+        else:
+            serve_polling(sock, args.poll_interval)
+    finally:
+        if args.shm:
+            # The segment's views are released by Close: let the shm loop finish its request first
+            shm_stop.set()
+            shm_thread.join()
+            shm_transport.Close()
+        if telemetry is not None:
+            telemetry.Close()